@@ -1,22 +1,73 @@
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox
-import json
-import requests
+from tkinter import ttk, scrolledtext, messagebox, filedialog, simpledialog
 import os
 import time
 import threading
 import pickle
-from typing import Dict, Any, List
+import argparse
+from typing import Dict, Any, List, Iterator, Optional, Callable, Union
+from chat_export import ChatExporter, append_to_archive, iter_archive
+from message_store import ConversationTree, NodeTextStore
+from memory_index import ConversationMemory, APIEmbedder
+from profiling import Profiler, PROFILE_DIR
+from ui_watchdog import UIWatchdog
+from markdown_view import BlockCache, MarkdownStream, configure_tags, render_markdown
+from reasoning import (ThinkTagSplitter, ReasoningView, configure_reasoning_tags, split_think_tags,
+                       REASONING_ONLY_REPLY)
+from arena import ModelArena, summarize_benchmarks, BENCHMARK_FILE
+from sweep import ParameterSweep, SWEEP_PARAMS, SWEEP_FILE, parse_values
+from message_queue import MessageQueue
+from backends import (Backend, HTTPBackend, FakeBackend, LocalServerBackend, DEFAULT_BASE_URL,
+                      LOCAL_BASE_URL, CANCELLED_ERROR, CancelToken, cached_tokens)
+
+# 开启性能分析时包装的方法
+CLIENT_SPANS = ["make_request", "save_state", "write_state", "load_state"]
+WINDOW_SPANS = ["handle_response", "load_chat_history", "flush_stream", "finish_stream"]
+
+# 请求参数的固定顺序，消息列表放在最后
+REQUEST_PARAM_ORDER = ["model", "max_tokens", "temperature", "top_p", "top_k", "frequency_penalty",
+                       "n", "stop", "stream", "stream_options", "messages"]
+
+# 可用的模型列表 - 根据文档更新
+MODEL_OPTIONS = [
+    "Qwen/QwQ-32B", 
+    "Pro/deepseek-ai/DeepSeek-R1", 
+    "Pro/deepseek-ai/DeepSeek-V3", 
+    "deepseek-ai/DeepSeek-R1", 
+    "deepseek-ai/DeepSeek-V3",
+    "deepseek-ai/DeepSeek-R1-Distill-Qwen-32B",
+    "deepseek-ai/DeepSeek-R1-Distill-Qwen-14B",
+    "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
+    "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B",
+    "Pro/deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
+    "Pro/deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B",
+    "deepseek-ai/DeepSeek-V2.5",
+    "Qwen/Qwen2.5-72B-Instruct-128K",
+    "Qwen/Qwen2.5-72B-Instruct",
+    "Qwen/Qwen2.5-32B-Instruct",
+    "Qwen/Qwen2.5-14B-Instruct",
+    "Qwen/Qwen2.5-7B-Instruct",
+    "Qwen/Qwen2.5-Coder-32B-Instruct",
+    "Qwen/Qwen2.5-Coder-7B-Instruct",
+    "Qwen/Qwen2-7B-Instruct",
+    "Qwen/Qwen2-1.5B-Instruct"
+]
 
 class AIClient:
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.base_url = "https://api.siliconflow.cn/v1"
-        self.headers = {
+        # 远程接口、本地服务和调试模式各自使用一个后端
+        self.http_backend = HTTPBackend(DEFAULT_BASE_URL, {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
-        }
-        self.messages: List[Dict[str, str]] = []
+        })
+        self.fake_backend = FakeBackend()
+        self.local_backend: Optional[LocalServerBackend] = None
+        # 对话树，按列表访问时得到当前分支的消息；较早的消息内容会转存到磁盘
+        self.messages = ConversationTree()
+        # 推理模型的思考过程，按助手消息的节点 id 单独保存，不会出现在之后的请求中；
+        # 思考过程通常比回复更长，较早的同样转存到磁盘
+        self.reasoning = NodeTextStore()
         # 根据API文档添加完整参数列表
         self.parameters = {
             "model": "deepseek-ai/DeepSeek-V2.5",
@@ -27,28 +78,89 @@ class AIClient:
             "frequency_penalty": 0.5,
             "n": 1,
             "stop": None,
+            "stream": True,  # 流式输出
             "system_prompt": ""  # 增加系统提示词
         }
-        # 禁用代理设置
-        self.proxies = {
-            "http": None,
-            "https": None
-        }
         self.debug_mode = False
-        self.max_retries = 3
+        # 保存状态可能同时来自多个后台线程，较旧的快照不能覆盖较新的
+        self.state_lock = threading.Lock()
+        self.state_revision = 0
+        self.saved_revision = 0
+        # 检索记忆：只发送最近的若干条消息，更早的对话按相关度召回
+        self.context_window = 20
+        # 窗口溢出时一次前移的消息条数，期间请求前缀保持不变
+        self.context_step = 8
+        self.memory_top_k = 4
+        # 本次会话的提示词用量，用于显示缓存命中率
+        self.usage_totals = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        self.memory = ConversationMemory(APIEmbedder(self))
+    
+    # 接口地址、请求头、代理和重试次数属于远程后端
+    @property
+    def base_url(self) -> str:
+        return self.http_backend.base_url
+    
+    @base_url.setter
+    def base_url(self, value: str):
+        self.http_backend.base_url = value
+    
+    @property
+    def headers(self) -> Dict[str, str]:
+        return self.http_backend.headers
+    
+    @property
+    def proxies(self) -> Dict[str, Any]:
+        return self.http_backend.proxies
+    
+    @property
+    def max_retries(self) -> int:
+        return self.http_backend.max_retries
+    
+    @max_retries.setter
+    def max_retries(self, value: int):
+        self.http_backend.max_retries = value
         
     def save_state(self, filename="ai_client_state.pkl"):
         """保存客户端状态，包括参数和消息历史"""
-        state = {
-            "parameters": self.parameters,
-            "messages": self.messages
+        return self.write_state(self.snapshot_state(), filename)
+    
+    def snapshot_state(self) -> Dict[str, Any]:
+        """状态的一致拷贝
+        
+        必须在修改对话的线程（界面线程）中调用；拷贝只复制索引，消息内容与当前对话共享，
+        之后可以交给 write_state 在后台线程中序列化。
+        """
+        self.state_revision += 1
+        return {
+            "revision": self.state_revision,
+            "parameters": dict(self.parameters),
+            "messages": self.messages.copy(),
+            "reasoning": self.reasoning.copy(),
+            "local_server": self.local_backend.base_url if self.local_backend else "",
+            # 各模型的生成速度，用于估算请求的截止时间
+            "throughput": {backend.name: backend.tracker.state()
+                           for backend in (self.http_backend, self.local_backend) if backend is not None}
         }
+    
+    def write_state(self, state: Dict[str, Any], filename="ai_client_state.pkl"):
+        """把 snapshot_state 得到的状态写入文件，先写临时文件再替换，中途失败不会损坏原文件"""
+        temp = filename + ".tmp"
         try:
-            with open(filename, 'wb') as f:
-                pickle.dump(state, f)
+            with self.state_lock:
+                if state["revision"] < self.saved_revision:
+                    # 更新的快照已经写入
+                    return True
+                with open(temp, 'wb') as f:
+                    pickle.dump(state, f)
+                os.replace(temp, filename)
+                self.saved_revision = state["revision"]
             return True
         except Exception as e:
             print(f"保存状态失败: {e}")
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
             return False
             
     def load_state(self, filename="ai_client_state.pkl"):
@@ -58,128 +170,190 @@ class AIClient:
                 with open(filename, 'rb') as f:
                     state = pickle.load(f)
                 self.parameters = state.get("parameters", self.parameters)
-                self.messages = state.get("messages", [])
+                messages = state.get("messages", [])
+                # 旧版本保存的是线性历史，转换后节点 id 与原来的位置相同，思考过程和记忆索引仍然对应
+                self.messages = messages if isinstance(messages, ConversationTree) else ConversationTree(messages)
+                reasoning = state.get("reasoning", {})
+                # 旧版本保存的是普通字典
+                self.reasoning = reasoning if isinstance(reasoning, NodeTextStore) else NodeTextStore(reasoning)
+                self.set_local_server(state.get("local_server", ""))
+                throughput = state.get("throughput", {})
+                self.http_backend.tracker.load(throughput.get(self.http_backend.name, {}))
+                if self.local_backend is not None:
+                    self.local_backend.tracker.load(throughput.get(self.local_backend.name, {}))
+                # 加载已有的记忆索引，并在后台补齐尚未嵌入的消息
+                self.memory.load(message_count=len(self.messages.nodes))
+                self.sync_memory()
                 return True
             return False
         except Exception as e:
             print(f"加载状态失败: {e}")
             return False
 
-    def make_request(self, endpoint: str, data: Dict[str, Any]) -> Dict[str, Any]:
-        url = f"{self.base_url}/{endpoint}"
-        
-        # 调试模式 - 模拟响应
-        if self.debug_mode:
-            time.sleep(1)  # 模拟网络延迟
-            return {
-                "id": "debug-response",
-                "choices": [
-                    {
-                        "message": {
-                            "role": "assistant",
-                            "content": "这是一个调试模式的模拟回复。实际使用时请关闭调试模式。"
-                        },
-                        "finish_reason": "stop"
-                    }
-                ]
+    def add_assistant_message(self, content: str, reasoning: str = ""):
+        """记录助手回复，思考过程单独保存"""
+        node_id = self.messages.append({
+            "role": "assistant",
+            "content": content
+        })
+        if reasoning:
+            self.reasoning[node_id] = reasoning
+        self.sync_memory()
+    
+    def sync_memory(self):
+        """记忆索引按节点 id 嵌入整棵对话树，切换分支不需要重建"""
+        self.memory.sync(self.messages.nodes)
+    
+    def clear_messages(self):
+        self.messages.clear()
+        self.reasoning = NodeTextStore()
+        self.memory.reset()
+    
+    def system_message(self) -> Optional[Dict[str, str]]:
+        """固定位置的系统提示词，总是取自当前参数"""
+        prompt = (self.parameters.get("system_prompt") or "").strip()
+        return {"role": "system", "content": prompt} if prompt else None
+    
+    def export_messages(self) -> Iterator[Dict[str, str]]:
+        """用于导出和归档的当前对话快照，与实际发送的请求一致：系统提示词在最前面"""
+        system = self.system_message()
+        messages = self.messages.snapshot()
+        
+        def iterate():
+            if system:
+                yield system
+            for msg in messages:
+                # 旧版本写入历史的系统消息不再发送，也不导出
+                if msg["role"] != "system":
+                    yield msg
+        return iterate()
+    
+    def context_start(self, indices: List[int], total: int) -> int:
+        """上下文窗口在 indices 中的起点
+        
+        起点按 context_step 条对齐，只在窗口溢出时整段前移，并且总是从用户消息开始，
+        因此连续多轮请求的前缀保持不变，服务商可以复用提示词缓存。
+        """
+        if total <= self.context_window:
+            return 0
+        step = max(1, self.context_step)
+        start = -(-(total - self.context_window) // step) * step
+        while start < len(indices) - 1 and self.messages.role(indices[start]) != "user":
+            start += 1
+        return min(start, len(indices))
+    
+    def build_context(self, query: str, pending: Optional[Dict[str, str]] = None,
+                      recall: bool = True) -> List[Dict[str, str]]:
+        """构建请求消息：系统提示词 + 最近的对话，并把召回的相关早期对话插在最后一条消息之前
+        
+        历史中保存的系统消息（旧版本写入的提示词）不再发送。召回片段每次都不同，
+        放在稳定的前缀之后。pending 是尚未写入历史、追加在最后的用户消息。
+        """
+        indices = [i for i in range(len(self.messages)) if self.messages.role(i) != "system"]
+        start = self.context_start(indices, len(indices) + (1 if pending else 0))
+        recent = [self.messages[i] for i in indices[start:]]
+        if pending:
+            recent.append(pending)
+        
+        system = self.system_message()
+        context = [system] if system else []
+        if start == 0 or not recall or self.memory_top_k <= 0:
+            return context + recent
+        
+        # 只从当前分支中滑出窗口的消息里召回，其他分支的内容不会混入
+        earlier = [self.messages.node_id(i) for i in indices[:start]]
+        hits = self.memory.recall(query, self.memory_top_k, candidates=earlier)
+        if hits:
+            snippets = []
+            # 按原始顺序排列召回的片段
+            position = {node_id: i for i, node_id in enumerate(earlier)}
+            for node_id, _ in sorted(hits, key=lambda hit: position[hit[0]]):
+                msg = self.messages.message(node_id)
+                speaker = "用户" if msg["role"] == "user" else "助手"
+                snippets.append(f"{speaker}: {msg['content']}")
+            recalled = {
+                "role": "system",
+                "content": "以下是与当前问题相关的早期对话片段，供参考：\n\n" + "\n\n".join(snippets)
             }
+            recent = recent[:-1] + [recalled] + recent[-1:]
+        return context + recent
+    
+    def build_request(self, messages: List[Dict[str, str]], parameters: Optional[Dict[str, Any]] = None,
+                      **overrides) -> Dict[str, Any]:
+        """按固定顺序组装请求参数，相同的设置总是得到相同的请求体"""
+        parameters = parameters or self.parameters
+        values = {
+            "model": parameters["model"],
+            "max_tokens": parameters["max_tokens"],
+            "temperature": parameters["temperature"],
+            "top_p": parameters["top_p"],
+            "top_k": parameters["top_k"],
+            "frequency_penalty": parameters["frequency_penalty"],
+            "n": parameters["n"],
+            "stop": parameters.get("stop"),
+            "stream": bool(parameters.get("stream", True)),
+        }
+        values.update(overrides)
+        # 让服务端在流式响应的最后一个数据块中返回用量（含缓存命中数）
+        if values["stream"]:
+            values.setdefault("stream_options", {"include_usage": True})
+        values["messages"] = messages
+        keys = REQUEST_PARAM_ORDER + sorted(key for key in values if key not in REQUEST_PARAM_ORDER)
+        return {key: values[key] for key in keys if values.get(key) is not None}
+    
+    def record_usage(self, usage: Optional[Dict[str, Any]]):
+        """累计本次会话的提示词用量和缓存命中"""
+        if not usage:
+            return
+        self.usage_totals["requests"] += 1
+        self.usage_totals["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        self.usage_totals["cached_tokens"] += cached_tokens(usage)
         
-        # 打印请求数据，用于调试
-        print("请求URL:", url)
-        print("请求头:", self.headers)
-        print("请求数据:", json.dumps(data, ensure_ascii=False, indent=2))
-        
-        # 实际API请求
-        retries = 0
-        while retries <= self.max_retries:
-            try:
-                # 使用无代理设置发送请求
-                response = requests.post(url, headers=self.headers, json=data, proxies=self.proxies, timeout=15)
-                
-                # 打印响应状态和内容，用于调试
-                print("响应状态码:", response.status_code)
-                try:
-                    print("响应内容:", json.dumps(response.json(), ensure_ascii=False, indent=2))
-                except:
-                    print("响应内容:", response.text)
-                
-                response.raise_for_status()
-                return response.json()
-            except requests.exceptions.HTTPError as e:
-                print(f"HTTP错误: {e}")
-                # 尝试获取详细的错误信息
-                try:
-                    error_detail = response.json()
-                    return {"error": f"HTTP错误 {response.status_code}: {error_detail.get('error', {}).get('message', str(e))}"}
-                except:
-                    return {"error": f"HTTP错误 {response.status_code}: {str(e)}"}
-            except requests.exceptions.ProxyError as e:
-                return {"error": f"代理错误: {str(e)}. 请检查您的网络设置或禁用代理。"}
-            except requests.exceptions.ConnectionError as e:
-                if retries < self.max_retries:
-                    retries += 1
-                    wait_time = 2 ** retries  # 指数退避
-                    time.sleep(wait_time)
-                    continue
-                return {"error": f"连接错误: {str(e)}. 请检查您的网络连接。"}
-            except requests.exceptions.Timeout as e:
-                if retries < self.max_retries:
-                    retries += 1
-                    wait_time = 2 ** retries
-                    time.sleep(wait_time)
-                    continue
-                return {"error": f"请求超时: {str(e)}. 服务器没有及时响应。"}
-            except requests.exceptions.RequestException as e:
-                return {"error": f"请求错误: {str(e)}"}
+    def backend_for(self, model=None) -> Backend:
+        """选择处理请求的后端：调试模式使用模拟后端，本地服务提供的模型发到本地"""
+        if self.debug_mode:
+            return self.fake_backend
+        if self.local_backend is not None and self.local_backend.serves(model):
+            return self.local_backend
+        return self.http_backend
+    
+    def set_local_server(self, url: str):
+        """设置本地 OpenAI 兼容服务地址，留空表示不使用本地服务"""
+        url = (url or "").strip()
+        if self.local_backend is not None and self.local_backend.base_url == url.rstrip("/"):
+            return
+        self.local_backend = LocalServerBackend(url) if url else None
+    
+    def make_request(self, endpoint: str, data: Dict[str, Any],
+                     token: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """普通请求；传入 token 的请求可以通过 token.cancel() 单独取消"""
+        return self.backend_for(data.get("model")).request(endpoint, data, token)
 
+    def stream_request(self, endpoint: str, data: Dict[str, Any],
+                       token: Optional[CancelToken] = None) -> Iterator[Dict[str, Any]]:
+        """流式请求，逐个返回解析后的 SSE 数据块；出错时返回带 error 字段的数据块"""
+        return self.backend_for(data.get("model")).stream(endpoint, data, token)
+    
     def test_connection(self) -> Dict[str, Any]:
         """测试API连接"""
+        model = self.parameters["model"]
         if self.debug_mode:
-            return {"success": True, "message": "调试模式，连接测试跳过"}
-            
-        try:
-            # 简单的消息请求，仅用于测试连接
-            test_data = {
-                "model": self.parameters["model"],
-                "messages": [{"role": "user", "content": "Hello"}],
-                "max_tokens": 5,
-                "stream": False
+            return self.fake_backend.test(model)
+        result = self.http_backend.test(model)
+        if self.local_backend is not None:
+            local = self.local_backend.test(model)
+            result = {
+                "success": result["success"] and local["success"],
+                "message": f"{result['message']}\n{local['message']}"
             }
-            
-            # 使用更短的超时时间
-            response = requests.post(
-                f"{self.base_url}/chat/completions", 
-                headers=self.headers, 
-                json=test_data, 
-                proxies=self.proxies, 
-                timeout=5
-            )
-            
-            print("测试连接响应码:", response.status_code)
-            try:
-                print("测试连接响应:", json.dumps(response.json(), ensure_ascii=False, indent=2))
-            except:
-                print("测试连接响应:", response.text)
-            
-            if response.status_code >= 200 and response.status_code < 300:
-                return {"success": True, "message": f"连接成功! 状态码: {response.status_code}"}
-            else:
-                try:
-                    error_detail = response.json()
-                    error_msg = error_detail.get("error", {}).get("message", str(response.text))
-                    return {"success": False, "message": f"API错误: {error_msg} (状态码: {response.status_code})"}
-                except:
-                    return {"success": False, "message": f"API错误: 状态码 {response.status_code}"}
-        except requests.exceptions.RequestException as e:
-            return {"success": False, "message": f"连接错误: {str(e)}"}
-        except Exception as e:
-            return {"success": False, "message": f"未知错误: {str(e)}"}
+        return result
 
 class SettingsWindow:
-    def __init__(self, parent, callback, debug_callback, test_callback=None):
+    def __init__(self, parent, callback, debug_callback, test_callback=None,
+                 profile_callback=None, profiling=False, local_endpoint=""):
         self.window = tk.Toplevel(parent)
         self.window.title("设置")
-        self.window.geometry("400x320")
+        self.window.geometry("400x410")
         self.window.transient(parent)
         self.window.grab_set()
         
@@ -198,6 +372,12 @@ class SettingsWindow:
         self.api_endpoint_entry.insert(0, "https://api.siliconflow.cn/v1")
         self.api_endpoint_entry.pack(fill=tk.X, pady=5)
         
+        # 本地服务地址输入，服务中已有的模型会发到本地
+        ttk.Label(main_frame, text=f"本地服务地址 (可选，如 {LOCAL_BASE_URL}):").pack(anchor=tk.W)
+        self.local_endpoint_entry = ttk.Entry(main_frame, width=50)
+        self.local_endpoint_entry.insert(0, local_endpoint)
+        self.local_endpoint_entry.pack(fill=tk.X, pady=5)
+        
         # 调试模式复选框
         self.debug_var = tk.BooleanVar()
         self.debug_checkbox = ttk.Checkbutton(
@@ -207,6 +387,16 @@ class SettingsWindow:
         )
         self.debug_checkbox.pack(anchor=tk.W, pady=10)
         
+        # 性能分析复选框
+        self.profile_callback = profile_callback
+        self.profile_var = tk.BooleanVar(value=profiling)
+        if profile_callback:
+            ttk.Checkbutton(
+                main_frame,
+                text=f"启用性能分析（结果写入 {PROFILE_DIR} 目录）",
+                variable=self.profile_var
+            ).pack(anchor=tk.W)
+        
         # 按钮框架
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(pady=20, fill=tk.X)
@@ -238,6 +428,7 @@ class SettingsWindow:
             
         api_key = self.api_key_entry.get().strip()
         api_endpoint = self.api_endpoint_entry.get().strip()
+        local_endpoint = self.local_endpoint_entry.get().strip()
         debug_mode = self.debug_var.get()
         
         if not api_key and not debug_mode:
@@ -248,18 +439,36 @@ class SettingsWindow:
         if not api_endpoint:
             api_endpoint = "https://api.siliconflow.cn/v1"
             
-        # 执行连接测试
-        result = self.test_callback(api_key, api_endpoint, debug_mode)
+        # 在后台线程中执行连接测试，避免阻塞界面
+        self.test_button.config(state=tk.DISABLED, text="测试中...")
+        
+        def run():
+            result = self.test_callback(api_key, api_endpoint, debug_mode, local_endpoint)
+            try:
+                self.window.after(0, lambda: self.show_test_result(result))
+            except (tk.TclError, RuntimeError):
+                # 设置窗口已经关闭
+                pass
+        
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+    
+    def show_test_result(self, result: Dict[str, Any]):
+        if not self.window.winfo_exists():
+            return
+        self.test_button.config(state=tk.NORMAL, text="测试连接")
         
         # 显示结果
         if result["success"]:
-            messagebox.showinfo("测试结果", result["message"])
+            messagebox.showinfo("测试结果", result["message"], parent=self.window)
         else:
-            messagebox.showerror("测试结果", result["message"])
+            messagebox.showerror("测试结果", result["message"], parent=self.window)
         
     def save_settings(self):
         api_key = self.api_key_entry.get().strip()
         api_endpoint = self.api_endpoint_entry.get().strip()
+        local_endpoint = self.local_endpoint_entry.get().strip()
         debug_mode = self.debug_var.get()
         
         if not api_key and not debug_mode:
@@ -270,8 +479,10 @@ class SettingsWindow:
         if not api_endpoint:
             api_endpoint = "https://api.siliconflow.cn/v1"
             
-        self.callback(api_key, api_endpoint)
+        self.callback(api_key, api_endpoint, local_endpoint)
         self.debug_callback(debug_mode)
+        if self.profile_callback:
+            self.profile_callback(self.profile_var.get())
         self.window.destroy()
 
 class ParameterFrame(ttk.Frame):
@@ -282,31 +493,6 @@ class ParameterFrame(ttk.Frame):
         self.create_widgets()
         
     def create_widgets(self):
-        # 可用的模型列表 - 根据文档更新
-        model_options = [
-            "Qwen/QwQ-32B", 
-            "Pro/deepseek-ai/DeepSeek-R1", 
-            "Pro/deepseek-ai/DeepSeek-V3", 
-            "deepseek-ai/DeepSeek-R1", 
-            "deepseek-ai/DeepSeek-V3",
-            "deepseek-ai/DeepSeek-R1-Distill-Qwen-32B",
-            "deepseek-ai/DeepSeek-R1-Distill-Qwen-14B",
-            "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
-            "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B",
-            "Pro/deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
-            "Pro/deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B",
-            "deepseek-ai/DeepSeek-V2.5",
-            "Qwen/Qwen2.5-72B-Instruct-128K",
-            "Qwen/Qwen2.5-72B-Instruct",
-            "Qwen/Qwen2.5-32B-Instruct",
-            "Qwen/Qwen2.5-14B-Instruct",
-            "Qwen/Qwen2.5-7B-Instruct",
-            "Qwen/Qwen2.5-Coder-32B-Instruct",
-            "Qwen/Qwen2.5-Coder-7B-Instruct",
-            "Qwen/Qwen2-7B-Instruct",
-            "Qwen/Qwen2-1.5B-Instruct"
-        ]
-        
         # 创建选项卡
         self.notebook = ttk.Notebook(self)
         self.notebook.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -332,7 +518,7 @@ class ParameterFrame(ttk.Frame):
             
             # 如果是model参数，创建下拉菜单
             if param == "model":
-                combo = ttk.Combobox(basic_tab, values=model_options, width=15)
+                combo = ttk.Combobox(basic_tab, values=MODEL_OPTIONS, width=15)
                 combo.set(value)
                 combo.grid(row=row, column=1, padx=5, pady=2)
                 combo.bind('<<ComboboxSelected>>', lambda e, p=param, cb=combo: self.update_parameter(p, cb.get()))
@@ -379,6 +565,15 @@ class ParameterFrame(ttk.Frame):
                 entry.bind('<KeyRelease>', lambda e, p=param, ent=entry: self.update_parameter(p, ent.get()))
             row += 1
         
+        # 流式输出开关
+        self.stream_var = tk.BooleanVar(value=self.parameters.get("stream", True))
+        ttk.Checkbutton(
+            advanced_tab,
+            text="流式输出",
+            variable=self.stream_var,
+            command=lambda: self.update_parameter("stream", self.stream_var.get())
+        ).grid(row=row, column=0, columnspan=2, padx=5, pady=2, sticky="w")
+        
         # 系统提示词文本区域
         ttk.Label(prompt_tab, text="系统提示词:").pack(anchor=tk.W, padx=5, pady=2)
         
@@ -439,6 +634,7 @@ class ParameterFrame(ttk.Frame):
             "frequency_penalty": 0.5,
             "n": 1,
             "stop": None,
+            "stream": True,
             "system_prompt": ""
         }
         
@@ -456,9 +652,341 @@ class ParameterFrame(ttk.Frame):
         # 回调更新
         self.callback(self.parameters)
 
+class ArenaWindow:
+    """模型对比：把同一段对话并发发送给多个模型，并排显示回复和速度指标"""
+    def __init__(self, parent, client, use_model_callback):
+        self.window = tk.Toplevel(parent)
+        self.window.title("模型对比")
+        self.window.geometry("1200x720")
+        self.client = client
+        self.use_model_callback = use_model_callback
+        self.arena = None
+        self.columns = []
+        
+        # 顶部: 模型选择和问题输入
+        top_frame = ttk.Frame(self.window, padding="10")
+        top_frame.pack(fill=tk.X)
+        
+        ttk.Label(top_frame, text="选择模型（可多选）:").grid(row=0, column=0, sticky="nw")
+        self.model_list = tk.Listbox(top_frame, selectmode=tk.MULTIPLE, height=6, exportselection=False, width=50)
+        for model in MODEL_OPTIONS:
+            self.model_list.insert(tk.END, model)
+        current = client.parameters.get("model")
+        if current in MODEL_OPTIONS:
+            self.model_list.selection_set(MODEL_OPTIONS.index(current))
+        self.model_list.grid(row=0, column=1, rowspan=3, padx=5, sticky="w")
+        
+        ttk.Label(top_frame, text="问题（附带当前对话上下文）:").grid(row=0, column=2, sticky="nw", padx=5)
+        self.prompt_entry = ttk.Entry(top_frame, width=50, font=('微软雅黑', 10))
+        self.prompt_entry.grid(row=1, column=2, padx=5, sticky="we")
+        
+        button_frame = ttk.Frame(top_frame)
+        button_frame.grid(row=2, column=2, padx=5, sticky="w")
+        self.start_button = ttk.Button(button_frame, text="开始对比", command=self.start)
+        self.start_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="历史速度", command=self.show_history).pack(side=tk.LEFT, padx=5)
+        
+        self.status_label = ttk.Label(self.window, text="", font=('微软雅黑', 9))
+        self.status_label.pack(anchor=tk.W, padx=10)
+        
+        # 结果区域，每个模型一列
+        self.results_frame = ttk.Frame(self.window, padding="5")
+        self.results_frame.pack(fill=tk.BOTH, expand=True)
+    
+    def build_messages(self, prompt: str) -> List[Dict[str, str]]:
+        """当前对话最近的上下文加上新问题，不修改聊天记录"""
+        # 与聊天使用相同的前缀，不做记忆召回（召回需要请求嵌入接口）
+        return self.client.build_context(prompt, {"role": "user", "content": prompt}, recall=False)
+    
+    def start(self):
+        models = [self.model_list.get(i) for i in self.model_list.curselection()]
+        prompt = self.prompt_entry.get().strip()
+        if not models:
+            messagebox.showerror("错误", "请至少选择一个模型", parent=self.window)
+            return
+        if not prompt:
+            messagebox.showerror("错误", "请输入问题", parent=self.window)
+            return
+        
+        # 重建结果列
+        for child in self.results_frame.winfo_children():
+            child.destroy()
+        self.columns = []
+        for col, model in enumerate(models):
+            frame = ttk.LabelFrame(self.results_frame, text=model, padding="3")
+            frame.grid(row=0, column=col, sticky="nsew", padx=3)
+            self.results_frame.columnconfigure(col, weight=1)
+            stats = ttk.Label(frame, text="等待中...", font=('微软雅黑', 9), justify=tk.LEFT)
+            stats.pack(anchor=tk.W)
+            text = scrolledtext.ScrolledText(frame, wrap=tk.WORD, font=('微软雅黑', 10), width=20)
+            text.pack(fill=tk.BOTH, expand=True)
+            ttk.Button(
+                frame,
+                text="使用此模型",
+                command=lambda m=model: self.use_model_callback(m)
+            ).pack(pady=3)
+            self.columns.append({"stats": stats, "text": text, "consumed": 0})
+        self.results_frame.rowconfigure(0, weight=1)
+        
+        self.arena = ModelArena(self.client, models, self.build_messages(prompt), dict(self.client.parameters))
+        self.arena.start()
+        self.start_button.config(state=tk.DISABLED)
+        self.status_label.config(text=f"正在并发请求 {len(models)} 个模型...")
+        self.refresh()
+    
+    def refresh(self):
+        """定时把各模型的新内容和指标刷新到界面"""
+        if not self.window.winfo_exists() or not self.arena:
+            return
+        for run, column in zip(self.arena.runs, self.columns):
+            count = len(run.parts)
+            if count > column["consumed"]:
+                column["text"].insert(tk.END, "".join(run.parts[column["consumed"]:count]))
+                column["text"].see(tk.END)
+                column["consumed"] = count
+            column["stats"].config(text=self.format_stats(run))
+        
+        if self.arena.done and (self.arena.thread is None or not self.arena.thread.is_alive()):
+            self.start_button.config(state=tk.NORMAL)
+            self.status_label.config(text=f"对比完成，结果已追加到 {BENCHMARK_FILE}")
+        else:
+            self.window.after(100, self.refresh)
+    
+    def format_stats(self, run) -> str:
+        if run.error:
+            return f"错误: {run.error}"
+        ttft = run.ttft()
+        latency = run.latency()
+        tps = run.tokens_per_second()
+        lines = [
+            f"首字延迟: {ttft:.2f}s" if ttft is not None else "首字延迟: -",
+            f"总耗时: {latency:.2f}s" + ("" if run.done else " ..."),
+            f"速度: {tps:.1f} tokens/s" if tps is not None else "速度: -",
+        ]
+        if run.usage:
+            cached = cached_tokens(run.usage)
+            lines.append(f"用量: 输入 {run.usage.get('prompt_tokens', '-')} / 输出 {run.usage.get('completion_tokens', '-')}"
+                         + (f" (缓存 {cached})" if cached else ""))
+        else:
+            lines.append(f"输出: 约 {run.completion_tokens()} 个数据块")
+        if run.reasoning_chars:
+            lines.append(f"思考过程: {run.reasoning_chars} 字")
+        return "\n".join(lines)
+    
+    def show_history(self):
+        """按历史中位速度排列各模型"""
+        summary = summarize_benchmarks()
+        if not summary:
+            messagebox.showinfo("历史速度", "还没有基准记录", parent=self.window)
+            return
+        ranked = sorted(summary.items(), key=lambda item: -(item[1]["tokens_per_second"] or 0))
+        lines = []
+        for model, stats in ranked:
+            ttft = stats["ttft"]
+            tps = stats["tokens_per_second"]
+            lines.append(
+                f"{model}: {tps:.1f} tokens/s, 首字 {ttft:.2f}s ({stats['runs']} 次)"
+                if tps is not None and ttft is not None else f"{model}: 数据不足 ({stats['runs']} 次)"
+            )
+        messagebox.showinfo("历史速度（中位数）", "\n".join(lines), parent=self.window)
+
+class SweepWindow:
+    """参数扫描：在问题集合和参数网格的所有组合上并发请求，比较各组参数的耗时和用量"""
+    def __init__(self, parent, client, apply_callback):
+        self.window = tk.Toplevel(parent)
+        self.window.title("参数扫描")
+        self.window.geometry("1100x720")
+        self.client = client
+        self.apply_callback = apply_callback
+        self.sweep = None
+        self.rows = []
+        
+        top_frame = ttk.Frame(self.window, padding="10")
+        top_frame.pack(fill=tk.X)
+        
+        # 左侧: 问题集合，每行一个
+        prompt_frame = ttk.LabelFrame(top_frame, text="问题（每行一个，单轮请求）", padding="5")
+        prompt_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.prompt_text = scrolledtext.ScrolledText(prompt_frame, wrap=tk.WORD, font=('微软雅黑', 10),
+                                                     width=40, height=10)
+        self.prompt_text.pack(fill=tk.BOTH, expand=True)
+        ttk.Button(prompt_frame, text="从文件导入", command=self.load_prompts).pack(anchor=tk.W, pady=3)
+        
+        # 右侧: 参数网格和运行选项
+        grid_frame = ttk.LabelFrame(top_frame, text="参数取值（逗号分隔，留空则使用当前值）", padding="5")
+        grid_frame.pack(side=tk.LEFT, fill=tk.Y, padx=10)
+        self.grid_entries = {}
+        row = 0
+        for name in SWEEP_PARAMS:
+            ttk.Label(grid_frame, text=f"{name}:").grid(row=row, column=0, padx=5, pady=2, sticky="w")
+            entry = ttk.Entry(grid_frame, width=40)
+            entry.insert(0, str(client.parameters.get(name, "")))
+            entry.grid(row=row, column=1, padx=5, pady=2, sticky="we")
+            self.grid_entries[name] = entry
+            row += 1
+        
+        self.option_entries = {}
+        for name, label, default in (("repeats", "每组重复次数:", 1), ("concurrency", "并发数:", 4),
+                                     ("rpm", "每分钟请求数:", 60)):
+            ttk.Label(grid_frame, text=label).grid(row=row, column=0, padx=5, pady=2, sticky="w")
+            entry = ttk.Entry(grid_frame, width=10)
+            entry.insert(0, str(default))
+            entry.grid(row=row, column=1, padx=5, pady=2, sticky="w")
+            self.option_entries[name] = entry
+            row += 1
+        
+        ttk.Label(grid_frame, text="结果文件:").grid(row=row, column=0, padx=5, pady=2, sticky="w")
+        file_frame = ttk.Frame(grid_frame)
+        file_frame.grid(row=row, column=1, padx=5, pady=2, sticky="we")
+        self.file_entry = ttk.Entry(file_frame, width=30)
+        self.file_entry.insert(0, SWEEP_FILE)
+        self.file_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        ttk.Button(file_frame, text="选择", command=self.choose_file).pack(side=tk.LEFT, padx=3)
+        row += 1
+        
+        button_frame = ttk.Frame(grid_frame)
+        button_frame.grid(row=row, column=0, columnspan=2, pady=5)
+        self.start_button = ttk.Button(button_frame, text="开始扫描", command=self.start)
+        self.start_button.pack(side=tk.LEFT, padx=5)
+        self.stop_button = ttk.Button(button_frame, text="停止", command=self.stop, state=tk.DISABLED)
+        self.stop_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="使用选中参数", command=self.apply_selected).pack(side=tk.LEFT, padx=5)
+        
+        self.status_label = ttk.Label(self.window, text="", font=('微软雅黑', 9))
+        self.status_label.pack(anchor=tk.W, padx=10)
+        
+        # 结果表格，每组参数一行
+        self.results_frame = ttk.Frame(self.window, padding="5")
+        self.results_frame.pack(fill=tk.BOTH, expand=True)
+        self.table = None
+    
+    def load_prompts(self):
+        filename = filedialog.askopenfilename(
+            parent=self.window,
+            filetypes=[("文本文件", "*.txt"), ("所有文件", "*.*")]
+        )
+        if not filename:
+            return
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                self.prompt_text.delete("1.0", tk.END)
+                self.prompt_text.insert("1.0", f.read())
+        except Exception as e:
+            messagebox.showerror("错误", f"读取问题文件失败: {e}", parent=self.window)
+    
+    def choose_file(self):
+        filename = filedialog.asksaveasfilename(
+            parent=self.window,
+            initialfile=os.path.basename(self.file_entry.get()) or SWEEP_FILE,
+            defaultextension=".jsonl",
+            confirmoverwrite=False,
+            filetypes=[("JSONL", "*.jsonl")]
+        )
+        if filename:
+            self.file_entry.delete(0, tk.END)
+            self.file_entry.insert(0, filename)
+    
+    def read_settings(self):
+        """读取问题、参数网格和运行选项，格式错误时抛出 ValueError"""
+        prompts = [line.strip() for line in self.prompt_text.get("1.0", tk.END).splitlines() if line.strip()]
+        if not prompts:
+            raise ValueError("请至少输入一个问题")
+        grid = {}
+        for name, entry in self.grid_entries.items():
+            try:
+                grid[name] = parse_values(name, entry.get())
+            except ValueError:
+                raise ValueError(f"{name} 的取值格式不正确")
+        repeats = int(self.option_entries["repeats"].get())
+        concurrency = int(self.option_entries["concurrency"].get())
+        rpm = float(self.option_entries["rpm"].get())
+        if repeats < 1 or concurrency < 1 or rpm <= 0:
+            raise ValueError("重复次数、并发数和每分钟请求数必须大于 0")
+        return prompts, grid, repeats, concurrency, rpm
+    
+    def start(self):
+        try:
+            prompts, grid, repeats, concurrency, rpm = self.read_settings()
+        except ValueError as e:
+            messagebox.showerror("错误", str(e), parent=self.window)
+            return
+        results_file = self.file_entry.get().strip() or SWEEP_FILE
+        self.sweep = ParameterSweep(self.client, prompts, grid, dict(self.client.parameters), results_file,
+                                    repeats=repeats, concurrency=concurrency, requests_per_minute=rpm)
+        self.build_table([name for name in SWEEP_PARAMS if len(grid.get(name) or []) > 1])
+        self.sweep.start()
+        self.start_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+        self.refresh()
+    
+    def stop(self):
+        if self.sweep:
+            self.sweep.stop()
+            self.stop_button.config(state=tk.DISABLED)
+            self.status_label.config(text="正在停止，等待已发出的请求完成...")
+    
+    def build_table(self, varying: List[str]):
+        """按参与扫描的参数（取值多于一个）建立表格列"""
+        for child in self.results_frame.winfo_children():
+            child.destroy()
+        self.param_columns = varying or ["model"]
+        stat_columns = ["runs", "errors", "ttft", "latency", "tokens/s", "prompt", "cached", "completion"]
+        columns = self.param_columns + stat_columns
+        self.table = ttk.Treeview(self.results_frame, columns=columns, show="headings")
+        for column in columns:
+            self.table.heading(column, text=column)
+            self.table.column(column, width=110 if column in self.param_columns else 80, anchor=tk.CENTER)
+        scrollbar = ttk.Scrollbar(self.results_frame, orient=tk.VERTICAL, command=self.table.yview)
+        self.table.configure(yscrollcommand=scrollbar.set)
+        self.table.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    
+    def refresh(self):
+        """定时刷新进度和各组参数的统计"""
+        if not self.window.winfo_exists() or not self.sweep:
+            return
+        self.rows = self.sweep.summary()
+        self.table.delete(*self.table.get_children())
+        for values, stats in self.rows:
+            self.table.insert("", tk.END, values=[values.get(name, "") for name in self.param_columns] + [
+                stats["runs"],
+                stats["errors"],
+                self.format_number(stats["ttft"], "{:.2f}s"),
+                self.format_number(stats["latency"], "{:.2f}s"),
+                self.format_number(stats["tokens_per_second"], "{:.1f}"),
+                self.format_number(stats["prompt_tokens"], "{:.0f}"),
+                self.format_number(stats["cached_tokens"], "{:.0f}"),
+                self.format_number(stats["completion_tokens"], "{:.0f}"),
+            ])
+        
+        total = len(self.sweep.cells)
+        progress = (f"{self.sweep.completed}/{total} 个请求完成"
+                    f"（复用已有结果 {self.sweep.cached}，失败 {self.sweep.failed}）")
+        if self.sweep.running:
+            self.status_label.config(text=f"正在扫描: {progress}")
+            self.window.after(500, self.refresh)
+        else:
+            self.start_button.config(state=tk.NORMAL)
+            self.stop_button.config(state=tk.DISABLED)
+            state = "已停止" if self.sweep.stop_event.is_set() else "扫描完成"
+            self.status_label.config(text=f"{state}: {progress}，结果保存在 {self.sweep.results_file}")
+    
+    @staticmethod
+    def format_number(value, fmt: str) -> str:
+        return fmt.format(value) if value is not None else "-"
+    
+    def apply_selected(self):
+        """把选中行的参数设置为聊天使用的参数"""
+        if not self.table or not self.table.selection():
+            messagebox.showinfo("提示", "请先在结果中选择一组参数", parent=self.window)
+            return
+        values, _ = self.rows[self.table.index(self.table.selection()[0])]
+        self.apply_callback(values)
+
 class ChatWindow:
-    def __init__(self, root):
+    def __init__(self, root, profiler=None):
         self.root = root
+        self.profiler = profiler or Profiler()
         self.root.title("AI 聊天助手")
         self.root.geometry("980x980")
         
@@ -515,6 +1043,33 @@ class ChatWindow:
         )
         self.save_chat_button.pack(side=tk.LEFT, padx=5)
         
+        # 导出全部对话按钮（包括已归档的对话）
+        self.export_all_button = ttk.Button(
+            button_frame,
+            text="导出全部",
+            command=self.export_all_history,
+            style='Accent.TButton'
+        )
+        self.export_all_button.pack(side=tk.LEFT, padx=5)
+        
+        # 模型对比按钮
+        self.arena_button = ttk.Button(
+            button_frame,
+            text="模型对比",
+            command=self.show_arena,
+            style='Accent.TButton'
+        )
+        self.arena_button.pack(side=tk.LEFT, padx=5)
+        
+        # 参数扫描按钮
+        self.sweep_button = ttk.Button(
+            button_frame,
+            text="参数扫描",
+            command=self.show_sweep,
+            style='Accent.TButton'
+        )
+        self.sweep_button.pack(side=tk.LEFT, padx=5)
+        
         # 创建聊天显示区域
         self.chat_frame = ttk.Frame(self.right_frame)
         self.chat_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
@@ -527,6 +1082,32 @@ class ChatWindow:
         )
         self.chat_display.pack(fill=tk.BOTH, expand=True)
         
+        # 先创建消息颜色标签，再配置 Markdown 标签，保证后者优先级更高
+        self.chat_display.tag_config("user", foreground="blue")
+        self.chat_display.tag_config("ai", foreground="green")
+        self.chat_display.tag_config("system", foreground="gray")
+        configure_tags(self.chat_display)
+        configure_reasoning_tags(self.chat_display)
+        self.md_cache = BlockCache()
+        
+        # 流式回复的渲染状态
+        self.stream_view = None
+        self.reasoning_view = None
+        self.reasoning_parts: List[str] = []
+        self.stream_label = ""
+        self.stream_pending: List[tuple] = []
+        self.stream_lock = threading.Lock()
+        self.stream_flush_scheduled = False
+        
+        # 右键菜单：重新生成、编辑后重新发送、切换分支
+        self.busy = False
+        # 重启或加载状态时客户端在后台线程中保存和加载，期间不接受新消息和对对话的修改
+        self.loading = False
+        # 当前聊天请求的取消句柄，停止按钮只取消这个请求
+        self.request_token = None
+        self.message_menu = tk.Menu(self.root, tearoff=0)
+        self.chat_display.bind("<Button-3>", self.show_message_menu)
+        
         # 创建输入区域
         self.input_frame = ttk.Frame(self.right_frame)
         self.input_frame.pack(fill=tk.X, padx=10, pady=5)
@@ -544,6 +1125,15 @@ class ChatWindow:
         )
         self.send_button.pack(side=tk.RIGHT, padx=5)
         
+        # 停止生成按钮，仅在等待回复时可用
+        self.stop_button = ttk.Button(
+            self.input_frame,
+            text="停止",
+            command=self.stop_generation,
+            state=tk.DISABLED
+        )
+        self.stop_button.pack(side=tk.RIGHT, padx=5)
+        
         # 清空聊天记录按钮
         self.clear_button = ttk.Button(
             self.input_frame,
@@ -552,13 +1142,62 @@ class ChatWindow:
         )
         self.clear_button.pack(side=tk.RIGHT, padx=5)
         
-        # 添加状态标签
+        # 等待回复时发送的消息进入队列；勾选后作为不带历史的单轮请求提前并行发送
+        self.parallel_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            self.input_frame,
+            text="排队消息并行发送",
+            variable=self.parallel_var
+        ).pack(side=tk.RIGHT, padx=5)
+        
+        # 消息队列，只在有排队消息时显示
+        self.message_queue = MessageQueue()
+        self.queue_paused = False
+        self.queue_frame = ttk.LabelFrame(self.right_frame, text="待发送消息（双击编辑）", padding="3")
+        self.queue_list = tk.Listbox(self.queue_frame, height=4, font=('微软雅黑', 9), exportselection=False)
+        self.queue_list.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.queue_list.bind('<Double-Button-1>', lambda e: self.edit_queued())
+        self.queue_list.bind('<Delete>', lambda e: self.remove_queued())
+        queue_buttons = ttk.Frame(self.queue_frame)
+        queue_buttons.pack(side=tk.RIGHT, padx=5)
+        for text, command in (("编辑", self.edit_queued), ("删除", self.remove_queued),
+                              ("上移", lambda: self.move_queued(-1)), ("下移", lambda: self.move_queued(1)),
+                              ("清空队列", self.clear_queue)):
+            ttk.Button(queue_buttons, text=text, command=command, width=8).pack(side=tk.LEFT, padx=2)
+        
+        # 添加状态栏
+        self.status_frame = ttk.Frame(self.right_frame)
+        self.status_frame.pack(fill=tk.X, padx=10, pady=2)
+        
         self.status_label = ttk.Label(
-            self.right_frame,
+            self.status_frame,
             text="就绪",
             font=('微软雅黑', 9)
         )
-        self.status_label.pack(anchor=tk.W, padx=10, pady=2)
+        self.status_label.pack(side=tk.LEFT)
+        
+        # 上一次请求的提示词用量和缓存命中
+        self.usage_label = ttk.Label(
+            self.status_frame,
+            text="",
+            font=('微软雅黑', 9),
+            foreground="gray"
+        )
+        self.usage_label.pack(side=tk.LEFT, padx=10)
+        
+        # 界面响应度指标
+        self.responsiveness_label = ttk.Label(
+            self.status_frame,
+            text="",
+            font=('微软雅黑', 9),
+            foreground="gray"
+        )
+        self.responsiveness_label.pack(side=tk.RIGHT)
+        
+        # 事件循环卡顿检测
+        self.watchdog = UIWatchdog(self.root)
+        self.watchdog.start()
+        self.update_responsiveness()
         
         # 绑定回车键发送消息
         self.message_input.bind('<Return>', lambda e: self.send_message())
@@ -567,6 +1206,10 @@ class ChatWindow:
         self.client = None
         self.api_key = None
         
+        # 命令行开启性能分析时，在加载历史之前挂上分析区间
+        if self.profiler.enabled:
+            self.profiler.instrument(self, WINDOW_SPANS)
+        
         # 尝试加载保存的API密钥
         self.load_api_key()
         
@@ -584,7 +1227,7 @@ class ChatWindow:
                     api_key = f.read().strip()
                     if api_key:
                         self.api_key = api_key
-                        self.client = AIClient(api_key)
+                        self.client = self.create_client(api_key)
                         # 加载保存的状态
                         self.client.load_state()
                         # 显示加载的消息历史
@@ -600,6 +1243,36 @@ class ChatWindow:
         except Exception as e:
             print(f"加载API密钥失败: {e}")
     
+    def update_responsiveness(self):
+        """每秒刷新一次界面延迟指标"""
+        metrics = self.watchdog.metrics()
+        text = f"界面延迟 p95 {metrics['p95']:.0f}ms / 最大 {metrics['max']:.0f}ms"
+        if metrics["stalls"]:
+            text += f"  卡顿 {metrics['stalls']} 次"
+        self.responsiveness_label.config(text=text)
+        self.root.after(1000, self.update_responsiveness)
+    
+    def create_client(self, api_key: str) -> AIClient:
+        """创建客户端，性能分析开启时挂上分析区间"""
+        client = AIClient(api_key)
+        if self.profiler.enabled:
+            self.profiler.instrument(client, CLIENT_SPANS)
+        return client
+    
+    def update_profiling(self, enabled: bool):
+        """开启或关闭性能分析"""
+        if enabled == self.profiler.enabled:
+            return
+        if enabled:
+            self.profiler.start()
+            self.profiler.instrument(self, WINDOW_SPANS)
+            if self.client:
+                self.profiler.instrument(self.client, CLIENT_SPANS)
+            self.add_message("系统", f"性能分析已开启，结果将写入 {self.profiler.session_dir}", "system")
+        else:
+            summary = self.profiler.stop()
+            self.add_message("系统", f"性能分析已关闭，热点汇总已写入 {summary}", "system")
+    
     def on_closing(self):
         """窗口关闭时的处理"""
         try:
@@ -611,9 +1284,16 @@ class ChatWindow:
             # 保存客户端状态
             if self.client:
                 self.client.save_state()
+                self.client.memory.save()
         except Exception as e:
             print(f"保存状态失败: {e}")
         
+        self.watchdog.stop()
+        
+        # 写出性能分析汇总
+        if self.profiler.enabled:
+            self.profiler.stop()
+        
         # 关闭窗口
         self.root.destroy()
         
@@ -623,19 +1303,144 @@ class ChatWindow:
             return
             
         # 清空当前显示
+        self.clear_display()
+        
+        # 显示当前分支的所有消息
+        for i in range(len(self.client.messages)):
+            self.render_history_message(i)
+    
+    def render_history_message(self, index: int):
+        """显示当前分支中的第 index 条消息，并在开头设置位置标记"""
+        msg = self.client.messages[index]
+        role = msg.get("role", "unknown")
+        content = msg.get("content", "")
+        
+        if role == "user":
+            self.add_message("您", content, "user", index=index)
+        elif role == "assistant":
+            node_id = self.client.messages.node_id(index)
+            # 思考过程展开时才从存储中读取，界面不保留全文
+            store = self.client.reasoning
+            reasoning = (lambda: store.get(node_id, "")) if node_id in store else ""
+            self.add_message("AI", content, "ai", reasoning, index=index)
+        elif role == "system":
+            self.add_message("系统提示", content, "system", index=index)
+    
+    def clear_display(self):
         self.chat_display.delete(1.0, tk.END)
+        for mark in self.message_marks() + ["waiting", "waiting_end"]:
+            self.chat_display.mark_unset(mark)
+    
+    def message_marks(self) -> List[str]:
+        """聊天区中的消息位置标记，按消息位置排序"""
+        marks = [name for name in self.chat_display.mark_names() if name.startswith("msg_")]
+        return sorted(marks, key=lambda name: int(name[4:]))
+    
+    def show_divergent(self, old_ids: List[int]):
+        """切换分支后只重新渲染与之前显示不同的部分"""
+        new_ids = self.client.messages.node_ids()
+        prefix = ConversationTree.common_prefix(old_ids, new_ids)
+        marks = [mark for mark in self.message_marks() if int(mark[4:]) >= prefix]
+        if marks:
+            self.chat_display.delete(marks[0], tk.END)
+            for mark in marks:
+                self.chat_display.mark_unset(mark)
+        for i in range(prefix, len(new_ids)):
+            self.render_history_message(i)
+        self.chat_display.see(tk.END)
+    
+    def branch_label(self, sender: str, index: int) -> str:
+        """有多个分支时在发送者后显示当前是第几个分支"""
+        if index < len(self.client.messages):
+            current, total = self.client.messages.branch_position(index)
+        else:
+            # 即将追加的回复，排在已有分支之后
+            messages = self.client.messages
+            total = len(messages.children.get(messages.node_id(-1), ())) + 1 if messages else 1
+            current = total
+        return f"{sender} [{current}/{total}]" if total > 1 else sender
+    
+    def message_at(self, index: str):
+        """返回聊天区位置 index 所在的消息序号"""
+        found = None
+        for mark in self.message_marks():
+            if self.chat_display.compare(mark, "<=", index):
+                found = int(mark[4:])
+            else:
+                break
+        if found is not None and found < len(self.client.messages):
+            return found
+        return None
+    
+    def show_message_menu(self, event):
+        if not self.client or self.busy or self.loading:
+            return
+        index = self.message_at(self.chat_display.index(f"@{event.x},{event.y}"))
+        if index is None:
+            return
         
-        # 显示所有消息
-        for msg in self.client.messages:
-            role = msg.get("role", "unknown")
-            content = msg.get("content", "")
-            
-            if role == "user":
-                self.add_message("您", content, "user")
-            elif role == "assistant":
-                self.add_message("AI", content, "ai")
-            elif role == "system":
-                self.add_message("系统提示", content, "system")
+        menu = self.message_menu
+        menu.delete(0, tk.END)
+        role = self.client.messages[index].get("role")
+        if role == "assistant":
+            menu.add_command(label="重新生成", command=lambda: self.regenerate(index))
+        elif role == "user":
+            menu.add_command(label="编辑并重新发送", command=lambda: self.edit_message(index))
+        menu.add_command(label="从这里开始新分支", command=lambda: self.branch_from(index))
+        current, total = self.client.messages.branch_position(index)
+        if total > 1:
+            menu.add_separator()
+            menu.add_command(label=f"上一个分支 ({current}/{total})", command=lambda: self.switch_branch(index, -1))
+            menu.add_command(label=f"下一个分支 ({current}/{total})", command=lambda: self.switch_branch(index, 1))
+        menu.tk_popup(event.x_root, event.y_root)
+    
+    def regenerate(self, index: int):
+        """为第 index 条助手消息生成新的分支回复"""
+        old_ids = self.client.messages.node_ids()
+        self.client.messages.truncate(index)
+        self.show_divergent(old_ids)
+        self.start_request(self.client.messages[-1]["content"] if self.client.messages else "")
+    
+    def edit_message(self, index: int):
+        """编辑第 index 条用户消息，作为新分支重新发送"""
+        content = simpledialog.askstring("编辑消息", "修改后重新发送（原消息保留在其他分支中）:",
+                                         initialvalue=self.client.messages[index]["content"],
+                                         parent=self.root)
+        if not content or not content.strip():
+            return
+        old_ids = self.client.messages.node_ids()
+        self.client.messages.fork(index, {"role": "user", "content": content.strip()})
+        self.client.sync_memory()
+        self.show_divergent(old_ids)
+        self.start_request(content.strip())
+    
+    def branch_from(self, index: int):
+        """回到第 index 条消息，之后发送的消息形成新分支"""
+        old_ids = self.client.messages.node_ids()
+        self.client.messages.truncate(index + 1)
+        self.show_divergent(old_ids)
+        self.add_message("系统", "之后发送的消息将形成新的分支，原来的对话仍可通过右键菜单切换回来。", "system")
+    
+    def switch_branch(self, index: int, step: int):
+        siblings = self.client.messages.siblings(index)
+        current = siblings.index(self.client.messages.node_id(index))
+        old_ids = self.client.messages.node_ids()
+        self.client.messages.switch(index, siblings[(current + step) % len(siblings)])
+        self.show_divergent(old_ids)
+    
+    def ask_export_filename(self, default_name: str):
+        """选择导出文件，格式由扩展名决定"""
+        return filedialog.asksaveasfilename(
+            parent=self.root,
+            initialfile=default_name,
+            defaultextension=".txt",
+            filetypes=[
+                ("文本文件", "*.txt"),
+                ("Markdown", "*.md"),
+                ("JSONL (微调格式)", "*.jsonl"),
+                ("HTML", "*.html"),
+            ]
+        )
     
     def save_chat_history(self):
         """保存聊天记录"""
@@ -643,39 +1448,84 @@ class ChatWindow:
             messagebox.showinfo("提示", "没有聊天记录可保存")
             return
             
-        try:
-            # 保存到文件
-            filename = f"聊天记录_{time.strftime('%Y%m%d_%H%M%S')}.txt"
-            with open(filename, "w", encoding="utf-8") as f:
-                for msg in self.client.messages:
-                    role = msg.get("role", "unknown")
-                    content = msg.get("content", "")
-                    
-                    role_text = "您" if role == "user" else "AI" if role == "assistant" else "系统"
-                    f.write(f"{role_text}:\n{content}\n\n")
+        filename = self.ask_export_filename(f"聊天记录_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+        if not filename:
+            return
+        
+        # 使用快照，后台线程导出时不受新消息影响
+        conversations = [("当前对话", self.client.export_messages())]
+        self.start_export(filename, conversations)
+    
+    def export_all_history(self):
+        """导出全部对话：归档文件中的历史对话加上当前对话"""
+        filename = self.ask_export_filename(f"全部聊天记录_{time.strftime('%Y%m%d_%H%M%S')}.jsonl")
+        if not filename:
+            return
             
+        current = self.client.export_messages() if self.client and self.client.messages else None
+        
+        def conversations():
+            yield from iter_archive()
+            if current is not None:
+                yield "当前对话", current
+        
+        self.start_export(filename, conversations())
+    
+    def start_export(self, filename: str, conversations):
+        """在后台线程中导出，状态栏显示进度"""
+        def on_progress(count):
+            self.root.after(0, lambda: self.status_label.config(text=f"正在导出... 已写出 {count} 条消息"))
+        
+        def on_done(result, error):
+            self.root.after(0, lambda: self.finish_export(result, error))
+        
+        self.save_chat_button.config(state=tk.DISABLED)
+        self.export_all_button.config(state=tk.DISABLED)
+        self.status_label.config(text="正在导出...")
+        ChatExporter(on_progress, on_done).start(filename, conversations)
+    
+    def finish_export(self, filename, error):
+        self.save_chat_button.config(state=tk.NORMAL)
+        self.export_all_button.config(state=tk.NORMAL)
+        self.status_label.config(text="就绪" if not (self.client and self.client.debug_mode) else "调试模式")
+        
+        if error:
+            messagebox.showerror("错误", f"保存聊天记录失败: {error}")
+        elif filename:
             messagebox.showinfo("成功", f"聊天记录已保存到 {filename}")
-        except Exception as e:
-            messagebox.showerror("错误", f"保存聊天记录失败: {e}")
             
     def show_settings(self):
-        SettingsWindow(self.root, self.update_settings, self.update_debug_mode, self.test_connection)
-        
-    def update_settings(self, api_key: str, api_endpoint: str):
-        is_new_client = self.client is None
+        if self.loading:
+            return
+        local_endpoint = self.client.local_backend.base_url if self.client and self.client.local_backend else ""
+        SettingsWindow(self.root, self.update_settings, self.update_debug_mode, self.test_connection,
+                       self.update_profiling, self.profiler.enabled, local_endpoint)
         
+    def update_settings(self, api_key: str, api_endpoint: str, local_endpoint: str = ""):
         self.api_key = api_key
-        if is_new_client:
-            self.client = AIClient(api_key)
-            self.client.base_url = api_endpoint
-        else:
-            self.client.api_key = api_key
-            self.client.base_url = api_endpoint
-            self.client.headers["Authorization"] = f"Bearer {api_key}"
+        if self.client is None:
+            # 如果是新客户端，在后台线程中加载保存的状态（历史、记忆索引）
+            client = self.create_client(api_key)
+            client.base_url = api_endpoint
             
-        # 如果是新客户端，尝试加载保存的状态
-        if is_new_client:
-            self.client.load_state()
+            def load():
+                client.load_state()
+                return client
+            
+            self.reload_client("正在加载聊天记录...", load,
+                               lambda client: self.apply_settings(client, local_endpoint, True))
+            return
+        
+        self.client.api_key = api_key
+        self.client.base_url = api_endpoint
+        self.client.headers["Authorization"] = f"Bearer {api_key}"
+        self.apply_settings(self.client, local_endpoint, False)
+    
+    def apply_settings(self, client: AIClient, local_endpoint: str, is_new_client: bool):
+        self.client = client
+        self.client.set_local_server(local_endpoint)
+        # 密钥或接口地址变化后，之前因 4xx 错误暂停的记忆嵌入重新尝试
+        self.client.memory.retry_parked()
             
         # 创建或更新参数设置框架
         if hasattr(self, 'parameter_frame'):
@@ -697,6 +1547,9 @@ class ChatWindow:
     def update_debug_mode(self, debug_mode: bool):
         if self.client:
             self.client.debug_mode = debug_mode
+            # 调试模式下使用本地嵌入，不请求嵌入接口
+            self.client.memory.set_offline(debug_mode)
+            self.client.sync_memory()
             if debug_mode:
                 self.add_message("系统", "已启用调试模式，不会发送实际API请求。", "system")
                 self.status_label.config(text="调试模式")
@@ -709,75 +1562,57 @@ class ChatWindow:
             
     def clear_chat(self):
         """清空聊天记录"""
-        if not self.client:
+        if not self.client or self.loading:
             return
             
         if messagebox.askyesno("确认", "确定要清空聊天记录吗？"):
-            # 保留系统提示词
-            system_prompt = None
-            for msg in self.client.messages:
-                if msg.get("role") == "system":
-                    system_prompt = msg.get("content")
-                    break
+            # 归档当前对话（在后台线程中写入），便于之后批量导出
+            old_messages = self.client.export_messages()
+            # 只读取角色，不从磁盘加载消息内容
+            messages = self.client.messages
+            has_history = any(messages.role(i) != "system" for i in range(len(messages)))
                     
             # 清空消息历史
-            self.client.messages = []
-            
-            # 如果有系统提示词，重新添加
-            if system_prompt:
-                self.client.messages.append({
-                    "role": "system",
-                    "content": system_prompt
-                })
+            self.client.clear_messages()
             
             # 清空聊天显示
-            self.chat_display.delete(1.0, tk.END)
+            self.clear_display()
+            
+            # 归档和保存状态都在后台线程中完成
+            client = self.client
+            state = client.snapshot_state()
             
-            # 保存状态
-            self.client.save_state()
+            def persist():
+                try:
+                    if has_history:
+                        append_to_archive(old_messages)
+                except Exception as e:
+                    print(f"归档聊天记录失败: {e}")
+                client.write_state(state)
+                # 索引已清空，旧的索引文件不能再用
+                client.memory.save()
+            
+            thread = threading.Thread(target=persist)
+            thread.daemon = True
+            thread.start()
             
             self.add_message("系统", "聊天记录已清空。", "system")
     
-    def send_message_thread(self, message):
+    def send_message_thread(self, message, token=None):
+        """为当前分支末尾的用户消息请求回复，message 用于召回相关的早期对话"""
         try:
-            # 如果有系统提示词且是第一条消息，加入系统提示词
-            if self.client.parameters["system_prompt"] and not self.client.messages:
-                self.client.messages.append({
-                    "role": "system",
-                    "content": self.client.parameters["system_prompt"]
-                })
-            
-            # 添加用户消息到历史记录
-            self.client.messages.append({
-                "role": "user",
-                "content": message
-            })
-            
-            # 按照API文档构建请求数据
-            request_data = {
-                "model": self.client.parameters["model"],
-                "messages": self.client.messages,
-                "temperature": self.client.parameters["temperature"],
-                "max_tokens": self.client.parameters["max_tokens"],
-                "stream": False,
-                "top_p": self.client.parameters["top_p"],
-                "top_k": self.client.parameters["top_k"],
-                "frequency_penalty": self.client.parameters["frequency_penalty"],
-                "n": self.client.parameters["n"]
-            }
-            
-            # 添加可选参数
-            if self.client.parameters["stop"] is not None:
-                request_data["stop"] = self.client.parameters["stop"]
+            # 按照API文档构建请求数据，参数顺序和消息前缀保持稳定
+            request_data = self.client.build_request(self.client.build_context(message))
             
             # 更新UI状态
             self.root.after(0, lambda: self.status_label.config(text="正在请求中..."))
             
-            # 发送请求
-            response = self.client.make_request("chat/completions", request_data)
+            if request_data["stream"]:
+                self.stream_response(request_data, token)
+                return
             
-            # 保存当前状态
-            self.client.save_state()
+            # 发送请求
+            response = self.client.make_request("chat/completions", request_data, token)
             
             # 在主线程中更新UI
             self.root.after(0, lambda: self.handle_response(response))
@@ -787,80 +1622,430 @@ class ChatWindow:
             print(error_msg)
             self.root.after(0, lambda: self.show_thread_error(error_msg))
             
+    def stream_response(self, request_data: Dict[str, Any], token=None):
+        """在请求线程中接收流式回复，增量内容合并后交给主线程渲染"""
+        self.root.after(0, self.start_stream)
+        parts = []
+        reasoning_parts = []
+        # 兼容把思考过程写在正文 <think> 标签里的服务商
+        splitter = ThinkTagSplitter()
+        error = None
+        usage = None
+        
+        def emit(reasoning_piece, content_piece):
+            if reasoning_piece:
+                reasoning_parts.append(reasoning_piece)
+                self.queue_stream_delta(reasoning_piece, "reasoning")
+            if content_piece:
+                parts.append(content_piece)
+                self.queue_stream_delta(content_piece, "content")
+        
+        try:
+            for chunk in self.client.stream_request("chat/completions", request_data, token):
+                if "error" in chunk:
+                    error = chunk["error"]
+                    break
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                choices = chunk.get("choices") or []
+                if not choices:
+                    continue
+                delta = choices[0].get("delta") or {}
+                reasoning_piece, content_piece = splitter.feed(delta.get("content") or "")
+                emit((delta.get("reasoning_content") or "") + reasoning_piece, content_piece)
+        except Exception as e:
+            error = f"接收回复时出错: {str(e)}"
+            print(error)
+        emit(*splitter.flush())
+        
+        content = "".join(parts)
+        reasoning = "".join(reasoning_parts)
+        self.root.after(0, lambda: self.finish_stream(content, reasoning, error, usage))
+    
+    def start_stream(self):
+        # 删除"发送中"消息
+        self.remove_waiting()
+        index = len(self.client.messages)
+        self.set_message_mark(index)
+        self.stream_label = self.branch_label("AI", index)
+        self.chat_display.insert(tk.END, f"\n{self.stream_label}:\n", "ai")
+        # 思考过程和正文的显示区域在收到第一段对应内容时再创建
+        self.stream_view = None
+        self.reasoning_view = None
+        self.reasoning_parts = []
+        self.status_label.config(text="正在接收回复...")
+    
+    def queue_stream_delta(self, piece: str, kind: str = "content"):
+        """请求线程调用：缓存增量内容，同一时间最多排队一次刷新"""
+        with self.stream_lock:
+            self.stream_pending.append((kind, piece))
+            if self.stream_flush_scheduled:
+                return
+            self.stream_flush_scheduled = True
+        self.root.after(30, self.flush_stream)
+    
+    def flush_stream(self):
+        with self.stream_lock:
+            pending = self.stream_pending
+            self.stream_pending = []
+            self.stream_flush_scheduled = False
+        reasoning = "".join(piece for kind, piece in pending if kind == "reasoning")
+        text = "".join(piece for kind, piece in pending if kind == "content")
+        
+        # 思考过程只在正文开始之前显示为可折叠区域，正文开始后仅累计保存
+        if reasoning:
+            if self.reasoning_view is None and self.stream_view is None:
+                parts = self.reasoning_parts
+                self.reasoning_view = ReasoningView(self.chat_display, lambda: "".join(parts), finished=False)
+            self.reasoning_parts.append(reasoning)
+            if self.reasoning_view:
+                self.reasoning_view.append(reasoning)
+        if text:
+            if self.stream_view is None:
+                self.stream_view = MarkdownStream(self.chat_display, self.md_cache, ("ai",))
+            self.stream_view.feed(text)
+        if reasoning or text:
+            self.chat_display.see(tk.END)
+    
+    def finish_stream(self, content: str, reasoning: str, error, usage=None):
+        self.flush_stream()
+        self.show_usage(usage)
+        if self.reasoning_view:
+            self.reasoning_view.finish()
+            self.reasoning_view = None
+        if self.stream_view:
+            self.stream_view.finish()
+            self.stream_view = None
+        # 只有思考过程时用占位内容作为回复，思考过程仍然单独保存，不进入之后的请求
+        if reasoning and not content:
+            content = REASONING_ONLY_REPLY
+            render_markdown(self.chat_display, content, self.md_cache, ("ai",))
+        self.chat_display.insert(tk.END, "\n")
+        
+        # 恢复状态
+        self.status_label.config(text="就绪" if not self.client.debug_mode else "调试模式")
+        self.send_button.config(state=tk.NORMAL)
+        self.stop_button.config(state=tk.DISABLED)
+        self.busy = False
+        
+        # 出错前或停止前已收到的部分内容仍然保留在历史记录中
+        if content:
+            self.client.add_assistant_message(content, reasoning)
+            # 与已有分支内容相同的回复会复用原节点，分支序号需要重新显示
+            index = len(self.client.messages) - 1
+            if self.branch_label("AI", index) != self.stream_label:
+                self.show_divergent(self.client.messages.node_ids()[:index])
+        if error == CANCELLED_ERROR:
+            self.show_error("已停止生成。")
+        elif error:
+            self.show_error(f"错误: {error}")
+        elif not content:
+            self.show_error("收到响应，但没有内容。")
+        self.request_finished(error)
+    
     def handle_response(self, response):
         # 删除"发送中"消息
-        self.chat_display.delete("end-3l", "end-1l")
+        self.remove_waiting()
         
         # 恢复状态
         self.status_label.config(text="就绪" if not self.client.debug_mode else "调试模式")
         self.send_button.config(state=tk.NORMAL)
+        self.stop_button.config(state=tk.DISABLED)
+        self.busy = False
         
-        if "error" in response:
+        self.show_usage(response.get("usage"))
+        if response.get("error") == CANCELLED_ERROR:
+            self.show_error("已停止生成。")
+        elif "error" in response:
             self.show_error(f"错误: {response['error']}")
         else:
-            try:
-                # 显示AI回复 - 处理多种可能的响应格式
-                ai_response = ""
-                
-                # 尝试解析不同格式的响应
-                if "choices" in response:
-                    choices = response["choices"]
-                    if choices and isinstance(choices, list):
-                        choice = choices[0]
-                        
-                        # 格式1: {"choices":[{"message":{"content":"回复内容"}}]}
-                        if "message" in choice and isinstance(choice["message"], dict):
-                            ai_response = choice["message"].get("content", "")
-                        
-                        # 格式2: {"choices":[{"text":"回复内容"}]}
-                        elif "text" in choice:
-                            ai_response = choice["text"]
-                        
-                        # 格式3: 其他可能的格式
-                        else:
-                            ai_response = str(choice)
-                
-                # 如果没有找到有效的响应内容
-                if not ai_response:
-                    ai_response = "收到响应，但无法解析内容。原始响应: " + str(response)
-                
-                self.add_message("AI", ai_response, "ai")
-                
-                # 添加AI回复到历史记录
-                self.client.messages.append({
-                    "role": "assistant",
-                    "content": ai_response
-                })
-            except Exception as e:
-                self.show_error(f"解析响应出错: {str(e)}\n原始响应: {str(response)}")
+            self.show_reply(response)
+        self.request_finished(response.get("error"))
+    
+    def show_reply(self, response):
+        """解析非流式回复，加入历史记录并显示"""
+        try:
+            # 显示AI回复 - 处理多种可能的响应格式
+            ai_response = ""
+            reasoning = ""
+            
+            # 尝试解析不同格式的响应
+            if "choices" in response:
+                choices = response["choices"]
+                if choices and isinstance(choices, list):
+                    choice = choices[0]
+                    
+                    # 格式1: {"choices":[{"message":{"content":"回复内容"}}]}
+                    if "message" in choice and isinstance(choice["message"], dict):
+                        ai_response = choice["message"].get("content") or ""
+                        # 推理模型的思考过程，单独保存
+                        reasoning = choice["message"].get("reasoning_content") or ""
+                    
+                    # 格式2: {"choices":[{"text":"回复内容"}]}
+                    elif "text" in choice:
+                        ai_response = choice["text"]
+                    
+                    # 格式3: 其他可能的格式
+                    else:
+                        ai_response = str(choice)
+            
+            # 思考过程写在正文 <think> 标签中的情况
+            think, ai_response = split_think_tags(ai_response)
+            reasoning += think
+            
+            # 只有思考过程时用占位内容作为回复；什么都没有时不写入历史
+            if not ai_response and reasoning:
+                ai_response = REASONING_ONLY_REPLY
+            if not ai_response:
+                self.show_error("收到响应，但无法解析内容。原始响应: " + str(response))
+                return
+            
+            # 添加AI回复到历史记录，思考过程不进入之后的请求
+            self.client.add_assistant_message(ai_response, reasoning)
+            
+            self.add_message("AI", ai_response, "ai", reasoning, index=len(self.client.messages) - 1)
+        except Exception as e:
+            self.show_error(f"解析响应出错: {str(e)}\n原始响应: {str(response)}")
+    
+    def request_finished(self, error=None):
+        """回复结束：出错或停止时暂停队列，否则稍后自动发送队列中的下一条消息"""
+        # 回复已写入历史，在界面线程中取快照后由后台线程保存
+        self.save_state_in_background()
+        if error and len(self.message_queue):
+            self.queue_paused = True
+            self.status_label.config(text="消息队列已暂停，输入框为空时按发送继续")
+        # 等当前回复处理完再发送，保证下一条消息基于完整的历史
+        self.root.after(0, self.process_queue)
+    
+    def enqueue_message(self, message: str):
+        item = self.message_queue.add(message, self.parallel_var.get())
+        if item.independent:
+            self.start_prefetch(item)
+        self.refresh_queue()
+    
+    def start_prefetch(self, item):
+        """独立消息不等前面的回复，立即作为单轮请求发送"""
+        def request(text):
+            system = self.client.system_message()
+            messages = ([system] if system else []) + [{"role": "user", "content": text}]
+            data = self.client.build_request(messages, n=1, stream=False)
+            return self.client.make_request("chat/completions", data)
+        
+        def on_done(_):
+            self.root.after(0, self.prefetch_updated)
+        
+        self.message_queue.prefetch(item, request, on_done)
+    
+    def prefetch_updated(self):
+        self.refresh_queue()
+        self.process_queue()
+    
+    def process_queue(self):
+        """按顺序发送队列中的消息：依赖上下文的消息在空闲时发送，已完成的并行请求直接写入对话"""
+        if not len(self.message_queue):
+            self.queue_paused = False
+        written = False
+        while not self.busy and not self.loading and not self.queue_paused and len(self.message_queue):
+            item = self.message_queue[0]
+            if not item.independent:
+                self.message_queue.pop()
+                self.refresh_queue()
+                self.submit_message(item.text)
+                break
+            if item.state == "failed":
+                self.queue_paused = True
+                self.status_label.config(text="消息队列已暂停")
+                self.show_error(f"排队消息请求失败: {item.response['error']}\n"
+                                "可以编辑该消息重试或删除它，然后在输入框为空时按发送继续。")
+                break
+            if item.state != "done":
+                # 等待并行请求完成
+                break
+            self.message_queue.pop()
+            self.client.messages.append({"role": "user", "content": item.text})
+            self.client.sync_memory()
+            self.add_message("您", item.text, "user", index=len(self.client.messages) - 1)
+            self.show_usage(item.response.get("usage"))
+            self.show_reply(item.response)
+            written = True
+        if written:
+            self.save_state_in_background()
+        self.refresh_queue()
+    
+    def save_state_in_background(self):
+        """保存状态需要序列化整个历史并读取溢出到磁盘的消息，不在界面线程中进行
+        
+        快照在界面线程中获取，后台线程序列化时界面仍可以继续修改对话。
+        """
+        state = self.client.snapshot_state()
+        thread = threading.Thread(target=self.client.write_state, args=(state,))
+        thread.daemon = True
+        thread.start()
+    
+    def refresh_queue(self):
+        """刷新队列列表，队列为空时隐藏"""
+        selection = self.queue_list.curselection()
+        self.queue_list.delete(0, tk.END)
+        for item in self.message_queue.items:
+            self.queue_list.insert(tk.END, item.label())
+        if selection and selection[0] < len(self.message_queue):
+            self.queue_list.selection_set(selection[0])
+        if len(self.message_queue):
+            self.queue_frame.pack(fill=tk.X, padx=10, pady=2, after=self.input_frame)
+        else:
+            self.queue_frame.pack_forget()
+    
+    def selected_queued(self) -> Optional[int]:
+        selection = self.queue_list.curselection()
+        return selection[0] if selection else None
+    
+    def edit_queued(self):
+        """编辑排队的消息；并行消息会用新内容重新请求"""
+        index = self.selected_queued()
+        if index is None:
+            return
+        item = self.message_queue[index]
+        text = simpledialog.askstring("编辑排队消息", "修改后的消息:", initialvalue=item.text, parent=self.root)
+        if not text or not text.strip():
+            return
+        item.reset(text.strip())
+        if item.independent:
+            self.start_prefetch(item)
+        self.refresh_queue()
+    
+    def remove_queued(self):
+        index = self.selected_queued()
+        if index is None:
+            return
+        self.message_queue.remove(index)
+        self.refresh_queue()
+        self.process_queue()
+    
+    def move_queued(self, step: int):
+        index = self.selected_queued()
+        if index is None:
+            return
+        target = self.message_queue.move(index, step)
+        self.queue_list.selection_clear(0, tk.END)
+        self.queue_list.selection_set(target)
+        self.refresh_queue()
+        self.process_queue()
+    
+    def clear_queue(self):
+        self.message_queue.clear()
+        self.queue_paused = False
+        self.refresh_queue()
         
     def send_message(self):
+        # 重启或加载期间输入框中的内容保留，加载完成后再发送
+        if self.loading:
+            return
         if not self.client:
             messagebox.showerror("错误", "请先设置API密钥")
             return
             
         message = self.message_input.get().strip()
         if not message:
+            # 输入为空时继续已暂停的队列
+            if self.queue_paused:
+                self.queue_paused = False
+                self.process_queue()
             return
             
         # 清空输入框
         self.message_input.delete(0, tk.END)
         
-        # 显示用户消息
-        self.add_message("您", message, "user")
+        # 正在等待回复或前面还有排队的消息时进入队列
+        if self.busy or len(self.message_queue):
+            self.enqueue_message(message)
+            return
+        self.submit_message(message)
+    
+    def submit_message(self, message: str):
+        """把用户消息加入对话并请求回复"""
+        # 添加用户消息到当前分支，系统提示词在构建请求时放在固定位置
+        self.client.messages.append({
+            "role": "user",
+            "content": message
+        })
+        self.client.sync_memory()
         
-        # 显示发送中消息
+        # 显示用户消息
+        self.add_message("您", message, "user", index=len(self.client.messages) - 1)
+        self.start_request(message)
+    
+    def start_request(self, message: str):
+        """为当前分支请求回复"""
+        # 显示发送中消息，记录位置以便收到回复时准确删除
+        self.chat_display.mark_set("waiting", "end-1c")
+        self.chat_display.mark_gravity("waiting", tk.LEFT)
         self.add_message("系统", "正在等待AI回复...", "system")
+        # 结束标记也向左靠，之后插入的提示不会被包含在删除范围内
+        self.chat_display.mark_set("waiting_end", "end-1c")
+        self.chat_display.mark_gravity("waiting_end", tk.LEFT)
         
-        # 禁用发送按钮
-        self.send_button.config(state=tk.DISABLED)
+        # 发送按钮保持可用，等待期间发送的消息进入队列
+        self.busy = True
+        self.stop_button.config(state=tk.NORMAL)
+        self.request_token = CancelToken()
         
         # 在新线程中发送请求
-        thread = threading.Thread(target=self.send_message_thread, args=(message,))
+        thread = threading.Thread(target=self.send_message_thread, args=(message, self.request_token))
         thread.daemon = True
         thread.start()
     
-    def add_message(self, sender: str, message: str, sender_type: str):
+    def show_usage(self, usage):
+        """在状态栏显示提示词用量和服务端报告的缓存命中"""
+        if not usage:
+            return
+        self.client.record_usage(usage)
+        prompt = usage.get("prompt_tokens") or 0
+        cached = cached_tokens(usage)
+        text = f"提示 {prompt} tokens"
+        if cached:
+            text += f"，缓存命中 {cached} ({cached / max(prompt, 1):.0%})"
+        totals = self.client.usage_totals
+        if totals["requests"] > 1 and totals["prompt_tokens"]:
+            text += f"  本次会话命中率 {totals['cached_tokens'] / totals['prompt_tokens']:.0%}"
+        self.usage_label.config(text=text)
+    
+    def stop_generation(self):
+        """停止当前回复，已收到的内容会保留"""
+        if self.client:
+            self.stop_button.config(state=tk.DISABLED)
+            self.status_label.config(text="正在停止...")
+            if self.request_token:
+                self.request_token.cancel()
+    
+    def remove_waiting(self):
+        """删除"发送中"消息"""
+        if "waiting" in self.chat_display.mark_names():
+            self.chat_display.delete("waiting", "waiting_end")
+            self.chat_display.mark_unset("waiting", "waiting_end")
+    
+    def set_message_mark(self, index: int):
+        """在聊天区末尾标记第 index 条消息的开始位置，切换分支时从这里开始重新渲染"""
+        mark = f"msg_{index}"
+        self.chat_display.mark_set(mark, "end-1c")
+        self.chat_display.mark_gravity(mark, tk.LEFT)
+    
+    def add_message(self, sender: str, message: str, sender_type: str,
+                    reasoning: Union[str, Callable[[], str]] = "", index: Optional[int] = None):
+        # 属于对话历史的消息记录位置标记，并显示分支序号
+        if index is not None:
+            self.set_message_mark(index)
+            sender = self.branch_label(sender, index)
+        
+        # AI 回复按 Markdown 渲染，思考过程默认折叠，展开时才插入正文
+        if sender_type == "ai":
+            self.chat_display.insert(tk.END, f"\n{sender}:\n", "ai")
+            if reasoning:
+                ReasoningView(self.chat_display, reasoning if callable(reasoning) else lambda: reasoning)
+            render_markdown(self.chat_display, message, self.md_cache, ("ai",))
+            self.chat_display.insert(tk.END, "\n")
+            self.chat_display.see(tk.END)
+            return
+            
         self.chat_display.insert(tk.END, f"\n{sender}:\n{message}\n")
         self.chat_display.see(tk.END)
         
@@ -868,9 +2053,6 @@ class ChatWindow:
         if sender_type == "user":
             self.chat_display.tag_add("user", "end-2c linestart", "end-1c")
             self.chat_display.tag_config("user", foreground="blue")
-        elif sender_type == "ai":
-            self.chat_display.tag_add("ai", "end-2c linestart", "end-1c")
-            self.chat_display.tag_config("ai", foreground="green")
         else:
             self.chat_display.tag_add("system", "end-2c linestart", "end-1c")
             self.chat_display.tag_config("system", foreground="gray")
@@ -880,70 +2062,167 @@ class ChatWindow:
     
     def show_thread_error(self, error_msg):
         # 删除"发送中"消息
-        self.chat_display.delete("end-3l", "end-1l")
+        self.remove_waiting()
         
         # 恢复UI状态
         self.status_label.config(text="就绪" if not self.client.debug_mode else "调试模式")
         self.send_button.config(state=tk.NORMAL)
+        self.stop_button.config(state=tk.DISABLED)
+        self.busy = False
         
         # 显示错误信息
         self.show_error(error_msg)
+        self.request_finished(error_msg)
 
     def restart_app(self):
         """重启应用程序，保留参数和聊天记录"""
+        if self.loading:
+            return
         if messagebox.askyesno("确认", "确定要重启程序吗？聊天记录和参数设置将被保留。"):
-            # 保存当前状态
-            if self.client:
-                self.client.save_state()
-                
+            old_client = self.client
+            api_key = self.api_key
+            state = old_client.snapshot_state() if old_client else None
+            
             # 清空聊天显示区域，保留消息历史
-            self.chat_display.delete(1.0, tk.END)
+            self.clear_display()
             
-            # 恢复状态
-            self.status_label.config(text="就绪")
-            self.send_button.config(state=tk.NORMAL)
+            # 保存和重新加载状态都在后台线程中完成
+            def reload():
+                if old_client:
+                    old_client.write_state(state)
+                    old_client.memory.save()
+                client = None
+                if api_key:
+                    client = self.create_client(api_key)
+                    client.load_state()
+                return client
             
-            # 重新加载客户端
-            if self.api_key:
-                self.client = AIClient(self.api_key)
-                self.client.load_state()
-                
-                # 重新加载消息历史到界面
-                self.load_chat_history()
+            self.reload_client("正在重启...", reload, self.finish_restart)
+    
+    def reload_client(self, status: str, load: Callable[[], Optional[AIClient]],
+                      on_loaded: Callable[[Optional[AIClient]], None]):
+        """在后台线程中运行 load，完成后在界面线程中调用 on_loaded(load 的返回值)
+        
+        期间发送、右键菜单、清空和队列都暂停，避免修改正在保存或即将被替换的对话。
+        """
+        self.loading = True
+        self.status_label.config(text=status)
+        self.send_button.config(state=tk.DISABLED)
+        
+        def run():
+            client = load()
+            self.root.after(0, lambda: self.finish_reload(client, on_loaded))
+        
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+    
+    def finish_reload(self, client: Optional[AIClient], on_loaded: Callable[[Optional[AIClient]], None]):
+        self.loading = False
+        self.send_button.config(state=tk.NORMAL)
+        on_loaded(client)
+        self.status_label.config(text="就绪" if not (self.client and self.client.debug_mode) else "调试模式")
+        # 加载期间完成的并行请求现在写入对话
+        self.process_queue()
+    
+    def finish_restart(self, client):
+        """重启的后台加载完成后刷新界面"""
+        # 重新加载客户端
+        if client:
+            self.client = client
+            
+            # 重新加载消息历史到界面
+            self.load_chat_history()
+            
+            # 刷新参数面板
+            if hasattr(self, 'parameter_frame'):
+                self.parameter_frame.destroy()
                 
-                # 刷新参数面板
-                if hasattr(self, 'parameter_frame'):
-                    self.parameter_frame.destroy()
-                    
-                self.parameter_frame = ParameterFrame(
-                    self.param_frame,
-                    self.client.parameters,
-                    self.update_parameters
-                )
-                self.parameter_frame.pack(fill=tk.X, padx=5, pady=5)
-            
-            # 添加欢迎消息
-            self.add_message("系统", "程序已重启，参数设置和聊天记录已保留。", "system")
+            self.parameter_frame = ParameterFrame(
+                self.param_frame,
+                self.client.parameters,
+                self.update_parameters
+            )
+            self.parameter_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        # 添加欢迎消息
+        self.add_message("系统", "程序已重启，参数设置和聊天记录已保留。", "system")
 
-    def test_connection(self, api_key: str, api_endpoint: str, debug_mode: bool) -> Dict[str, Any]:
+    def show_arena(self):
+        if not self.client:
+            messagebox.showerror("错误", "请先设置API密钥")
+            return
+        ArenaWindow(self.root, self.client, self.use_model)
+    
+    def use_model(self, model: str):
+        """切换当前使用的模型并刷新参数面板"""
+        self.client.parameters["model"] = model
+        if hasattr(self, 'parameter_frame'):
+            self.parameter_frame.destroy()
+            
+        self.parameter_frame = ParameterFrame(
+            self.param_frame,
+            self.client.parameters,
+            self.update_parameters
+        )
+        self.parameter_frame.pack(fill=tk.X, padx=5, pady=5)
+        self.add_message("系统", f"已切换到模型 {model}", "system")
+    
+    def show_sweep(self):
+        if not self.client:
+            messagebox.showerror("错误", "请先设置API密钥")
+            return
+        SweepWindow(self.root, self.client, self.apply_parameters)
+    
+    def apply_parameters(self, values: Dict[str, Any]):
+        """使用参数扫描中选中的一组参数并刷新参数面板"""
+        self.client.parameters.update(values)
+        if hasattr(self, 'parameter_frame'):
+            self.parameter_frame.destroy()
+            
+        self.parameter_frame = ParameterFrame(
+            self.param_frame,
+            self.client.parameters,
+            self.update_parameters
+        )
+        self.parameter_frame.pack(fill=tk.X, padx=5, pady=5)
+        settings = ", ".join(f"{name}={value}" for name, value in values.items())
+        self.add_message("系统", f"已应用参数: {settings}", "system")
+    
+    def test_connection(self, api_key: str, api_endpoint: str, debug_mode: bool,
+                        local_endpoint: str = "") -> Dict[str, Any]:
         """测试API连接"""
         # 创建临时客户端进行测试
         temp_client = AIClient(api_key)
         temp_client.base_url = api_endpoint
         temp_client.debug_mode = debug_mode
+        temp_client.set_local_server(local_endpoint)
+        if self.client:
+            temp_client.parameters["model"] = self.client.parameters["model"]
         
         # 执行连接测试
         result = temp_client.test_connection()
         return result
 
 def main():
+    parser = argparse.ArgumentParser(description="AI 聊天助手")
+    parser.add_argument("--profile", action="store_true", help="启动时开启性能分析")
+    parser.add_argument("--profile-dir", default=PROFILE_DIR, help="性能分析输出目录")
+    parser.add_argument("--profile-mode", choices=["span", "session"], default="span",
+                        help="span: 每种区间单独保存; session: 只保存会话汇总")
+    args = parser.parse_args()
+    
+    profiler = Profiler(args.profile_dir, args.profile_mode)
+    if args.profile:
+        profiler.start()
+    
     root = tk.Tk()
     
     # 创建自定义样式
     style = ttk.Style()
     style.configure('Accent.TButton', font=('微软雅黑', 10, 'bold'))
     
-    app = ChatWindow(root)
+    app = ChatWindow(root, profiler)
     root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable
+
+from backends import cached_tokens
+
+# 对比结果的基准记录文件，每次对比追加一行
+BENCHMARK_FILE = "benchmarks.jsonl"
+
+
+class ArenaRun:
+    """单个模型的一次请求，由请求线程写入，界面线程定时读取"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.parts: List[str] = []
+        self.reasoning_chars = 0
+        self.chunks = 0
+        self.start: Optional[float] = None
+        self.first_token: Optional[float] = None
+        self.end: Optional[float] = None
+        self.usage: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.end is not None
+
+    def ttft(self) -> Optional[float]:
+        if self.start is None or self.first_token is None:
+            return None
+        return self.first_token - self.start
+
+    def latency(self) -> Optional[float]:
+        if self.start is None:
+            return None
+        return (self.end or time.perf_counter()) - self.start
+
+    def completion_tokens(self) -> int:
+        """优先使用服务端返回的用量，否则用数据块数量近似"""
+        return self.usage.get("completion_tokens") or self.chunks
+
+    def tokens_per_second(self) -> Optional[float]:
+        if self.first_token is None:
+            return None
+        elapsed = (self.end or time.perf_counter()) - self.first_token
+        if elapsed <= 0:
+            return None
+        return self.completion_tokens() / elapsed
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "ttft": self.ttft(),
+            "latency": self.latency(),
+            "tokens_per_second": self.tokens_per_second(),
+            "prompt_tokens": self.usage.get("prompt_tokens"),
+            "cached_tokens": cached_tokens(self.usage),
+            "completion_tokens": self.completion_tokens(),
+            "content_chars": sum(len(p) for p in self.parts),
+            "reasoning_chars": self.reasoning_chars,
+            "error": self.error,
+        }
+
+
+def run_stream(client, run: ArenaRun, data: Dict[str, Any]):
+    """通过 client 发送流式请求并记录计时"""
+    run.start = time.perf_counter()
+    try:
+        for chunk in client.stream_request("chat/completions", data):
+            if "error" in chunk:
+                run.error = chunk["error"]
+                break
+            if chunk.get("usage"):
+                run.usage = chunk["usage"]
+            choices = chunk.get("choices") or []
+            if not choices:
+                continue
+            delta = choices[0].get("delta") or {}
+            content = delta.get("content") or ""
+            reasoning = delta.get("reasoning_content") or ""
+            if content or reasoning:
+                if run.first_token is None:
+                    run.first_token = time.perf_counter()
+                run.chunks += 1
+                run.reasoning_chars += len(reasoning)
+                if content:
+                    run.parts.append(content)
+    except Exception as e:
+        run.error = str(e)
+    finally:
+        run.end = time.perf_counter()
+
+
+class ModelArena:
+    """把同一段对话并发发送给多个模型，比较首字延迟、总耗时和生成速度"""
+
+    def __init__(self, client, models: List[str], messages: List[Dict[str, str]],
+                 parameters: Dict[str, Any], benchmark_file: str = BENCHMARK_FILE):
+        self.client = client
+        self.messages = messages
+        self.parameters = parameters
+        self.benchmark_file = benchmark_file
+        self.runs = [ArenaRun(model) for model in models]
+        self.thread: Optional[threading.Thread] = None
+
+    def request_data(self, model: str) -> Dict[str, Any]:
+        # 与聊天请求相同的参数顺序，服务端会在最后一个数据块中返回用量
+        return self.client.build_request(self.messages, self.parameters, model=model, n=1, stream=True)
+
+    @property
+    def done(self) -> bool:
+        return all(run.done for run in self.runs)
+
+    def start(self, on_done: Optional[Callable[["ModelArena"], None]] = None):
+        """在后台并发运行所有模型，完成后写入基准记录"""
+        def run_all():
+            with ThreadPoolExecutor(max_workers=len(self.runs)) as pool:
+                for run in self.runs:
+                    pool.submit(run_stream, self.client, run, self.request_data(run.model))
+            self.save_record()
+            if on_done:
+                on_done(self)
+
+        self.thread = threading.Thread(target=run_all)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save_record(self):
+        record = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "base_url": self.client.base_url,
+            "debug": self.client.debug_mode,
+            "max_tokens": self.parameters["max_tokens"],
+            "prompt_chars": sum(len(m.get("content", "")) for m in self.messages),
+            "results": [run.summary() for run in self.runs],
+        }
+        try:
+            with open(self.benchmark_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"保存基准记录失败: {e}")
+
+
+def summarize_benchmarks(filename: str = BENCHMARK_FILE) -> Dict[str, Dict[str, Any]]:
+    """按模型汇总历史基准记录（中位数），忽略调试模式和失败的请求"""
+    samples: Dict[str, Dict[str, List[float]]] = {}
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("debug"):
+                continue
+            for result in record.get("results", []):
+                if result.get("error"):
+                    continue
+                model = samples.setdefault(result["model"], {"ttft": [], "latency": [], "tokens_per_second": []})
+                for key in model:
+                    if result.get(key) is not None:
+                        model[key].append(result[key])
+
+    summary = {}
+    for name, values in samples.items():
+        summary[name] = {"runs": len(values["latency"])}
+        for key, items in values.items():
+            summary[name][key] = statistics.median(items) if items else None
+    return summary
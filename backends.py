@@ -0,0 +1,473 @@
+import json
+import time
+import threading
+from typing import Dict, Any, Iterator, Optional, Set, Callable, Union, List
+
+import requests
+
+from memory_index import HashEmbedder
+from deadlines import (ThroughputTracker, Deadline, make_deadline, stream_monitor, interrupt_response,
+                       CONNECT_TIMEOUT, IDLE_TIMEOUT)
+
+# 默认的远程服务地址和本地 OpenAI 兼容服务地址
+DEFAULT_BASE_URL = "https://api.siliconflow.cn/v1"
+LOCAL_BASE_URL = "http://127.0.0.1:8000/v1"
+
+# 请求被用户取消时返回的错误信息
+CANCELLED_ERROR = "请求已取消"
+
+DEBUG_REPLY = "这是一个调试模式的模拟回复。实际使用时请关闭调试模式。"
+
+# 这些接口的请求和响应很大（例如嵌入向量）且调用频繁，不打印调试输出
+QUIET_ENDPOINTS = {"embeddings"}
+
+
+def cached_tokens(usage: Optional[Dict[str, Any]]) -> int:
+    """服务端报告的提示词缓存命中 token 数，不同服务商使用的字段不同"""
+    if not usage:
+        return 0
+    details = usage.get("prompt_tokens_details") or {}
+    return details.get("cached_tokens") or usage.get("prompt_cache_hit_tokens") or 0
+
+
+class CancelToken:
+    """单个请求的取消句柄
+
+    由发起请求的一方创建并传给 request/stream，cancel 只影响使用这个句柄的请求，
+    同时进行的其他请求（记忆嵌入、模型对比、参数扫描等）不受影响。
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        # 正在读取的响应，取消时关闭以中断读取
+        self.responses = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def cancel(self):
+        with self.lock:
+            self.event.set()
+            responses = list(self.responses)
+        for response in responses:
+            interrupt_response(response)
+
+    def attach(self, response) -> bool:
+        """登记正在读取的响应，已取消时返回 False"""
+        with self.lock:
+            if self.event.is_set():
+                return False
+            self.responses.add(response)
+            return True
+
+    def detach(self, response):
+        with self.lock:
+            self.responses.discard(response)
+
+    def wait(self, seconds: float) -> bool:
+        """可被取消的等待，返回 False 表示等待期间请求被取消"""
+        return not self.event.wait(max(0.0, seconds))
+
+
+class Backend:
+    """后端接口：普通请求和流式请求
+
+    request 返回解析后的响应，出错时返回带 error 字段的字典；
+    stream 逐个返回 SSE 数据块，出错时返回带 error 字段的数据块后结束。
+    token 为 None 的请求不能取消。
+    """
+    name = "base"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def request(self, endpoint: str, data: Dict[str, Any],
+                token: Optional[CancelToken] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def stream(self, endpoint: str, data: Dict[str, Any],
+               token: Optional[CancelToken] = None) -> Iterator[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def test(self, model: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class HTTPBackend(Backend):
+    """通过 requests 访问 OpenAI 风格的 HTTP 接口
+
+    非流式请求在收到响应之前无法中断，取消后丢弃结果；流式请求取消时立即关闭连接。
+    """
+    name = "http"
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, headers: Optional[Dict[str, str]] = None,
+                 proxies: Optional[Dict[str, Any]] = None, max_retries: int = 3,
+                 connect_timeout: float = CONNECT_TIMEOUT, idle_timeout: float = IDLE_TIMEOUT):
+        super().__init__()
+        self.base_url = base_url
+        self.headers = headers if headers is not None else {"Content-Type": "application/json"}
+        # 默认禁用代理设置
+        self.proxies = proxies if proxies is not None else {"http": None, "https": None}
+        self.max_retries = max_retries
+        self.connect_timeout = connect_timeout
+        self.idle_timeout = idle_timeout
+        # 按模型观测的生成速度，用于估算每个请求的截止时间
+        self.tracker = ThroughputTracker()
+
+    def deadline(self, data: Dict[str, Any]) -> Deadline:
+        return make_deadline(self.tracker, data, self.connect_timeout, self.idle_timeout)
+
+    def request(self, endpoint: str, data: Dict[str, Any],
+                token: Optional[CancelToken] = None) -> Dict[str, Any]:
+        url = f"{self.base_url}/{endpoint}"
+        token = token or CancelToken()
+        deadline = self.deadline(data)
+        verbose = endpoint not in QUIET_ENDPOINTS
+
+        # 打印请求数据，用于调试
+        if verbose:
+            print("请求URL:", url)
+            print("请求头:", self.headers)
+            print("请求数据:", json.dumps(data, ensure_ascii=False, indent=2))
+            print(f"请求时间预算: {deadline.total:.0f} 秒")
+
+        retries = 0
+        while retries <= self.max_retries:
+            try:
+                # 使用无代理设置发送请求，读取超时为剩余的时间预算
+                started = time.monotonic()
+                response = requests.post(url, headers=self.headers, json=data, proxies=self.proxies,
+                                         timeout=deadline.request_timeout())
+                if token.cancelled:
+                    return {"error": CANCELLED_ERROR}
+
+                # 打印响应状态和内容，用于调试
+                if verbose:
+                    print("响应状态码:", response.status_code)
+                    try:
+                        print("响应内容:", json.dumps(response.json(), ensure_ascii=False, indent=2))
+                    except:
+                        print("响应内容:", response.text)
+
+                response.raise_for_status()
+                result = response.json()
+                # 非流式请求无法区分首字延迟和生成时间，按总耗时计算的速度偏保守
+                usage = result.get("usage") or {}
+                self.tracker.observe(data.get("model"), tokens=usage.get("completion_tokens") or 0,
+                                     seconds=time.monotonic() - started)
+                return result
+            except requests.exceptions.HTTPError as e:
+                print(f"HTTP错误: {e}")
+                # 尝试获取详细的错误信息
+                # status 供调用方区分可以重试的错误（5xx）和重试也不会成功的错误（4xx）
+                try:
+                    error_detail = response.json()
+                    return {"error": f"HTTP错误 {response.status_code}: {error_detail.get('error', {}).get('message', str(e))}",
+                            "status": response.status_code}
+                except:
+                    return {"error": f"HTTP错误 {response.status_code}: {str(e)}", "status": response.status_code}
+            except requests.exceptions.ProxyError as e:
+                return {"error": f"代理错误: {str(e)}. 请检查您的网络设置或禁用代理。"}
+            except requests.exceptions.ConnectionError as e:
+                # 剩余预算足够完成一次请求时才重试（指数退避）
+                if retries < self.max_retries and deadline.can_retry(2 ** (retries + 1)):
+                    retries += 1
+                    if not token.wait(2 ** retries):
+                        return {"error": CANCELLED_ERROR}
+                    continue
+                return {"error": f"连接错误: {str(e)}. 请检查您的网络连接。"}
+            except requests.exceptions.Timeout as e:
+                # 连接超时属于 ConnectionError，这里只有读取超时，说明时间预算已经用完，不再重试
+                return {"error": f"请求超时: {str(e)}. 服务器没有在 {deadline.total:.0f} 秒内完成响应。"}
+            except requests.exceptions.RequestException as e:
+                return {"error": f"请求错误: {str(e)}"}
+
+    def stream(self, endpoint: str, data: Dict[str, Any],
+               token: Optional[CancelToken] = None) -> Iterator[Dict[str, Any]]:
+        url = f"{self.base_url}/{endpoint}"
+        data = dict(data, stream=True)
+        token = token or CancelToken()
+        deadline = self.deadline(data)
+
+        print("请求URL:", url)
+        print("请求数据:", json.dumps(data, ensure_ascii=False, indent=2))
+
+        # 只在收到响应头之前重试，开始接收内容后不再重试
+        retries = 0
+        while True:
+            try:
+                # 首字延迟从成功的这次尝试开始计算，不包含之前失败的连接和退避等待
+                started = time.monotonic()
+                response = requests.post(url, headers=self.headers, json=data, proxies=self.proxies,
+                                         timeout=deadline.stream_timeout(), stream=True)
+                print("响应状态码:", response.status_code)
+                response.raise_for_status()
+                break
+            except requests.exceptions.HTTPError as e:
+                print(f"HTTP错误: {e}")
+                try:
+                    error_detail = response.json()
+                    yield {"error": f"HTTP错误 {response.status_code}: {error_detail.get('error', {}).get('message', str(e))}"}
+                except:
+                    yield {"error": f"HTTP错误 {response.status_code}: {str(e)}"}
+                return
+            except requests.exceptions.ProxyError as e:
+                yield {"error": f"代理错误: {str(e)}. 请检查您的网络设置或禁用代理。"}
+                return
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # 剩余预算足够完成一次请求时才重试（指数退避）
+                if retries < self.max_retries and deadline.can_retry(2 ** (retries + 1)):
+                    retries += 1
+                    if token.wait(2 ** retries):
+                        continue
+                    yield {"error": CANCELLED_ERROR}
+                    return
+                yield {"error": f"连接错误: {str(e)}. 请检查您的网络连接。"}
+                return
+            except requests.exceptions.RequestException as e:
+                yield {"error": f"请求错误: {str(e)}"}
+                return
+
+        if not token.attach(response):
+            response.close()
+            yield {"error": CANCELLED_ERROR}
+            return
+
+        # 首包超时和空闲超时由监视线程检查，数据持续到达时不会中断
+        watch = stream_monitor.watch(response, deadline.first_chunk, deadline.idle)
+        first_chunk = None
+        tokens = 0
+        usage_tokens = 0
+        try:
+            with response:
+                for line in response.iter_lines():
+                    if token.cancelled:
+                        break
+                    watch.touch()
+                    if not line:
+                        continue
+                    line = line.decode("utf-8")
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(payload)
+                    except ValueError:
+                        print("无法解析的数据块:", payload)
+                        continue
+                    if first_chunk is None:
+                        first_chunk = time.monotonic()
+                    tokens += 1
+                    usage_tokens = (chunk.get("usage") or {}).get("completion_tokens") or usage_tokens
+                    yield chunk
+        except Exception as e:
+            # 取消或超时时关闭连接会让读取抛出异常
+            if not token.cancelled and not watch.expired:
+                yield {"error": f"读取流式响应出错: {str(e)}"}
+        finally:
+            stream_monitor.unwatch(watch)
+            token.detach(response)
+        if token.cancelled:
+            yield {"error": CANCELLED_ERROR}
+        elif watch.expired:
+            yield {"error": watch.expired}
+        elif first_chunk is not None:
+            # 优先使用服务端返回的用量，否则用数据块数量近似
+            self.tracker.observe(data.get("model"), ttft=first_chunk - started,
+                                 tokens=usage_tokens or tokens, seconds=time.monotonic() - first_chunk)
+
+    def test(self, model: str) -> Dict[str, Any]:
+        try:
+            # 简单的消息请求，仅用于测试连接
+            test_data = {
+                "model": model,
+                "messages": [{"role": "user", "content": "Hello"}],
+                "max_tokens": 5,
+                "stream": False
+            }
+
+            # 使用更短的超时时间
+            response = requests.post(
+                f"{self.base_url}/chat/completions",
+                headers=self.headers,
+                json=test_data,
+                proxies=self.proxies,
+                timeout=5
+            )
+
+            print("测试连接响应码:", response.status_code)
+            try:
+                print("测试连接响应:", json.dumps(response.json(), ensure_ascii=False, indent=2))
+            except:
+                print("测试连接响应:", response.text)
+
+            if response.status_code >= 200 and response.status_code < 300:
+                return {"success": True, "message": f"连接成功! 状态码: {response.status_code}"}
+            else:
+                try:
+                    error_detail = response.json()
+                    error_msg = error_detail.get("error", {}).get("message", str(response.text))
+                    return {"success": False, "message": f"API错误: {error_msg} (状态码: {response.status_code})"}
+                except:
+                    return {"success": False, "message": f"API错误: 状态码 {response.status_code}"}
+        except requests.exceptions.RequestException as e:
+            return {"success": False, "message": f"连接错误: {str(e)}"}
+        except Exception as e:
+            return {"success": False, "message": f"未知错误: {str(e)}"}
+
+
+class LocalServerBackend(HTTPBackend):
+    """本机运行的 OpenAI 兼容服务（如 vLLM、llama.cpp server、Ollama）
+
+    通过 /models 获取服务中的模型列表并缓存，客户端据此把对应模型的请求发到本地。
+    本地服务通常不需要密钥，连接失败时很快放弃，避免拖慢远程请求。
+    """
+    name = "local"
+
+    def __init__(self, base_url: str = LOCAL_BASE_URL, api_key: str = "", max_retries: int = 1,
+                 connect_timeout: float = 2.0, idle_timeout: float = IDLE_TIMEOUT, models_ttl: float = 30.0):
+        headers = {"Content-Type": "application/json"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        super().__init__(base_url.rstrip("/"), headers, None, max_retries, connect_timeout, idle_timeout)
+        self.models_ttl = models_ttl
+        self.models_cache: Set[str] = set()
+        self.models_time: Optional[float] = None
+
+    def list_models(self, refresh: bool = False) -> Set[str]:
+        """返回本地服务中的模型，服务不可用时返回空集合"""
+        now = time.monotonic()
+        if not refresh and self.models_time is not None and now - self.models_time < self.models_ttl:
+            return self.models_cache
+        models: Set[str] = set()
+        try:
+            response = requests.get(f"{self.base_url}/models", headers=self.headers,
+                                    proxies=self.proxies, timeout=(1, 3))
+            response.raise_for_status()
+            models = {item["id"] for item in response.json().get("data", []) if "id" in item}
+        except (requests.exceptions.RequestException, ValueError, AttributeError) as e:
+            print(f"获取本地模型列表失败: {e}")
+        self.models_cache = models
+        self.models_time = now
+        return models
+
+    def serves(self, model: Optional[str]) -> bool:
+        return bool(model) and model in self.list_models()
+
+    def test(self, model: str) -> Dict[str, Any]:
+        models = self.list_models(refresh=True)
+        if not models:
+            return {"success": False, "message": f"无法连接本地服务 {self.base_url}"}
+        names = ", ".join(sorted(models))
+        if model in models:
+            return {"success": True, "message": f"本地服务连接成功，当前模型将由本地服务处理。可用模型: {names}"}
+        return {"success": True, "message": f"本地服务连接成功，可用模型: {names}"}
+
+
+class FakeBackend(Backend):
+    """进程内的模拟后端，不产生任何网络请求，用于调试模式和测试
+
+    tokens_per_second 为 None 时不等待，立即返回全部内容；
+    reply 可以是固定文本，也可以是根据请求数据生成回复的函数。
+    用量中按最近请求的公共前缀模拟服务端的提示词缓存，以 cache_block 个 token 为单位命中。
+    """
+    name = "fake"
+
+    def __init__(self, tokens_per_second: Optional[float] = 20.0, latency: float = 0.3,
+                 reply: Union[str, Callable[[Dict[str, Any]], str]] = DEBUG_REPLY,
+                 chars_per_token: int = 2, cache_block: int = 16, cache_size: int = 8):
+        super().__init__()
+        self.tokens_per_second = tokens_per_second
+        self.latency = latency
+        self.reply = reply
+        self.chars_per_token = chars_per_token
+        self.cache_block = cache_block
+        self.cache_size = cache_size
+        self.prompt_cache: List[str] = []
+        self.embedder = HashEmbedder()
+
+    def reply_text(self, data: Dict[str, Any]) -> str:
+        return self.reply(data) if callable(self.reply) else self.reply
+
+    def tokens(self, text: str):
+        return [text[i:i + self.chars_per_token] for i in range(0, len(text), self.chars_per_token)]
+
+    def cached_prefix(self, prompt: str) -> int:
+        """与最近请求的最长公共前缀（字符数），并记录本次请求"""
+        best = 0
+        for cached in self.prompt_cache:
+            length = 0
+            for a, b in zip(prompt, cached):
+                if a != b:
+                    break
+                length += 1
+            best = max(best, length)
+        with self.lock:
+            self.prompt_cache = ([prompt] + [p for p in self.prompt_cache if p != prompt])[:self.cache_size]
+        return best
+
+    def usage(self, data: Dict[str, Any], completion_tokens: int) -> Dict[str, Any]:
+        prompt = "".join(f"{m.get('role')}\n{m.get('content') or ''}\n" for m in data.get("messages", []))
+        prompt_tokens = -(-len(prompt) // self.chars_per_token)
+        cached = self.cached_prefix(prompt) // self.chars_per_token // self.cache_block * self.cache_block
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached}
+        }
+
+    def delay(self, tokens: int) -> float:
+        if not self.tokens_per_second:
+            return 0.0
+        return tokens / self.tokens_per_second
+
+    def request(self, endpoint: str, data: Dict[str, Any],
+                token: Optional[CancelToken] = None) -> Dict[str, Any]:
+        token = token or CancelToken()
+        if endpoint == "embeddings":
+            texts = data.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+            vectors = self.embedder.embed(texts)
+            return {"data": [{"index": i, "embedding": v.tolist()} for i, v in enumerate(vectors)]}
+
+        tokens = self.tokens(self.reply_text(data))
+        if not token.wait(self.latency + self.delay(len(tokens))):
+            return {"error": CANCELLED_ERROR}
+        return {
+            "id": "debug-response",
+            "choices": [
+                {
+                    "message": {
+                        "role": "assistant",
+                        "content": "".join(tokens)
+                    },
+                    "finish_reason": "stop"
+                }
+            ],
+            "usage": self.usage(data, len(tokens))
+        }
+
+    def stream(self, endpoint: str, data: Dict[str, Any],
+               token: Optional[CancelToken] = None) -> Iterator[Dict[str, Any]]:
+        token = token or CancelToken()
+        tokens = self.tokens(self.reply_text(data))
+        if not token.wait(self.latency):
+            yield {"error": CANCELLED_ERROR}
+            return
+        for piece in tokens:
+            # 模拟逐个 token 返回
+            if not token.wait(self.delay(1)):
+                yield {"error": CANCELLED_ERROR}
+                return
+            yield {"choices": [{"delta": {"content": piece}, "finish_reason": None}]}
+        yield {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+        if (data.get("stream_options") or {}).get("include_usage"):
+            yield {"choices": [], "usage": self.usage(data, len(tokens))}
+
+    def test(self, model: str) -> Dict[str, Any]:
+        return {"success": True, "message": "调试模式，连接测试跳过"}
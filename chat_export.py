@@ -0,0 +1,259 @@
+import os
+import json
+import html
+import time
+import uuid
+import threading
+from typing import Dict, Any, Iterable, Iterator, Tuple, Callable, Optional, TextIO
+
+# 默认的归档文件，清空聊天时旧对话会逐行追加到这里
+ARCHIVE_FILE = "chat_archive.jsonl"
+
+ROLE_NAMES = {
+    "user": "您",
+    "assistant": "AI",
+    "system": "系统",
+}
+
+# 一个对话: (标题, 消息迭代器)
+Conversation = Tuple[str, Iterable[Dict[str, Any]]]
+
+
+def role_text(role: str) -> str:
+    return ROLE_NAMES.get(role, "系统")
+
+
+class BaseWriter:
+    """导出格式的基类，按消息逐条写出，不在内存中拼接整个文档"""
+    extension = ".txt"
+
+    def __init__(self, f: TextIO):
+        self.f = f
+
+    def begin_document(self):
+        pass
+
+    def begin_conversation(self, title: str):
+        pass
+
+    def write_message(self, msg: Dict[str, Any]):
+        raise NotImplementedError
+
+    def end_conversation(self):
+        pass
+
+    def end_document(self):
+        pass
+
+
+class TextWriter(BaseWriter):
+    """纯文本格式，与原来的“保存聊天”输出一致"""
+    extension = ".txt"
+
+    def write_message(self, msg: Dict[str, Any]):
+        self.f.write(f"{role_text(msg.get('role', 'unknown'))}:\n{msg.get('content', '')}\n\n")
+
+    def end_conversation(self):
+        self.f.write("\n")
+
+
+class MarkdownWriter(BaseWriter):
+    extension = ".md"
+
+    def begin_conversation(self, title: str):
+        self.f.write(f"# {title}\n\n")
+
+    def write_message(self, msg: Dict[str, Any]):
+        self.f.write(f"**{role_text(msg.get('role', 'unknown'))}:**\n\n{msg.get('content', '')}\n\n")
+
+    def end_conversation(self):
+        self.f.write("---\n\n")
+
+
+class JSONLWriter(BaseWriter):
+    """OpenAI 微调格式: 每行一个 {"messages": [...]}，消息逐条序列化写入"""
+    extension = ".jsonl"
+
+    def begin_conversation(self, title: str):
+        self.count = 0
+        self.f.write('{"messages": [')
+
+    def write_message(self, msg: Dict[str, Any]):
+        if self.count:
+            self.f.write(", ")
+        record = {"role": msg.get("role", "user"), "content": msg.get("content", "")}
+        self.f.write(json.dumps(record, ensure_ascii=False))
+        self.count += 1
+
+    def end_conversation(self):
+        self.f.write("]}\n")
+
+
+class HTMLWriter(BaseWriter):
+    extension = ".html"
+
+    def begin_document(self):
+        self.f.write(
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>聊天记录</title>\n"
+            "<style>body{font-family:sans-serif;max-width:860px;margin:auto}"
+            ".msg{margin:8px 0;white-space:pre-wrap}.user{color:blue}"
+            ".assistant{color:green}.system{color:gray}</style>\n</head><body>\n"
+        )
+
+    def begin_conversation(self, title: str):
+        self.f.write(f"<section><h1>{html.escape(title)}</h1>\n")
+
+    def write_message(self, msg: Dict[str, Any]):
+        role = msg.get("role", "system")
+        css = role if role in ROLE_NAMES else "system"
+        self.f.write(
+            f"<div class=\"msg {css}\"><b>{html.escape(role_text(role))}:</b>\n"
+            f"{html.escape(str(msg.get('content', '')))}</div>\n"
+        )
+
+    def end_conversation(self):
+        self.f.write("</section><hr>\n")
+
+    def end_document(self):
+        self.f.write("</body></html>\n")
+
+
+WRITERS = {
+    ".txt": TextWriter,
+    ".md": MarkdownWriter,
+    ".jsonl": JSONLWriter,
+    ".html": HTMLWriter,
+}
+
+
+def writer_for(filename: str):
+    """根据文件扩展名选择导出格式"""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".htm":
+        ext = ".html"
+    if ext not in WRITERS:
+        raise ValueError(f"不支持的导出格式: {ext}")
+    return WRITERS[ext]
+
+
+def append_to_archive(messages: Iterable[Dict[str, Any]], title: Optional[str] = None,
+                      filename: str = ARCHIVE_FILE) -> int:
+    """把一段对话逐条追加到归档文件，返回写入的消息数
+
+    每条记录带有对话 id，标题相同（例如同一秒内清空两次）的对话也不会被合并。
+    """
+    title = title or f"对话 {time.strftime('%Y-%m-%d %H:%M:%S')}"
+    conversation_id = uuid.uuid4().hex
+    count = 0
+    with open(filename, "a", encoding="utf-8") as f:
+        for msg in messages:
+            record = {"id": conversation_id, "conversation": title, "role": msg.get("role", "unknown"),
+                      "content": msg.get("content", "")}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def iter_archive(filename: str = ARCHIVE_FILE) -> Iterator[Conversation]:
+    """按对话分组流式读取归档文件，每次只在内存中保留一条消息"""
+    if not os.path.exists(filename):
+        return
+
+    with open(filename, "r", encoding="utf-8") as f:
+        line = f.readline()
+        while line:
+            try:
+                first = json.loads(line)
+            except ValueError:
+                line = f.readline()
+                continue
+            title = first.get("conversation", "对话")
+            # 旧版本的归档没有对话 id，只能按标题分组
+            key = first.get("id") or title
+            state = {"next": None}
+
+            def messages(first=first, key=key, state=state):
+                yield first
+                while True:
+                    raw = f.readline()
+                    if not raw:
+                        state["next"] = ""
+                        return
+                    try:
+                        record = json.loads(raw)
+                    except ValueError:
+                        continue
+                    if (record.get("id") or record.get("conversation", "对话")) != key:
+                        # 下一段对话的第一行，交还给外层循环
+                        state["next"] = raw
+                        return
+                    yield record
+
+            gen = messages()
+            yield title, gen
+            # 调用方没有读完时把剩余部分跳过
+            for _ in gen:
+                pass
+            line = state["next"]
+
+
+class ChatExporter:
+    """在后台线程中流式导出对话，并报告进度
+
+    progress_callback(已写出的消息数) 在工作线程中调用，
+    界面侧需要自行用 root.after 切回主线程。
+    """
+
+    def __init__(self, progress_callback: Optional[Callable[[int], None]] = None,
+                 done_callback: Optional[Callable[[Optional[str], Optional[Exception]], None]] = None):
+        self.progress_callback = progress_callback
+        self.done_callback = done_callback
+        self.thread: Optional[threading.Thread] = None
+        self.progress_interval = 0.2
+
+    def export(self, filename: str, conversations: Iterable[Conversation]) -> int:
+        """同步导出，返回写出的消息数"""
+        writer_cls = writer_for(filename)
+        count = 0
+        last_report = 0.0
+        tmp_name = filename + ".part"
+        try:
+            with open(tmp_name, "w", encoding="utf-8", newline="\n") as f:
+                writer = writer_cls(f)
+                writer.begin_document()
+                for title, messages in conversations:
+                    writer.begin_conversation(title)
+                    for msg in messages:
+                        writer.write_message(msg)
+                        count += 1
+                        now = time.time()
+                        if self.progress_callback and now - last_report >= self.progress_interval:
+                            last_report = now
+                            self.progress_callback(count)
+                    writer.end_conversation()
+                writer.end_document()
+        except Exception:
+            # 不留下写了一半的临时文件
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        os.replace(tmp_name, filename)
+        if self.progress_callback:
+            self.progress_callback(count)
+        return count
+
+    def start(self, filename: str, conversations: Iterable[Conversation]):
+        """在后台线程中导出"""
+        def run():
+            try:
+                self.export(filename, conversations)
+                error = None
+            except Exception as e:
+                print(f"导出聊天记录失败: {e}")
+                error = e
+            if self.done_callback:
+                self.done_callback(filename, error)
+
+        self.thread = threading.Thread(target=run)
+        self.thread.daemon = True
+        self.thread.start()
@@ -0,0 +1,190 @@
+import time
+import socket
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+# 连接超时：建立 TCP/TLS 连接的时间，网络不通时应在几秒内发现
+CONNECT_TIMEOUT = 5.0
+# 流式响应两个数据块之间允许的最长间隔，超过即认为连接已挂起
+IDLE_TIMEOUT = 15.0
+# 等待第一个数据块的时间范围（按观测到的首字延迟放大后限制在此范围内）
+FIRST_CHUNK_MIN = 10.0
+FIRST_CHUNK_MAX = 90.0
+# 整个请求（含重试）的时间预算范围
+DEADLINE_MIN = 15.0
+DEADLINE_MAX = 900.0
+# 按平均速度估算生成时间后再乘的安全系数
+SAFETY_FACTOR = 2.0
+
+
+class ThroughputTracker:
+    """按模型记录生成速度 (tokens/s) 和首字延迟的指数移动平均
+
+    没有观测数据的模型使用保守的默认值，估算出的截止时间偏宽松。
+    """
+
+    def __init__(self, alpha: float = 0.3, default_tps: float = 10.0, default_ttft: float = 5.0):
+        self.alpha = alpha
+        self.default_tps = default_tps
+        self.default_ttft = default_ttft
+        self.rates: Dict[str, Dict[str, float]] = {}
+        self.lock = threading.Lock()
+
+    def _update(self, entry: Dict[str, float], key: str, value: float):
+        if key in entry:
+            entry[key] = self.alpha * value + (1 - self.alpha) * entry[key]
+        else:
+            entry[key] = value
+
+    def observe(self, model: str, ttft: Optional[float] = None, tokens: int = 0, seconds: float = 0.0):
+        """记录一次请求：ttft 为首个数据块的延迟，tokens/seconds 为生成阶段的输出量和耗时"""
+        if not model:
+            return
+        with self.lock:
+            entry = self.rates.setdefault(model, {})
+            if ttft is not None:
+                self._update(entry, "ttft", ttft)
+            # 太短的回复测不准速度
+            if tokens >= 8 and seconds > 0:
+                self._update(entry, "tps", tokens / seconds)
+
+    def estimate(self, model: Optional[str]) -> Tuple[float, float]:
+        """返回 (tokens/s, 首字延迟秒数)"""
+        with self.lock:
+            entry = self.rates.get(model or "", {})
+            return entry.get("tps", self.default_tps), entry.get("ttft", self.default_ttft)
+
+    def state(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {model: dict(entry) for model, entry in self.rates.items()}
+
+    def load(self, rates: Dict[str, Dict[str, float]]):
+        with self.lock:
+            self.rates = {model: dict(entry) for model, entry in (rates or {}).items()}
+
+
+class Deadline:
+    """一次请求的时间预算，所有重试共用
+
+    total 按 max_tokens 和观测速度估算；expected 是按平均速度完成一次请求所需的时间，
+    剩余预算不足 expected 时不再重试，避免注定超时的请求从头再来。
+    """
+
+    def __init__(self, connect: float, first_chunk: float, idle: float, total: float, expected: float):
+        self.connect = connect
+        self.first_chunk = first_chunk
+        self.idle = idle
+        self.total = total
+        self.expected = expected
+        self.start = time.monotonic()
+
+    def remaining(self) -> float:
+        return self.start + self.total - time.monotonic()
+
+    def can_retry(self, backoff: float) -> bool:
+        return self.remaining() >= backoff + self.expected
+
+    def request_timeout(self) -> Tuple[float, float]:
+        """非流式请求的 (连接, 读取) 超时：读取期间看不到进度，只能等到预算用完"""
+        return self.connect, max(1.0, self.remaining())
+
+    def stream_timeout(self) -> Tuple[float, float]:
+        """流式请求的 (连接, 读取) 超时；读取超时只是兜底，首包和空闲超时由 StreamMonitor 检查"""
+        return self.connect, max(self.first_chunk, self.idle) + 5.0
+
+
+def make_deadline(tracker: ThroughputTracker, data: Dict[str, Any], connect: float = CONNECT_TIMEOUT,
+                  idle: float = IDLE_TIMEOUT) -> Deadline:
+    """根据请求的模型和 max_tokens 估算时间预算"""
+    tps, ttft = tracker.estimate(data.get("model"))
+    first_chunk = min(max(ttft * 4, FIRST_CHUNK_MIN), FIRST_CHUNK_MAX)
+    generation = (data.get("max_tokens") or 0) / max(tps, 0.1)
+    total = min(max(first_chunk + generation * SAFETY_FACTOR, DEADLINE_MIN), DEADLINE_MAX)
+    # max_tokens 很大时按平均速度估算的完成时间会超过封顶后的预算，连第一次失败都无法重试；
+    # 这时与未封顶时（安全系数为 2）一样，只要剩余一半以上的预算就允许重试
+    expected = min(ttft + generation, total / SAFETY_FACTOR)
+    return Deadline(connect, first_chunk, idle, total, expected)
+
+
+def interrupt_response(response):
+    """关闭响应并中断其他线程中阻塞的读取
+
+    只调用 response.close() 时，阻塞在 recv 上的读取要等到套接字读取超时才会返回，
+    因此先关闭底层套接字。
+    """
+    sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    try:
+        response.close()
+    except Exception:
+        pass
+
+
+class StreamWatch:
+    """被监视的流式响应，每收到数据调用 touch"""
+
+    def __init__(self, response, first_chunk: float, idle: float):
+        self.response = response
+        self.idle = idle
+        self.timeout = first_chunk
+        self.last = time.monotonic()
+        self.first = True
+        # 超时后记录原因，读取方据此区分超时和其他错误
+        self.expired: Optional[str] = None
+
+    def touch(self):
+        self.last = time.monotonic()
+        if self.first:
+            self.first = False
+            self.timeout = self.idle
+
+
+class StreamMonitor:
+    """后台检查流式响应的首包超时和空闲超时，超时时关闭连接中断读取
+
+    只要数据持续到达就不会中断，因此慢但仍在输出的请求不会被杀掉。
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.watches = set()
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def watch(self, response, first_chunk: float, idle: float) -> StreamWatch:
+        watch = StreamWatch(response, first_chunk, idle)
+        with self.lock:
+            self.watches.add(watch)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+        return watch
+
+    def unwatch(self, watch: StreamWatch):
+        with self.lock:
+            self.watches.discard(watch)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            with self.lock:
+                if not self.watches:
+                    self.thread = None
+                    return
+                expired = [w for w in self.watches if now - w.last > w.timeout]
+                for watch in expired:
+                    self.watches.discard(watch)
+            for watch in expired:
+                stage = "第一个数据块" if watch.first else "新的数据块"
+                watch.expired = f"流式响应超时: {watch.timeout:.0f} 秒内没有收到{stage}"
+                interrupt_response(watch.response)
+
+
+# 所有后端共用一个监视线程
+stream_monitor = StreamMonitor()
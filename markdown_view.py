@@ -0,0 +1,330 @@
+import re
+import unicodedata
+import tkinter as tk
+from collections import OrderedDict
+from typing import List, Tuple
+
+# 渲染片段: (文本, 标签元组)
+Segment = Tuple[str, Tuple[str, ...]]
+
+_FENCE_RE = re.compile(r"^\s*(```|~~~)\s*([\w+#.-]*)")
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)")
+_LIST_RE = re.compile(r"^(\s*)([-*+]|\d+[.)])\s+(.*)")
+_QUOTE_RE = re.compile(r"^\s*>\s?(.*)")
+_RULE_RE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+_TABLE_SEP_RE = re.compile(r"^\s*\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?\s*$")
+_INLINE_RE = re.compile(
+    r"(?P<code>`[^`\n]+`)"
+    r"|(?P<bold>\*\*[^*\n]+\*\*|(?<!\w)__[^_\n]+__(?!\w))"
+    r"|(?P<italic>\*[^*\s][^*\n]*\*|(?<!\w)_[^_\s][^_\n]*_(?!\w))"
+    r"|(?P<link>\[[^\]\n]+\]\([^)\s]+\))"
+)
+
+_KEYWORDS = {
+    "and", "as", "assert", "async", "await", "break", "case", "catch", "class", "const",
+    "continue", "def", "default", "del", "do", "elif", "else", "except", "export", "extends",
+    "false", "False", "finally", "fn", "for", "from", "func", "function", "if", "impl", "import",
+    "in", "interface", "is", "lambda", "let", "match", "mut", "new", "nil", "None", "not", "null",
+    "or", "package", "pass", "pub", "raise", "return", "self", "static", "struct", "switch",
+    "this", "throw", "true", "True", "try", "type", "var", "void", "while", "with", "yield",
+}
+_CODE_RE = re.compile(
+    r"(?P<comment>#[^\n]*|//[^\n]*|--[^\n]*)"
+    r"|(?P<string>\"(?:[^\"\\\n]|\\.)*\"|'(?:[^'\\\n]|\\.)*')"
+    r"|(?P<number>\b\d+(?:\.\d+)?\b)"
+    r"|(?P<word>\b[A-Za-z_]\w*\b)"
+)
+# 这些语言里 # 不是注释
+_NO_HASH_COMMENT = {"c", "cpp", "c++", "java", "javascript", "js", "typescript", "ts",
+                    "go", "rust", "css", "csharp", "cs", "kotlin", "swift"}
+
+
+def is_block_start(line: str) -> bool:
+    return bool(_FENCE_RE.match(line) or _HEADING_RE.match(line) or _LIST_RE.match(line)
+                or _QUOTE_RE.match(line) or _RULE_RE.match(line) or line.lstrip().startswith("|"))
+
+
+def split_blocks(text: str) -> List[str]:
+    """把 Markdown 文本切分为块，块后的空行归入该块
+
+    追加文本只会改变最后一个块，之前的块保持不变，流式渲染依赖这一点。
+    """
+    lines = text.splitlines(keepends=True)
+    blocks: List[str] = []
+    i = 0
+    while i < len(lines):
+        start = i
+        line = lines[i]
+        fence = _FENCE_RE.match(line)
+        if fence:
+            marker = fence.group(1)
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith(marker):
+                i += 1
+            i += 1
+        elif _HEADING_RE.match(line) or _RULE_RE.match(line):
+            i += 1
+        elif line.lstrip().startswith("|"):
+            i += 1
+            while i < len(lines) and lines[i].lstrip().startswith("|"):
+                i += 1
+        elif _LIST_RE.match(line):
+            i += 1
+            # 缩进的续行属于同一列表项
+            while (i < len(lines) and lines[i].strip() and lines[i][:1] in " \t"
+                   and not _LIST_RE.match(lines[i])):
+                i += 1
+        elif _QUOTE_RE.match(line):
+            i += 1
+            while i < len(lines) and _QUOTE_RE.match(lines[i]):
+                i += 1
+        elif line.strip():
+            i += 1
+            while i < len(lines) and lines[i].strip() and not is_block_start(lines[i]):
+                i += 1
+        else:
+            i += 1
+        # 空行归入前一个块
+        while i < len(lines) and not lines[i].strip():
+            i += 1
+        blocks.append("".join(lines[start:i]))
+    return blocks
+
+
+def text_width(text: str) -> int:
+    """等宽字体下的显示宽度，中日韩全角字符占两格"""
+    return sum(2 if unicodedata.east_asian_width(ch) in "WF" else 1 for ch in text)
+
+
+def render_inline(text: str, tags: Tuple[str, ...]) -> List[Segment]:
+    segments: List[Segment] = []
+    pos = 0
+    for m in _INLINE_RE.finditer(text):
+        if m.start() > pos:
+            segments.append((text[pos:m.start()], tags))
+        token = m.group(0)
+        kind = m.lastgroup
+        if kind == "code":
+            segments.append((token[1:-1], tags + ("md_code",)))
+        elif kind == "bold":
+            segments.append((token[2:-2], tags + ("md_bold",)))
+        elif kind == "italic":
+            segments.append((token[1:-1], tags + ("md_italic",)))
+        else:
+            label = token[1:token.index("]")]
+            segments.append((label, tags + ("md_link",)))
+        pos = m.end()
+    if pos < len(text):
+        segments.append((text[pos:], tags))
+    return segments
+
+
+def highlight_code(code: str, language: str, tags: Tuple[str, ...]) -> List[Segment]:
+    segments: List[Segment] = []
+    pos = 0
+    hash_comment = language.lower() not in _NO_HASH_COMMENT
+    for m in _CODE_RE.finditer(code):
+        kind = m.lastgroup
+        token = m.group(0)
+        if kind == "comment" and token.startswith("#") and not hash_comment:
+            continue
+        if kind == "comment" and token.startswith("--") and language.lower() not in ("sql", "lua", "haskell"):
+            continue
+        if kind == "word":
+            if token not in _KEYWORDS:
+                continue
+            kind = "keyword"
+        if m.start() > pos:
+            segments.append((code[pos:m.start()], tags))
+        segments.append((token, tags + (f"hl_{kind}",)))
+        pos = m.end()
+    if pos < len(code):
+        segments.append((code[pos:], tags))
+    return segments
+
+
+def render_table(lines: List[str], tags: Tuple[str, ...]) -> List[Segment]:
+    rows = []
+    for line in lines:
+        if _TABLE_SEP_RE.match(line):
+            rows.append(None)
+            continue
+        cells = line.strip().strip("|").split("|")
+        rows.append([cell.strip() for cell in cells])
+    columns = max((len(row) for row in rows if row), default=0)
+    widths = [0] * columns
+    for row in rows:
+        for col, cell in enumerate(row or []):
+            widths[col] = max(widths[col], text_width(cell))
+
+    segments: List[Segment] = []
+    table_tags = tags + ("md_table",)
+    for row in rows:
+        if row is None:
+            segments.append(("─┼─".join("─" * w for w in widths) + "\n", table_tags))
+            continue
+        cells = [cell + " " * (widths[col] - text_width(cell))
+                 for col, cell in enumerate(row + [""] * (columns - len(row)))]
+        segments.append((" │ ".join(cells) + "\n", table_tags))
+    return segments
+
+
+def render_block(block: str, tags: Tuple[str, ...] = ()) -> List[Segment]:
+    """把一个块转换为带标签的文本片段"""
+    body = block.rstrip("\n")
+    trailing = "\n" * (len(block) - len(body))
+    lines = body.split("\n")
+    first = lines[0] if lines else ""
+
+    fence = _FENCE_RE.match(first)
+    if fence:
+        closed = len(lines) > 1 and lines[-1].strip().startswith(fence.group(1))
+        code_lines = lines[1:-1] if closed else lines[1:]
+        code = "\n".join(code_lines) + "\n"
+        code_tags = tags + ("md_codeblock",)
+        return highlight_code(code, fence.group(2), code_tags) + [(trailing[1:], tags)]
+
+    heading = _HEADING_RE.match(first)
+    if heading:
+        level = min(len(heading.group(1)), 3)
+        return render_inline(heading.group(2), tags + (f"md_h{level}",)) + [(trailing or "\n", tags)]
+
+    if _RULE_RE.match(first):
+        return [("─" * 30 + trailing, tags + ("md_rule",))]
+
+    if first.lstrip().startswith("|"):
+        return render_table(lines, tags) + [(trailing[1:], tags)]
+
+    item = _LIST_RE.match(first)
+    if item:
+        indent = min(len(item.group(1).expandtabs(4)) // 2, 3)
+        bullet = "•" if item.group(2) in "-*+" else item.group(2)
+        text = " ".join([item.group(3)] + [line.strip() for line in lines[1:]])
+        item_tags = tags + (f"md_list{indent}",)
+        return [(f"{bullet} ", item_tags)] + render_inline(text, item_tags) + [(trailing or "\n", tags)]
+
+    if _QUOTE_RE.match(first):
+        text = "\n".join(_QUOTE_RE.match(line).group(1) for line in lines)
+        return render_inline(text, tags + ("md_quote",)) + [(trailing or "\n", tags)]
+
+    return render_inline(body, tags) + [(trailing, tags)]
+
+
+class BlockCache:
+    """已完成块的渲染结果缓存 (LRU)"""
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.items: "OrderedDict[tuple, List[Segment]]" = OrderedDict()
+
+    def render(self, block: str, tags: Tuple[str, ...]) -> List[Segment]:
+        key = (block, tags)
+        segments = self.items.get(key)
+        if segments is None:
+            segments = render_block(block, tags)
+            self.items[key] = segments
+            if len(self.items) > self.size:
+                self.items.popitem(last=False)
+        else:
+            self.items.move_to_end(key)
+        return segments
+
+
+def configure_tags(widget: tk.Text, font_family: str = "微软雅黑", font_size: int = 10):
+    """配置 Markdown 渲染用的文本标签"""
+    mono = ("Consolas", font_size)
+    widget.tag_config("md_h1", font=(font_family, font_size + 6, "bold"))
+    widget.tag_config("md_h2", font=(font_family, font_size + 4, "bold"))
+    widget.tag_config("md_h3", font=(font_family, font_size + 2, "bold"))
+    widget.tag_config("md_bold", font=(font_family, font_size, "bold"))
+    widget.tag_config("md_italic", font=(font_family, font_size, "italic"))
+    widget.tag_config("md_link", foreground="#0366d6", underline=True)
+    widget.tag_config("md_code", font=mono, background="#f0f0f0", foreground="#c7254e")
+    widget.tag_config("md_codeblock", font=mono, background="#f6f8fa", foreground="#24292e",
+                      lmargin1=12, lmargin2=12)
+    widget.tag_config("md_table", font=mono, foreground="#24292e")
+    widget.tag_config("md_quote", foreground="#6a737d", lmargin1=16, lmargin2=16)
+    widget.tag_config("md_rule", foreground="#d0d0d0")
+    for level in range(4):
+        margin = 12 + level * 16
+        widget.tag_config(f"md_list{level}", lmargin1=margin, lmargin2=margin + 12)
+    widget.tag_config("hl_keyword", foreground="#d73a49")
+    widget.tag_config("hl_string", foreground="#032f62")
+    widget.tag_config("hl_comment", foreground="#6a737d")
+    widget.tag_config("hl_number", foreground="#005cc5")
+    # Markdown 标签优先于消息颜色标签
+    for tag in widget.tag_names():
+        if tag.startswith(("md_", "hl_")):
+            widget.tag_raise(tag)
+
+
+def insert_segments(widget: tk.Text, index: str, segments: List[Segment]):
+    """一次 insert 调用插入所有片段"""
+    args = []
+    for text, tags in segments:
+        if text:
+            args.extend((text, tags))
+    if args:
+        widget.insert(index, *args)
+
+
+class MarkdownStream:
+    """单条消息的增量渲染器
+
+    已完成的块只渲染一次（并进入缓存），每次追加文本时只删除并重绘最后一个未完成的块，
+    因此每个 token 的渲染开销与消息总长度无关。
+    """
+    _counter = 0
+
+    def __init__(self, widget: tk.Text, cache: BlockCache, tags: Tuple[str, ...] = (),
+                 index: str = tk.END):
+        MarkdownStream._counter += 1
+        self.widget = widget
+        self.cache = cache
+        self.tags = tags
+        self.text = ""
+        # text[:done] 已作为完成的块渲染
+        self.done = 0
+        self.tail_mark = f"md_tail_{MarkdownStream._counter}"
+        self.end_mark = f"md_end_{MarkdownStream._counter}"
+        widget.mark_set(self.tail_mark, index)
+        widget.mark_gravity(self.tail_mark, tk.LEFT)
+        widget.mark_set(self.end_mark, index)
+        widget.mark_gravity(self.end_mark, tk.RIGHT)
+
+    def feed(self, delta: str):
+        self.text += delta
+        pending = self.text[self.done:]
+        # 只有完整的行才能确定块的边界
+        complete = pending[:pending.rfind("\n") + 1]
+        blocks = split_blocks(complete) if complete else []
+        finished = blocks[:-1]
+
+        self.widget.delete(self.tail_mark, self.end_mark)
+        for block in finished:
+            insert_segments(self.widget, self.end_mark, self.cache.render(block, self.tags))
+            self.done += len(block)
+        if finished:
+            self.widget.mark_set(self.tail_mark, self.end_mark)
+        # 未完成的尾部块不进缓存
+        segments = []
+        for block in split_blocks(self.text[self.done:]):
+            segments.extend(render_block(block, self.tags))
+        insert_segments(self.widget, self.end_mark, segments)
+
+    def finish(self):
+        """流结束，把剩余部分作为完成的块渲染并释放标记"""
+        self.widget.delete(self.tail_mark, self.end_mark)
+        for block in split_blocks(self.text[self.done:]):
+            insert_segments(self.widget, self.end_mark, self.cache.render(block, self.tags))
+        self.done = len(self.text)
+        self.widget.mark_unset(self.tail_mark, self.end_mark)
+
+
+def render_markdown(widget: tk.Text, text: str, cache: BlockCache, tags: Tuple[str, ...] = (),
+                    index: str = tk.END):
+    """一次性渲染完整的 Markdown 文本"""
+    segments: List[Segment] = []
+    for block in split_blocks(text):
+        segments.extend(cache.render(block, tags))
+    insert_segments(widget, index, segments)
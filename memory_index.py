@@ -0,0 +1,334 @@
+import os
+import re
+import zlib
+import queue
+import time
+import threading
+from typing import List, Tuple, Optional, Sequence
+
+import numpy as np
+
+# 默认的向量索引文件
+MEMORY_FILE = "ai_client_memory.npz"
+
+_WORD_RE = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+
+
+class HashEmbedder:
+    """确定性的本地嵌入器，用于离线/调试模式
+
+    对英文按单词、对中文等按单字和相邻双字做特征哈希，不依赖网络和模型。
+    """
+    name = "hash"
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        tokens = _WORD_RE.findall(text.lower())
+        return tokens + [a + b for a, b in zip(tokens, tokens[1:])]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        return vectors
+
+
+class EmbeddingError(RuntimeError):
+    """嵌入请求失败；retryable 为 False 时重试也不会成功（密钥无效、模型不存在等）"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class APIEmbedder:
+    """通过服务商的 /v1/embeddings 接口生成向量"""
+
+    def __init__(self, client, model: str = "BAAI/bge-m3", batch_size: int = 32):
+        self.client = client
+        self.model = model
+        self.batch_size = batch_size
+
+    @property
+    def name(self) -> str:
+        return f"api:{self.model}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        rows: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = list(texts[start:start + self.batch_size])
+            response = self.client.make_request("embeddings", {
+                "model": self.model,
+                "input": batch,
+                "encoding_format": "float"
+            })
+            if "error" in response:
+                # 没有状态码的是网络错误；4xx 中只有限流（429）值得重试
+                status = response.get("status")
+                raise EmbeddingError(response["error"], retryable=status is None or status >= 500 or status == 429)
+            data = sorted(response.get("data", []), key=lambda d: d.get("index", 0))
+            if len(data) != len(batch):
+                raise EmbeddingError(f"嵌入结果数量不匹配: {len(data)} != {len(batch)}", retryable=False)
+            rows.extend(item["embedding"] for item in data)
+        return np.asarray(rows, dtype=np.float32)
+
+
+class VectorIndex:
+    """基于 NumPy 的向量索引，行向量归一化后用矩阵乘法批量计算余弦相似度"""
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = dim
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n = len(ids)
+        if self.size + n > len(self.vectors):
+            capacity = max(len(self.vectors) * 2, self.size + n)
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            grown_ids = np.zeros(capacity, dtype=np.int64)
+            grown_ids[:self.size] = self.ids[:self.size]
+            self.vectors, self.ids = grown, grown_ids
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.vectors[self.size:self.size + n] = vectors / norms
+        self.ids[self.size:self.size + n] = ids
+        self.size += n
+
+    def search(self, queries: np.ndarray, k: int = 5, max_id: Optional[int] = None,
+               candidates: Optional[Sequence[int]] = None) -> List[List[Tuple[int, float]]]:
+        """批量查询，返回每个查询的 [(id, 相似度), ...]，只考虑 id < max_id 且在 candidates 中的向量"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.size == 0 or k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        scores = (queries / norms) @ self.vectors[:self.size].T
+        ids = self.ids[:self.size]
+        if max_id is not None:
+            scores[:, ids >= max_id] = -np.inf
+        if candidates is not None:
+            scores[:, ~np.isin(ids, np.asarray(candidates, dtype=np.int64))] = -np.inf
+
+        k = min(k, self.size)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            order = candidates[np.argsort(-scores[row, candidates])]
+            results.append([(int(ids[i]), float(scores[row, i])) for i in order
+                            if np.isfinite(scores[row, i])])
+        return results
+
+    def truncate(self, max_id: int):
+        """删除 id >= max_id 的向量"""
+        keep = self.ids[:self.size] < max_id
+        count = int(keep.sum())
+        self.vectors[:count] = self.vectors[:self.size][keep]
+        self.ids[:count] = self.ids[:self.size][keep]
+        self.size = count
+
+
+class ConversationMemory:
+    """对话记忆：后台批量嵌入消息，按需召回相关的早期对话
+
+    消息 id 即其在消息历史（对话树的节点池）中的位置。在线时使用 API 嵌入，
+    离线（调试模式）时使用本地确定性嵌入，两者的向量不能混用，切换时会重建索引。
+    """
+
+    def __init__(self, embedder, fallback_embedder=None, batch_size: int = 32):
+        self.embedder = embedder
+        self.fallback_embedder = fallback_embedder or HashEmbedder()
+        self.offline = False
+        self.batch_size = batch_size
+        self.index: Optional[VectorIndex] = None
+        self.index_name: Optional[str] = None
+        # 已经排队等待嵌入的下一个消息 id
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.queue: "queue.Queue[Tuple[int, int, str]]" = queue.Queue()
+        self.generation = 0
+        self.worker: Optional[threading.Thread] = None
+        # 连续失败的批次数，用于重试前的退避
+        self.failures = 0
+        # 遇到无法重试的错误后暂停嵌入，消息暂存在 parked 中，修改设置后通过 retry_parked 重新排队
+        self.paused: Optional[str] = None
+        self.parked: List[Tuple[int, int, str]] = []
+
+    def active_embedder(self):
+        return self.fallback_embedder if self.offline else self.embedder
+
+    def set_offline(self, offline: bool):
+        if offline != self.offline:
+            self.offline = offline
+            self.reset()
+
+    def reset(self):
+        """清空索引，之后通过 sync 重新嵌入"""
+        with self.lock:
+            self.generation += 1
+            self.index = None
+            self.index_name = None
+            self.next_id = 0
+            self.paused = None
+            self.parked = []
+
+    def retry_parked(self):
+        """恢复因无法重试的错误而暂停的嵌入，例如更换密钥或接口地址之后"""
+        with self.lock:
+            parked, self.parked = self.parked, []
+            self.paused = None
+        for item in parked:
+            self.queue.put(item)
+        if parked:
+            self._ensure_worker()
+
+    def sync(self, messages):
+        """把尚未入队的消息加入后台嵌入队列"""
+        with self.lock:
+            if self.next_id > len(messages):
+                # 历史被替换或截短，已有向量不再对应原来的位置，全部重建
+                self.generation += 1
+                self.index = None
+                self.index_name = None
+                self.next_id = 0
+            start, self.next_id = self.next_id, len(messages)
+            generation = self.generation
+
+        for msg_id in range(start, len(messages)):
+            msg = messages[msg_id]
+            if msg.get("role") in ("user", "assistant") and msg.get("content"):
+                self.queue.put((generation, msg_id, msg["content"]))
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self._run)
+            self.worker.daemon = True
+            self.worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            generation = self.generation
+            batch = [item for item in batch if item[0] == generation]
+            if not batch:
+                continue
+
+            with self.lock:
+                if self.paused is not None:
+                    self.parked.extend(batch)
+                    continue
+
+            embedder = self.active_embedder()
+            try:
+                vectors = embedder.embed([text for _, _, text in batch])
+            except Exception as e:
+                if not getattr(e, "retryable", True):
+                    with self.lock:
+                        if generation == self.generation:
+                            self.paused = str(e)
+                            self.parked.extend(batch)
+                    print(f"生成消息向量失败: {e}，暂停嵌入，修改设置后重试")
+                    continue
+                # 网络错误和服务端错误：放回队列稍后重试，否则这些消息永远不会被索引
+                self.failures += 1
+                delay = min(2 ** self.failures, 60)
+                print(f"生成消息向量失败: {e}，{delay} 秒后重试")
+                for item in batch:
+                    self.queue.put(item)
+                time.sleep(delay)
+                continue
+            self.failures = 0
+
+            with self.lock:
+                if generation != self.generation:
+                    continue
+                if self.index is None:
+                    self.index = VectorIndex(vectors.shape[1])
+                    self.index_name = embedder.name
+                self.index.add([msg_id for _, msg_id, _ in batch], vectors)
+
+    def pending(self) -> int:
+        return self.queue.qsize()
+
+    def recall(self, query: str, k: int = 4, max_id: Optional[int] = None,
+               candidates: Optional[Sequence[int]] = None) -> List[Tuple[int, float]]:
+        """召回与 query 最相关的消息 id，只在 id < max_id 且在 candidates 中的消息中查找"""
+        with self.lock:
+            if self.index is None or len(self.index) == 0 or self.paused is not None:
+                return []
+        embedder = self.active_embedder()
+        try:
+            vector = embedder.embed([query])
+        except Exception as e:
+            print(f"生成查询向量失败: {e}")
+            return []
+        with self.lock:
+            if self.index is None or self.index_name != embedder.name:
+                return []
+            return self.index.search(vector, k, max_id, candidates)[0]
+
+    def save(self, filename: str = MEMORY_FILE) -> bool:
+        """保存索引；索引已被清空时删除旧文件，避免下次加载时旧向量对应到新消息上"""
+        with self.lock:
+            if self.index is None:
+                try:
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                    return True
+                except OSError as e:
+                    print(f"删除记忆索引失败: {e}")
+                    return False
+            size = self.index.size
+            vectors = self.index.vectors[:size].copy()
+            ids = self.index.ids[:size].copy()
+            name = self.index_name
+        try:
+            with open(filename, "wb") as f:
+                np.savez(f, vectors=vectors, ids=ids, name=np.array(name))
+            return True
+        except Exception as e:
+            print(f"保存记忆索引失败: {e}")
+            return False
+
+    def load(self, filename: str = MEMORY_FILE, message_count: Optional[int] = None) -> bool:
+        """加载索引，嵌入器不一致时丢弃；之后仍需调用 sync 补齐新消息"""
+        if not os.path.exists(filename):
+            return False
+        try:
+            with np.load(filename) as data:
+                vectors, ids, name = data["vectors"], data["ids"], str(data["name"])
+        except Exception as e:
+            print(f"加载记忆索引失败: {e}")
+            return False
+        if name != self.active_embedder().name:
+            return False
+
+        index = VectorIndex(vectors.shape[1], capacity=max(1024, len(ids)))
+        index.add(ids, vectors)
+        if message_count is not None:
+            index.truncate(message_count)
+        with self.lock:
+            self.generation += 1
+            self.index = index
+            self.index_name = name
+            self.next_id = int(index.ids[:index.size].max()) + 1 if index.size else 0
+        return True
@@ -0,0 +1,101 @@
+import threading
+from typing import Dict, Any, List, Optional, Callable
+
+# 同时进行的并行单轮请求数
+PARALLEL_LIMIT = 3
+
+STATE_LABELS = {
+    "queued": "排队",
+    "running": "请求中",
+    "done": "已完成",
+    "failed": "失败",
+}
+
+
+class QueuedMessage:
+    """等待发送的消息
+
+    依赖上下文的消息在前一条回复完成后按顺序发送；independent 的消息作为不带历史的
+    单轮请求提前并行发送，轮到它时直接把结果写入对话。
+    """
+
+    def __init__(self, text: str, independent: bool = False):
+        self.text = text
+        self.independent = independent
+        self.state = "queued"
+        self.response: Optional[Dict[str, Any]] = None
+        # 编辑后递增，旧请求的结果据此丢弃
+        self.version = 0
+
+    def label(self) -> str:
+        if not self.independent:
+            return self.text
+        return f"[并行·{STATE_LABELS[self.state]}] {self.text}"
+
+    def reset(self, text: str):
+        self.text = text
+        self.state = "queued"
+        self.response = None
+        self.version += 1
+
+
+class MessageQueue:
+    """界面线程维护的消息队列，并行请求在后台线程中运行并通过回调通知界面"""
+
+    def __init__(self, limit: int = PARALLEL_LIMIT):
+        self.items: List[QueuedMessage] = []
+        self.slots = threading.Semaphore(limit)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, index: int) -> QueuedMessage:
+        return self.items[index]
+
+    def add(self, text: str, independent: bool = False) -> QueuedMessage:
+        item = QueuedMessage(text, independent)
+        self.items.append(item)
+        return item
+
+    def pop(self, index: int = 0) -> QueuedMessage:
+        return self.items.pop(index)
+
+    def remove(self, index: int):
+        self.items.pop(index).version += 1
+
+    def move(self, index: int, step: int) -> int:
+        """移动第 index 条消息，返回新的位置"""
+        target = min(max(index + step, 0), len(self.items) - 1)
+        self.items.insert(target, self.items.pop(index))
+        return target
+
+    def clear(self):
+        # 进行中的并行请求完成后发现消息已不在队列中，结果直接丢弃
+        for item in self.items:
+            item.version += 1
+        self.items = []
+
+    def prefetch(self, item: QueuedMessage, request: Callable[[str], Dict[str, Any]],
+                 on_done: Callable[[QueuedMessage], None]):
+        """在后台线程中发送独立消息的单轮请求，完成后（在后台线程中）调用 on_done"""
+        version = item.version
+
+        def run():
+            with self.slots:
+                if item.version != version or item not in self.items:
+                    return
+                item.state = "running"
+                on_done(item)
+                try:
+                    response = request(item.text)
+                except Exception as e:
+                    response = {"error": f"发送请求时出错: {str(e)}"}
+            if item.version != version:
+                return
+            item.response = response
+            item.state = "failed" if "error" in response else "done"
+            on_done(item)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
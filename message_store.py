@@ -0,0 +1,369 @@
+import sys
+import tempfile
+import threading
+from collections.abc import MutableMapping, MutableSequence, Sequence
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple, Union
+
+# 默认保留在内存中的最近消息条数，更早的消息内容写入磁盘段文件
+HOT_MESSAGES = 32
+
+# 对话树中第一条消息的父节点
+ROOT = -1
+
+
+class MessageRecord:
+    """单条消息的紧凑表示，角色字符串经过 intern，内容可能已转存到磁盘"""
+    __slots__ = ("role", "content", "offset", "length")
+
+    def __init__(self, role: str, content: Optional[str]):
+        self.role = sys.intern(role)
+        self.content = content
+        self.offset = -1
+        self.length = 0
+
+
+class MessageSegment:
+    """只追加的磁盘段文件，保存被转出内存的消息内容"""
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile(prefix="ai_client_messages_")
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def write(self, content: str):
+        data = content.encode("utf-8")
+        with self.lock:
+            offset = self.size
+            self.file.seek(offset)
+            self.file.write(data)
+            self.size += len(data)
+        return offset, len(data)
+
+    def read(self, offset: int, length: int) -> str:
+        with self.lock:
+            self.file.seek(offset)
+            data = self.file.read(length)
+        return data.decode("utf-8")
+
+    def close(self):
+        try:
+            self.file.close()
+        except Exception:
+            pass
+
+
+class MessageStore(MutableSequence):
+    """消息历史的列表式容器
+
+    对外仍按 {"role": ..., "content": ...} 字典读写，内部使用紧凑记录保存。
+    超出最近 hot_limit 条的消息内容会写入磁盘段文件，读取时按需加载。
+    """
+
+    def __init__(self, messages: Iterable[Dict[str, Any]] = (), hot_limit: int = HOT_MESSAGES):
+        self.hot_limit = hot_limit
+        self._records: List[MessageRecord] = []
+        self._segment: Optional[MessageSegment] = None
+        for msg in messages:
+            self.append(msg)
+
+    @staticmethod
+    def _make_record(msg: Dict[str, Any]) -> MessageRecord:
+        return MessageRecord(msg.get("role", "user"), msg.get("content", "") or "")
+
+    def _content(self, record: MessageRecord, segment: Optional[MessageSegment] = None) -> str:
+        content = record.content
+        if content is not None:
+            return content
+        return (segment or self._segment).read(record.offset, record.length)
+
+    def _spill_record(self, record: MessageRecord):
+        if record.content is None:
+            return
+        if self._segment is None:
+            self._segment = MessageSegment()
+        # 先写好偏移量再清空内容，其他线程读取时总能拿到有效数据
+        record.offset, record.length = self._segment.write(record.content)
+        record.content = None
+
+    def _spill(self):
+        """把热区之外的消息内容转存到磁盘"""
+        for record in self._records[:max(0, len(self._records) - self.hot_limit)]:
+            self._spill_record(record)
+
+    def _as_dict(self, record: MessageRecord) -> Dict[str, str]:
+        return {"role": record.role, "content": self._content(record)}
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._as_dict(record) for record in self._records[index]]
+        return self._as_dict(self._records[index])
+
+    def __setitem__(self, index, msg):
+        if isinstance(index, slice):
+            self._records[index] = [self._make_record(m) for m in msg]
+        else:
+            self._records[index] = self._make_record(msg)
+        self._spill()
+
+    def __delitem__(self, index):
+        del self._records[index]
+
+    def insert(self, index: int, msg: Dict[str, Any]):
+        self._records.insert(index, self._make_record(msg))
+        self._spill()
+
+    def append(self, msg: Dict[str, Any]):
+        self._records.append(self._make_record(msg))
+        # 只有刚滑出热区的那一条需要转存
+        cold = len(self._records) - self.hot_limit - 1
+        if cold >= 0:
+            self._spill_record(self._records[cold])
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        for record in self._records:
+            yield self._as_dict(record)
+
+    def role(self, index: int) -> str:
+        """只读取角色，不会从磁盘加载内容"""
+        return self._records[index].role
+
+    def clear(self):
+        self._records = []
+        # 旧段文件仍可能被快照引用，交给垃圾回收关闭
+        self._segment = None
+
+    def snapshot(self, indices: Optional[Iterable[int]] = None) -> Iterator[Dict[str, str]]:
+        """返回当前消息（或指定位置的消息）的只读迭代器，可在后台线程中使用，不受之后修改的影响"""
+        records = list(self._records) if indices is None else [self._records[i] for i in indices]
+        segment = self._segment
+
+        def iterate():
+            for record in records:
+                yield {"role": record.role, "content": self._content(record, segment)}
+        return iterate()
+
+    def copy(self) -> "MessageStore":
+        """浅拷贝：共享消息记录和段文件，之后对原容器的增删不影响拷贝，可在后台线程中序列化"""
+        store = MessageStore(hot_limit=self.hot_limit)
+        store._records = list(self._records)
+        store._segment = self._segment
+        return store
+
+    def memory_usage(self) -> int:
+        """仍在内存中的消息内容字符数"""
+        return sum(len(record.content) for record in self._records if record.content is not None)
+
+    def __repr__(self):
+        return f"MessageStore({len(self._records)} messages, {self.memory_usage()} chars in memory)"
+
+    def __reduce__(self):
+        # 按条写入 pickle，保存时不需要把全部历史一次性读入内存
+        return (self.__class__, (), {"hot_limit": self.hot_limit}, self.snapshot())
+
+    def __setstate__(self, state):
+        # pickle 先逐条 append 再恢复状态，这里按真实的热区大小重新转存
+        self.hot_limit = state.get("hot_limit", HOT_MESSAGES)
+        self._spill()
+
+    def extend(self, messages: Iterable[Dict[str, Any]]):
+        for msg in messages:
+            self.append(msg)
+
+
+class NodeTextStore(MutableMapping):
+    """按节点 id 保存的附加文本（例如推理模型的思考过程）
+
+    文本按写入顺序保存在 MessageStore 中，与消息内容一样只在内存中保留最近 hot_limit 条，
+    更早的写入磁盘段文件，读取时按需加载。
+    """
+
+    def __init__(self, items: Union[Dict[int, str], Iterable[Tuple[int, str]]] = (),
+                 hot_limit: int = HOT_MESSAGES):
+        self.texts = MessageStore(hot_limit=hot_limit)
+        # 节点 id -> 文本在 texts 中的位置
+        self.positions: Dict[int, int] = {}
+        self.update(items)
+
+    def __getitem__(self, node_id: int) -> str:
+        return self.texts[self.positions[node_id]]["content"]
+
+    def __setitem__(self, node_id: int, text: str):
+        # 重新写入时追加新记录，旧文本留在段文件中，与消息历史一样只追加
+        self.texts.append({"role": "text", "content": text})
+        self.positions[node_id] = len(self.texts) - 1
+
+    def __delitem__(self, node_id: int):
+        del self.positions[node_id]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(list(self.positions))
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def clear(self):
+        self.texts.clear()
+        self.positions = {}
+
+    def copy(self) -> "NodeTextStore":
+        """浅拷贝，文本与原容器共享，可在后台线程中序列化"""
+        store = NodeTextStore(hot_limit=self.texts.hot_limit)
+        store.texts = self.texts.copy()
+        store.positions = dict(self.positions)
+        return store
+
+    def memory_usage(self) -> int:
+        return self.texts.memory_usage()
+
+    def __repr__(self):
+        return f"NodeTextStore({len(self.positions)} texts, {self.memory_usage()} chars in memory)"
+
+    def __reduce__(self):
+        # 按条写入 pickle，只保存仍被引用的文本
+        texts = self.texts.snapshot(self.positions.values())
+        items = zip(list(self.positions), (msg["content"] for msg in texts))
+        return (self.__class__, (), {"hot_limit": self.texts.hot_limit}, None, items)
+
+    def __setstate__(self, state):
+        self.texts.hot_limit = state.get("hot_limit", HOT_MESSAGES)
+        self.texts._spill()
+
+
+class ConversationTree(Sequence):
+    """对话树：每条消息是一个节点，不同分支共享公共前缀
+
+    节点按创建顺序保存在 MessageStore 中，节点 id 即其在节点池中的位置，
+    因此存储只随不重复的消息增长，与分支数量无关。
+    按序列访问时得到当前分支（根到当前叶子的路径）上的消息，append 在当前分支末尾追加。
+    """
+
+    def __init__(self, messages: Iterable[Dict[str, Any]] = (), hot_limit: int = HOT_MESSAGES):
+        self.nodes = MessageStore(hot_limit=hot_limit)
+        self.parents: List[int] = []
+        self.children: Dict[int, List[int]] = {}
+        # 每个节点最近使用的子节点，切换分支时沿它走到叶子
+        self.last_child: Dict[int, int] = {}
+        self.path: List[int] = []
+        for msg in messages:
+            self.append(msg)
+
+    def __len__(self) -> int:
+        return len(self.path)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.nodes[node_id] for node_id in self.path[index]]
+        return self.nodes[self.path[index]]
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        for node_id in list(self.path):
+            yield self.nodes[node_id]
+
+    def append(self, msg: Dict[str, Any]) -> int:
+        """在当前分支末尾追加消息，返回节点 id；已有相同的子节点时直接复用"""
+        parent = self.path[-1] if self.path else ROOT
+        role = msg.get("role", "user")
+        content = msg.get("content", "") or ""
+        for child in self.children.get(parent, ()):
+            existing = self.nodes[child]
+            if existing["role"] == role and existing["content"] == content:
+                node_id = child
+                break
+        else:
+            node_id = len(self.nodes)
+            self.nodes.append({"role": role, "content": content})
+            self.parents.append(parent)
+            self.children.setdefault(parent, []).append(node_id)
+        self.last_child[parent] = node_id
+        self.path.append(node_id)
+        return node_id
+
+    def extend(self, messages: Iterable[Dict[str, Any]]):
+        for msg in messages:
+            self.append(msg)
+
+    def truncate(self, length: int):
+        """当前分支回退到前 length 条消息，之后的节点仍保留在树中"""
+        del self.path[length:]
+
+    def fork(self, index: int, msg: Dict[str, Any]) -> int:
+        """把第 index 条消息替换为 msg，形成新的分支"""
+        self.truncate(index)
+        return self.append(msg)
+
+    def switch(self, index: int, node_id: int):
+        """把第 index 条消息切换为同级节点 node_id，并沿最近使用的子节点走到叶子"""
+        parent = self.path[index - 1] if index > 0 else ROOT
+        if node_id not in self.children.get(parent, ()):
+            raise ValueError(f"节点 {node_id} 不是第 {index} 条消息的同级节点")
+        self.truncate(index)
+        while node_id is not None:
+            self.last_child[parent] = node_id
+            self.path.append(node_id)
+            parent, node_id = node_id, self.last_child.get(node_id)
+
+    def node_id(self, index: int) -> int:
+        return self.path[index]
+
+    def role(self, index: int) -> str:
+        return self.nodes.role(self.path[index])
+
+    def node_ids(self) -> List[int]:
+        return list(self.path)
+
+    def message(self, node_id: int) -> Dict[str, str]:
+        return self.nodes[node_id]
+
+    def siblings(self, index: int) -> List[int]:
+        """第 index 条消息所在位置的所有分支节点（包括自身）"""
+        parent = self.path[index - 1] if index > 0 else ROOT
+        return list(self.children.get(parent, ()))
+
+    def branch_position(self, index: int) -> Tuple[int, int]:
+        """返回 (当前是第几个分支, 分支总数)，从 1 开始"""
+        siblings = self.siblings(index)
+        return siblings.index(self.path[index]) + 1, len(siblings)
+
+    @staticmethod
+    def common_prefix(a: List[int], b: List[int]) -> int:
+        """两个分支的公共前缀长度"""
+        length = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            length += 1
+        return length
+
+    def clear(self):
+        self.nodes.clear()
+        self.parents = []
+        self.children = {}
+        self.last_child = {}
+        self.path = []
+
+    def snapshot(self) -> Iterator[Dict[str, str]]:
+        """当前分支的只读迭代器，可在后台线程中使用"""
+        return self.nodes.snapshot(list(self.path))
+
+    def copy(self) -> "ConversationTree":
+        """整棵树的一致拷贝，节点内容与原树共享
+
+        在修改对话树的线程（界面线程）中调用，得到的拷贝可以交给后台线程序列化，
+        路径和父子关系不会指向拷贝中不存在的节点。
+        """
+        tree = ConversationTree()
+        tree.nodes = self.nodes.copy()
+        tree.parents = list(self.parents)
+        tree.children = {parent: list(children) for parent, children in self.children.items()}
+        tree.last_child = dict(self.last_child)
+        tree.path = list(self.path)
+        return tree
+
+    def memory_usage(self) -> int:
+        return self.nodes.memory_usage()
+
+    def __repr__(self):
+        return f"ConversationTree({len(self.path)} messages on branch, {len(self.nodes)} nodes)"
@@ -0,0 +1,156 @@
+import os
+import io
+import time
+import pstats
+import cProfile
+import threading
+import functools
+import tracemalloc
+from typing import Dict, List, Optional
+
+# 默认的性能分析输出目录
+PROFILE_DIR = "profiles"
+
+
+class Profiler:
+    """按需开启的性能分析器
+
+    instrument() 把对象上的指定方法替换为带命名区间的包装函数，
+    关闭时 uninstrument() 恢复原方法，因此未开启时没有任何额外开销。
+    mode="span" 时结束时按区间名称各写出一个 .prof 文件（同名区间的多次调用合并，
+    流式渲染等高频区间不会产生大量文件），mode="session" 时只写出整个会话的汇总。
+    """
+
+    def __init__(self, output_dir: str = PROFILE_DIR, mode: str = "span", top: int = 20):
+        self.output_dir = output_dir
+        self.mode = mode
+        self.top = top
+        self.enabled = False
+        self.session_dir: Optional[str] = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stats: Optional[pstats.Stats] = None
+        self.spans: Dict[str, List[float]] = {}
+        self.memory: Dict[str, List[int]] = {}
+        # span 模式下按区间名称合并的采样结果
+        self.span_stats: Dict[str, pstats.Stats] = {}
+        self.instrumented: List[tuple] = []
+
+    def start(self):
+        if self.enabled:
+            return
+        self.session_dir = os.path.join(self.output_dir, time.strftime("%Y%m%d_%H%M%S"))
+        os.makedirs(self.session_dir, exist_ok=True)
+        self.stats = None
+        self.spans = {}
+        self.memory = {}
+        self.span_stats = {}
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+        print(f"性能分析已开启，输出目录: {self.session_dir}")
+
+    def stop(self) -> Optional[str]:
+        """停止分析并写出汇总，返回汇总文件路径"""
+        if not self.enabled:
+            return None
+        self.enabled = False
+        self.uninstrument()
+        summary = self.write_summary()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        print(f"性能分析已关闭，汇总: {summary}")
+        return summary
+
+    def instrument(self, obj, method_names: List[str]):
+        """用命名区间包装 obj 上的方法（只作用于该实例）"""
+        for name in method_names:
+            if name in obj.__dict__:
+                continue
+            original = getattr(obj, name)
+            span_name = f"{type(obj).__name__}.{name}"
+            setattr(obj, name, self.wrap(span_name, original))
+            self.instrumented.append((obj, name))
+
+    def uninstrument(self):
+        for obj, name in self.instrumented:
+            obj.__dict__.pop(name, None)
+        self.instrumented = []
+
+    def wrap(self, span_name: str, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            return self.run_span(span_name, func, args, kwargs)
+        return wrapper
+
+    def run_span(self, span_name: str, func, args, kwargs):
+        # 嵌套区间或其他线程的区间正在采样时只记录耗时，cProfile 同一时间只能有一个在运行
+        nested = getattr(self.local, "active", False)
+        profile = None
+        if not nested and self.lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+        self.local.active = True
+
+        mem_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        start = time.perf_counter()
+        try:
+            if profile is not None:
+                return profile.runcall(func, *args, **kwargs)
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            mem_after = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+            self.local.active = nested
+            if profile is not None:
+                try:
+                    self.record_profile(span_name, profile)
+                finally:
+                    self.lock.release()
+            self.spans.setdefault(span_name, []).append(elapsed)
+            self.memory.setdefault(span_name, []).append(mem_after - mem_before)
+
+    def record_profile(self, span_name: str, profile: cProfile.Profile):
+        profile.create_stats()
+        if self.stats is None:
+            self.stats = pstats.Stats(profile)
+        else:
+            self.stats.add(profile)
+        if self.mode == "span":
+            if span_name in self.span_stats:
+                self.span_stats[span_name].add(profile)
+            else:
+                self.span_stats[span_name] = pstats.Stats(profile)
+
+    def write_summary(self) -> Optional[str]:
+        if not self.session_dir:
+            return None
+        out = io.StringIO()
+        out.write("== 区间耗时 ==\n")
+        out.write(f"{'区间':<40}{'次数':>6}{'总计(s)':>10}{'平均(ms)':>10}{'最大(ms)':>10}{'内存增量(KB)':>14}\n")
+        for name, times in sorted(self.spans.items(), key=lambda item: -sum(item[1])):
+            mem = self.memory.get(name, [0])
+            out.write(f"{name:<40}{len(times):>6}{sum(times):>10.3f}"
+                      f"{sum(times) / len(times) * 1000:>10.1f}{max(times) * 1000:>10.1f}"
+                      f"{sum(mem) / 1024:>14.1f}\n")
+
+        if self.stats is not None:
+            out.write(f"\n== CPU 热点 (按累计时间前 {self.top} 项) ==\n")
+            self.stats.stream = out
+            self.stats.sort_stats("cumulative").print_stats(self.top)
+            self.stats.dump_stats(os.path.join(self.session_dir, "session.prof"))
+        for span_name, stats in self.span_stats.items():
+            stats.dump_stats(os.path.join(self.session_dir, f"{span_name}.prof"))
+
+        if tracemalloc.is_tracing():
+            out.write(f"\n== 内存分配 (前 {self.top} 行) ==\n")
+            snapshot = tracemalloc.take_snapshot()
+            snapshot.dump(os.path.join(self.session_dir, "session.tracemalloc"))
+            for stat in snapshot.statistics("lineno")[:self.top]:
+                out.write(f"{stat}\n")
+
+        filename = os.path.join(self.session_dir, "summary.txt")
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(out.getvalue())
+        return filename
@@ -0,0 +1,155 @@
+import tkinter as tk
+from typing import Callable, Tuple
+
+# 回复只有思考过程、没有正文时（例如 max_tokens 在思考阶段就用完）写入历史的占位内容
+REASONING_ONLY_REPLY = "（只收到思考过程，没有正文回复）"
+
+
+class ThinkTagSplitter:
+    """把回复开头 <think>...</think> 中的思考过程从正文中分离出来（支持流式输入）
+
+    部分服务商不返回 reasoning_content，而是把思考过程写在正文开头的 think 标签中。
+    """
+    OPEN = "<think>"
+    CLOSE = "</think>"
+
+    def __init__(self):
+        self.buffer = ""
+        # start: 尚未确定是否有 think 标签; think: 标签内; after: 标签刚结束; content: 正文
+        self.state = "start"
+
+    def feed(self, text: str) -> Tuple[str, str]:
+        """输入一段文本，返回 (思考过程片段, 正文片段)"""
+        self.buffer += text
+        reasoning = content = ""
+        while self.buffer:
+            if self.state == "start":
+                stripped = self.buffer.lstrip()
+                if stripped.startswith(self.OPEN):
+                    self.buffer = stripped[len(self.OPEN):]
+                    self.state = "think"
+                elif self.OPEN.startswith(stripped):
+                    # 可能是被截断的开始标签，等待更多内容
+                    break
+                else:
+                    self.state = "content"
+            elif self.state == "think":
+                end = self.buffer.find(self.CLOSE)
+                if end >= 0:
+                    reasoning += self.buffer[:end]
+                    self.buffer = self.buffer[end + len(self.CLOSE):]
+                    self.state = "after"
+                else:
+                    # 保留可能是结束标签前缀的部分
+                    keep = 0
+                    for k in range(min(len(self.CLOSE) - 1, len(self.buffer)), 0, -1):
+                        if self.CLOSE.startswith(self.buffer[-k:]):
+                            keep = k
+                            break
+                    reasoning += self.buffer[:len(self.buffer) - keep]
+                    self.buffer = self.buffer[len(self.buffer) - keep:]
+                    break
+            elif self.state == "after":
+                stripped = self.buffer.lstrip()
+                if not stripped:
+                    break
+                self.buffer = stripped
+                self.state = "content"
+            else:
+                content += self.buffer
+                self.buffer = ""
+        return reasoning, content
+
+    def flush(self) -> Tuple[str, str]:
+        """输入结束，返回缓冲区中剩余的内容"""
+        rest, self.buffer = self.buffer, ""
+        if self.state == "think":
+            return rest, ""
+        if self.state == "after":
+            return "", rest.lstrip()
+        return "", rest
+
+
+def split_think_tags(text: str) -> Tuple[str, str]:
+    """拆分完整回复，返回 (思考过程, 正文)"""
+    splitter = ThinkTagSplitter()
+    reasoning, content = splitter.feed(text)
+    rest_reasoning, rest_content = splitter.flush()
+    return reasoning + rest_reasoning, content + rest_content
+
+
+class ReasoningView:
+    """聊天区中可折叠的思考过程
+
+    默认折叠，只显示标题和字数；展开时才把正文插入文本框。
+    get_text 返回当前完整的思考过程，流式接收时通过 append 追加。
+    finished 为 False 时标题显示“思考中”。
+    """
+    _counter = 0
+
+    def __init__(self, widget: tk.Text, get_text: Callable[[], str], index: str = tk.END,
+                 finished: bool = True):
+        ReasoningView._counter += 1
+        name = f"reasoning_{ReasoningView._counter}"
+        self.widget = widget
+        self.get_text = get_text
+        self.expanded = False
+        self.finished = finished
+        self.length = len(get_text())
+        self.header_tag = f"{name}_header"
+        self.body_start = f"{name}_start"
+        self.body_end = f"{name}_end"
+
+        # 正文区域位于标题和换行之间，避免与后面的回复内容共享插入位置
+        widget.insert(index, self.header_text(), ("reasoning_header", self.header_tag), "\n", ())
+        widget.mark_set(self.body_start, f"{self.header_tag}.last")
+        widget.mark_gravity(self.body_start, tk.LEFT)
+        widget.mark_set(self.body_end, f"{self.header_tag}.last")
+        widget.mark_gravity(self.body_end, tk.RIGHT)
+
+        widget.tag_bind(self.header_tag, "<Button-1>", lambda e: self.toggle())
+        widget.tag_bind(self.header_tag, "<Enter>", lambda e: widget.config(cursor="hand2"))
+        widget.tag_bind(self.header_tag, "<Leave>", lambda e: widget.config(cursor=""))
+
+    def header_text(self) -> str:
+        arrow = "▼" if self.expanded else "▶"
+        label = "思考过程" if self.finished else "思考中..."
+        return f"{arrow} {label} ({self.length} 字)"
+
+    def refresh_header(self):
+        # 先在旧标题前插入新标题再删除旧标题，正文标记保持在标题之后
+        ranges = self.widget.tag_ranges(self.header_tag)
+        if not ranges:
+            return
+        start, end = str(ranges[0]), str(ranges[1])
+        text = self.header_text()
+        self.widget.insert(start, text, ("reasoning_header", self.header_tag))
+        self.widget.delete(f"{start} + {len(text)} chars", f"{end} + {len(text)} chars")
+
+    def append(self, piece: str):
+        """流式追加（调用前 get_text 已包含 piece）"""
+        self.length += len(piece)
+        if self.expanded:
+            self.widget.insert(self.body_end, piece, ("reasoning_body",))
+        self.refresh_header()
+
+    def finish(self):
+        self.finished = True
+        self.refresh_header()
+
+    def toggle(self):
+        if self.expanded:
+            self.widget.delete(self.body_start, self.body_end)
+            self.expanded = False
+        else:
+            self.widget.insert(self.body_end, "\n" + self.get_text(), ("reasoning_body",))
+            self.expanded = True
+        self.refresh_header()
+
+
+def configure_reasoning_tags(widget: tk.Text, font_family: str = "微软雅黑", font_size: int = 10):
+    widget.tag_config("reasoning_header", foreground="#8a8a8a", font=(font_family, font_size - 1, "italic"))
+    widget.tag_config("reasoning_body", foreground="#8a8a8a", font=(font_family, font_size - 1),
+                      lmargin1=12, lmargin2=12)
+    widget.tag_raise("reasoning_header")
+    widget.tag_raise("reasoning_body")
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import hashlib
+import itertools
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+from arena import ArenaRun, run_stream
+
+# 参数扫描结果文件，每完成一个请求追加一行
+SWEEP_FILE = "sweep_results.jsonl"
+
+# 可以扫描的参数及其类型，顺序即网格展开的顺序
+SWEEP_PARAMS = {
+    "model": str,
+    "temperature": float,
+    "top_p": float,
+    "top_k": float,
+    "frequency_penalty": float,
+    "max_tokens": int,
+}
+
+
+def parse_values(name: str, text: str) -> List[Any]:
+    """把逗号分隔的取值解析为列表，去掉重复值；格式错误时抛出 ValueError"""
+    cast = SWEEP_PARAMS[name]
+    values = []
+    for item in text.replace("，", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        value = cast(item)
+        if value not in values:
+            values.append(value)
+    return values
+
+
+def expand_grid(grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """参数网格的笛卡尔积，没有给出取值的参数不参与扫描"""
+    names = [name for name in SWEEP_PARAMS if grid.get(name)]
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def canonical_request(data: Dict[str, Any]) -> str:
+    """规范化的请求体（键排序、紧凑格式）"""
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def backend_identity(client, model: Optional[str]) -> str:
+    """处理该模型请求的后端，例如 "http:https://api.example.com/v1"；调试模式为 "fake:" """
+    backend = client.backend_for(model)
+    return f"{backend.name}:{getattr(backend, 'base_url', '')}"
+
+
+def request_key(data: Dict[str, Any], repeat: int = 0, backend: str = "") -> str:
+    """请求的缓存键：后端、规范化请求体和重复序号的 sha256
+
+    包含后端是因为同一模型名在不同服务商、本地服务和调试模式下的结果不能互相复用。
+    """
+    return hashlib.sha256(f"{backend}\n{canonical_request(data)}#{repeat}".encode("utf-8")).hexdigest()
+
+
+def load_results(filename: str) -> Dict[str, Dict[str, Any]]:
+    """读取已完成的扫描结果，按缓存键索引；失败的请求不复用"""
+    results = {}
+    if not os.path.exists(filename):
+        return results
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断时可能留下写了一半的行
+                continue
+            if record.get("result", {}).get("error"):
+                continue
+            results[record["key"]] = record
+    return results
+
+
+class RateLimiter:
+    """令牌桶限速：平均每分钟 per_minute 个请求，最多连续发出 burst 个"""
+
+    def __init__(self, per_minute: float, burst: int = 1):
+        self.rate = max(per_minute, 0.1) / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        # 被服务端限流（429）后暂停到此时刻
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, stop: threading.Event) -> bool:
+        """等待一个令牌，stop 被设置时放弃并返回 False"""
+        while not stop.is_set():
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            stop.wait(min(wait, 1.0))
+        return False
+
+    def backoff(self, seconds: float):
+        """服务端返回限流错误时清空令牌并暂停发送"""
+        with self.lock:
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class SweepCell:
+    """扫描中的一个请求：某个问题在某组参数下的第 repeat 次运行"""
+
+    def __init__(self, prompt_index: int, prompt: str, values: Dict[str, Any], repeat: int,
+                 data: Dict[str, Any]):
+        self.prompt_index = prompt_index
+        self.prompt = prompt
+        self.values = values
+        self.repeat = repeat
+        self.data = data
+        # 缓存键包含后端，在后台线程中确定（查询本地服务的模型列表可能需要网络请求）
+        self.backend = ""
+        self.key: Optional[str] = None
+        # 完成（或从结果文件中复用）后的记录
+        self.record: Optional[Dict[str, Any]] = None
+        self.cached = False
+
+    @property
+    def done(self) -> bool:
+        return self.record is not None
+
+
+class ParameterSweep:
+    """在参数网格和问题集合的笛卡尔积上并发运行单轮请求
+
+    每个请求完成后立即追加到结果文件；再次运行时跳过文件中已有的相同请求，
+    因此中断后可以继续，修改网格后也只会请求新增的组合。
+    """
+
+    def __init__(self, client, prompts: List[str], grid: Dict[str, List[Any]], parameters: Dict[str, Any],
+                 results_file: str = SWEEP_FILE, repeats: int = 1, concurrency: int = 4,
+                 requests_per_minute: float = 60.0):
+        self.client = client
+        self.results_file = results_file
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(requests_per_minute, burst=self.concurrency)
+        self.stop_event = threading.Event()
+        self.write_lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.failed = 0
+
+        self.cells: List[SweepCell] = []
+        seen = set()
+        system = client.system_message()
+        for values in expand_grid(grid):
+            request_parameters = dict(parameters)
+            request_parameters.update(values)
+            for prompt_index, prompt in enumerate(prompts):
+                messages = ([system] if system else []) + [{"role": "user", "content": prompt}]
+                data = client.build_request(messages, request_parameters, n=1, stream=True)
+                for repeat in range(max(1, repeats)):
+                    # 重复的问题或取值展开出完全相同的请求时只运行一次
+                    body = (canonical_request(data), repeat)
+                    if body not in seen:
+                        seen.add(body)
+                        self.cells.append(SweepCell(prompt_index, prompt, values, repeat, data))
+
+    @property
+    def completed(self) -> int:
+        return sum(1 for cell in self.cells if cell.done)
+
+    @property
+    def cached(self) -> int:
+        return sum(1 for cell in self.cells if cell.cached)
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, on_done: Optional[Callable[["ParameterSweep"], None]] = None):
+        """在后台先从结果文件中复用已有结果，再运行剩余的请求"""
+        def run_all():
+            existing = load_results(self.results_file)
+            backends: Dict[str, str] = {}
+            for cell in self.cells:
+                model = cell.data["model"]
+                if model not in backends:
+                    backends[model] = backend_identity(self.client, model)
+                cell.backend = backends[model]
+                cell.key = request_key(cell.data, cell.repeat, cell.backend)
+                if cell.key in existing:
+                    cell.record = existing[cell.key]
+                    cell.cached = True
+            pending = [cell for cell in self.cells if not cell.done]
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                for cell in pending:
+                    pool.submit(self.run_cell, cell)
+            if on_done:
+                on_done(self)
+
+        self.thread = threading.Thread(target=run_all)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """不再发出新的请求，已发出的请求运行完毕后写入结果"""
+        self.stop_event.set()
+
+    def run_cell(self, cell: SweepCell):
+        if not self.limiter.acquire(self.stop_event):
+            return
+        run = ArenaRun(cell.data["model"])
+        run_stream(self.client, run, cell.data)
+        record = {
+            "key": cell.key,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "backend": cell.backend,
+            "debug": self.client.debug_mode,
+            "prompt_index": cell.prompt_index,
+            "prompt": cell.prompt,
+            "values": cell.values,
+            "repeat": cell.repeat,
+            "request": cell.data,
+            "content": "".join(run.parts),
+            "result": run.summary(),
+        }
+        if run.error and "429" in run.error:
+            self.limiter.backoff(30.0)
+        self.save_record(record)
+        cell.record = record
+
+    def save_record(self, record: Dict[str, Any]):
+        try:
+            with self.write_lock:
+                if record["result"].get("error"):
+                    self.failed += 1
+                with open(self.results_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"保存扫描结果失败: {e}")
+
+    def summary(self) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """按参数组合汇总已完成的请求：耗时和速度取中位数，用量取平均值"""
+        groups: Dict[str, Tuple[Dict[str, Any], List[Dict[str, Any]]]] = {}
+        for cell in self.cells:
+            name = json.dumps(cell.values, sort_keys=True)
+            groups.setdefault(name, (cell.values, []))
+            if cell.done:
+                groups[name][1].append(cell.record["result"])
+
+        rows = []
+        for values, results in groups.values():
+            ok = [r for r in results if not r.get("error")]
+            stats: Dict[str, Any] = {"runs": len(results), "errors": len(results) - len(ok)}
+            for key in ("ttft", "latency", "tokens_per_second"):
+                items = [r[key] for r in ok if r.get(key) is not None]
+                stats[key] = statistics.median(items) if items else None
+            for key in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+                items = [r[key] for r in ok if r.get(key) is not None]
+                stats[key] = statistics.mean(items) if items else None
+            rows.append((values, stats))
+        return rows
@@ -0,0 +1,14 @@
+import pytest
+
+from ai_client import AIClient
+from backends import FakeBackend
+
+
+@pytest.fixture
+def client():
+    """调试模式的客户端：模拟后端立即返回，记忆使用本地嵌入，不产生网络请求"""
+    client = AIClient("test-key")
+    client.debug_mode = True
+    client.memory.set_offline(True)
+    client.fake_backend = FakeBackend(tokens_per_second=None, latency=0)
+    return client
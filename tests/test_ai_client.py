@@ -0,0 +1,97 @@
+import os
+
+from ai_client import AIClient, REQUEST_PARAM_ORDER
+
+
+def fill(client, count):
+    # 直接写入对话树，不同步记忆，避免嵌入请求
+    for i in range(count):
+        client.messages.append({"role": "user" if i % 2 == 0 else "assistant", "content": f"消息 {i}"})
+
+
+def test_context_start_is_aligned_and_stable(client):
+    fill(client, 40)
+    indices = list(range(40))
+    assert client.context_start(indices, client.context_window) == 0
+    # 窗口溢出后起点按 context_step 整段前移，期间连续多轮保持不变
+    starts = [client.context_start(indices, total) for total in range(21, 37)]
+    assert starts == [8] * 8 + [16] * 8
+
+
+def test_context_start_begins_with_user_message(client):
+    fill(client, 30)
+    client.context_step = 3
+    indices = list(range(30))
+    start = client.context_start(indices, 23)
+    assert start == 4
+    assert client.messages.role(indices[start]) == "user"
+
+
+def test_build_context_keeps_prefix_between_turns(client):
+    client.parameters["system_prompt"] = "你是一个乐于助人的助手。"
+    fill(client, 24)
+    first = client.build_context("问题", recall=False)
+    client.messages.append({"role": "user", "content": "新的问题"})
+    client.messages.append({"role": "assistant", "content": "新的回答"})
+    second = client.build_context("问题", recall=False)
+    assert first[0] == {"role": "system", "content": "你是一个乐于助人的助手。"}
+    assert second[:len(first)] == first
+
+
+def test_build_request_uses_fixed_key_order(client):
+    messages = [{"role": "user", "content": "你好"}]
+    data = client.build_request(messages)
+    expected = [key for key in REQUEST_PARAM_ORDER if key != "stop"]
+    assert list(data) == expected
+    assert data["stream_options"] == {"include_usage": True}
+
+    data = client.build_request(messages, stream=False, stop=["\n"])
+    assert "stream_options" not in data
+    assert list(data) == [key for key in REQUEST_PARAM_ORDER if key != "stream_options"]
+
+
+def test_export_messages_puts_system_prompt_first(client):
+    client.parameters["system_prompt"] = "系统提示词"
+    client.messages.append({"role": "system", "content": "旧版本保存的提示词"})
+    fill(client, 2)
+    assert list(client.export_messages()) == [
+        {"role": "system", "content": "系统提示词"},
+        {"role": "user", "content": "消息 0"},
+        {"role": "assistant", "content": "消息 1"},
+    ]
+
+
+def test_state_snapshot_is_not_affected_by_later_changes(client, tmp_path, monkeypatch):
+    # load_state 会读取当前目录下的记忆索引
+    monkeypatch.chdir(tmp_path)
+    filename = str(tmp_path / "state.pkl")
+    fill(client, 4)
+    client.reasoning[1] = "思考过程"
+    state = client.snapshot_state()
+    # 快照之后界面线程继续修改对话
+    client.messages.fork(2, {"role": "user", "content": "新分支"})
+    client.reasoning[4] = "新的思考过程"
+    assert client.write_state(state, filename)
+
+    restored = AIClient("test-key")
+    restored.memory.set_offline(True)
+    assert restored.load_state(filename)
+    assert [msg["content"] for msg in restored.messages] == [f"消息 {i}" for i in range(4)]
+    assert restored.reasoning == {1: "思考过程"}
+    assert not os.path.exists(filename + ".tmp")
+
+
+def test_older_snapshot_does_not_overwrite_newer(client, tmp_path, monkeypatch):
+    # load_state 会读取当前目录下的记忆索引
+    monkeypatch.chdir(tmp_path)
+    filename = str(tmp_path / "state.pkl")
+    fill(client, 2)
+    older = client.snapshot_state()
+    fill(client, 2)
+    assert client.write_state(client.snapshot_state(), filename)
+    assert client.write_state(older, filename)
+
+    restored = AIClient("test-key")
+    restored.memory.set_offline(True)
+    assert restored.load_state(filename)
+    assert len(restored.messages) == 4
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from arena import ArenaRun, ModelArena, run_stream, summarize_benchmarks
+from backends import DEBUG_REPLY
+
+MESSAGES = [{"role": "user", "content": "你好"}]
+
+
+def test_run_timings_and_token_rate():
+    run = ArenaRun("m")
+    assert run.ttft() is None and run.tokens_per_second() is None
+    run.start, run.first_token, run.end = 10.0, 10.5, 12.5
+    run.chunks = 20
+    assert run.ttft() == pytest.approx(0.5)
+    assert run.latency() == pytest.approx(2.5)
+    assert run.tokens_per_second() == pytest.approx(10.0)
+    # 服务端返回的用量优先于数据块数量
+    run.usage = {"completion_tokens": 40, "prompt_tokens": 8}
+    assert run.tokens_per_second() == pytest.approx(20.0)
+    assert run.summary()["prompt_tokens"] == 8
+
+
+class ErrorClient:
+    def stream_request(self, endpoint, data):
+        yield {"choices": [{"delta": {"reasoning_content": "想"}}]}
+        yield {"error": "服务不可用"}
+
+
+def test_run_stream_records_error():
+    run = ArenaRun("m")
+    run_stream(ErrorClient(), run, {})
+    assert run.done and run.error == "服务不可用"
+    assert run.reasoning_chars == 1 and run.parts == []
+
+
+def test_arena_writes_benchmark_record(client, tmp_path):
+    filename = str(tmp_path / "benchmarks.jsonl")
+    arena = ModelArena(client, ["model-a", "model-b"], MESSAGES, client.parameters, benchmark_file=filename)
+    arena.start()
+    arena.thread.join(10)
+    assert arena.done
+
+    with open(filename, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 1
+    record = records[0]
+    assert record["debug"] is True
+    assert record["max_tokens"] == client.parameters["max_tokens"]
+    assert [result["model"] for result in record["results"]] == ["model-a", "model-b"]
+    for result in record["results"]:
+        assert result["error"] is None
+        assert result["content_chars"] == len(DEBUG_REPLY)
+        assert result["completion_tokens"] == len(client.fake_backend.tokens(DEBUG_REPLY))
+        assert result["ttft"] is not None and result["latency"] >= result["ttft"]
+
+
+def test_summary_uses_median_and_skips_debug_and_errors(client, tmp_path):
+    filename = tmp_path / "benchmarks.jsonl"
+    # 调试模式的对比记录不计入汇总
+    arena = ModelArena(client, ["m"], MESSAGES, client.parameters, benchmark_file=str(filename))
+    arena.start()
+    arena.thread.join(10)
+
+    def result(ttft, error=None):
+        return {"model": "m", "ttft": ttft, "latency": ttft * 10, "tokens_per_second": 1 / ttft, "error": error}
+
+    records = [{"debug": False, "results": [result(1.0), result(100.0, error="超时")]},
+               {"debug": False, "results": [result(2.0)]},
+               {"debug": False, "results": [result(4.0)]}]
+    with open(filename, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+    summary = summarize_benchmarks(str(filename))
+    assert summary == {"m": {"runs": 3, "ttft": 2.0, "latency": 20.0, "tokens_per_second": 0.5}}
+    assert summarize_benchmarks(str(tmp_path / "missing.jsonl")) == {}
@@ -0,0 +1,108 @@
+import requests
+
+import backends
+from backends import CANCELLED_ERROR, CancelToken, FakeBackend, HTTPBackend, cached_tokens
+
+MESSAGES = [
+    {"role": "system", "content": "你是一个乐于助人的助手。" * 8},
+    {"role": "user", "content": "你好"},
+]
+
+
+def make_backend(reply="你好，有什么可以帮你？"):
+    return FakeBackend(tokens_per_second=None, latency=0, reply=reply)
+
+
+def stream_content(chunks):
+    return "".join(chunk["choices"][0]["delta"].get("content") or ""
+                   for chunk in chunks if chunk.get("choices"))
+
+
+def test_request_and_stream_return_the_reply():
+    backend = make_backend()
+    data = {"model": "m", "messages": MESSAGES}
+    response = backend.request("chat/completions", data)
+    assert response["choices"][0]["message"]["content"] == "你好，有什么可以帮你？"
+    assert stream_content(backend.stream("chat/completions", data)) == "你好，有什么可以帮你？"
+
+
+def test_reply_function_receives_request_data():
+    backend = make_backend(reply=lambda data: data["messages"][-1]["content"] * 2)
+    response = backend.request("chat/completions", {"model": "m", "messages": MESSAGES})
+    assert response["choices"][0]["message"]["content"] == "你好你好"
+
+
+def test_usage_chunk_only_when_requested():
+    backend = make_backend()
+    data = {"model": "m", "messages": MESSAGES, "stream": True}
+    assert not any("usage" in chunk for chunk in backend.stream("chat/completions", data))
+
+    data["stream_options"] = {"include_usage": True}
+    chunks = list(backend.stream("chat/completions", data))
+    assert chunks[-1]["choices"] == []
+    assert chunks[-1]["usage"]["completion_tokens"] == len(backend.tokens("你好，有什么可以帮你？"))
+
+
+def test_repeated_prefix_is_reported_as_cached():
+    backend = make_backend()
+    first = backend.request("chat/completions", {"model": "m", "messages": MESSAGES})["usage"]
+    longer = MESSAGES + [{"role": "assistant", "content": "你好"}, {"role": "user", "content": "再见"}]
+    second = backend.request("chat/completions", {"model": "m", "messages": longer})["usage"]
+    assert cached_tokens(first) == 0
+    assert 0 < cached_tokens(second) <= first["prompt_tokens"]
+    assert cached_tokens(second) % backend.cache_block == 0
+
+
+def test_cancelled_token_stops_only_its_own_request():
+    backend = make_backend()
+    data = {"model": "m", "messages": MESSAGES}
+    cancelled = CancelToken()
+    cancelled.cancel()
+    assert backend.request("chat/completions", data, cancelled) == {"error": CANCELLED_ERROR}
+    assert list(backend.stream("chat/completions", data, cancelled)) == [{"error": CANCELLED_ERROR}]
+
+    token = CancelToken()
+    other = CancelToken()
+    stream = backend.stream("chat/completions", data, token)
+    other_stream = backend.stream("chat/completions", data, other)
+    next(stream)
+    next(other_stream)
+    token.cancel()
+    assert next(stream) == {"error": CANCELLED_ERROR}
+    assert "error" not in next(other_stream)
+    assert stream_content(other_stream)
+
+
+def test_cached_tokens_field_variants():
+    assert cached_tokens(None) == 0
+    assert cached_tokens({"prompt_tokens": 10}) == 0
+    assert cached_tokens({"prompt_tokens_details": {"cached_tokens": 64}}) == 64
+    assert cached_tokens({"prompt_tokens_details": None, "prompt_cache_hit_tokens": 32}) == 32
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.text = str(body)
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} error")
+
+
+def test_embeddings_are_not_logged_and_errors_carry_status(monkeypatch, capsys):
+    vectors = {"data": [{"index": 0, "embedding": [0.1] * 1024}]}
+    monkeypatch.setattr(backends.requests, "post", lambda *args, **kwargs: FakeResponse(200, vectors))
+    backend = HTTPBackend("http://example.invalid/v1")
+    assert backend.request("embeddings", {"model": "m", "input": ["text"]}) == vectors
+    assert capsys.readouterr().out == ""
+
+    denied = {"error": {"message": "invalid api key"}}
+    monkeypatch.setattr(backends.requests, "post", lambda *args, **kwargs: FakeResponse(401, denied))
+    response = backend.request("embeddings", {"model": "m", "input": ["text"]})
+    assert response["status"] == 401
+    assert "invalid api key" in response["error"]
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from chat_export import ChatExporter, append_to_archive, iter_archive
+
+FIRST = [{"role": "user", "content": "问题一"}, {"role": "assistant", "content": "回答一"}]
+SECOND = [{"role": "user", "content": "问题二"}, {"role": "assistant", "content": "<b>回答二</b> & 更多"}]
+
+
+def read_archive(filename):
+    return [(title, [msg["content"] for msg in messages]) for title, messages in iter_archive(filename)]
+
+
+def test_conversations_with_same_title_stay_separate(tmp_path):
+    filename = str(tmp_path / "archive.jsonl")
+    append_to_archive(FIRST, title="对话", filename=filename)
+    append_to_archive(SECOND, title="对话", filename=filename)
+    assert read_archive(filename) == [("对话", ["问题一", "回答一"]), ("对话", ["问题二", "<b>回答二</b> & 更多"])]
+
+
+def test_old_archives_are_grouped_by_title(tmp_path):
+    filename = tmp_path / "archive.jsonl"
+    lines = [{"conversation": "旧对话 A", "role": "user", "content": "a1"},
+             {"conversation": "旧对话 A", "role": "assistant", "content": "a2"},
+             {"conversation": "旧对话 B", "role": "user", "content": "b1"}]
+    filename.write_text("".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines) + "{不完整",
+                        encoding="utf-8")
+    assert read_archive(str(filename)) == [("旧对话 A", ["a1", "a2"]), ("旧对话 B", ["b1"])]
+
+
+def test_partially_read_conversation_is_skipped(tmp_path):
+    filename = str(tmp_path / "archive.jsonl")
+    for title, messages in (("一", FIRST), ("二", SECOND), ("三", FIRST)):
+        append_to_archive(messages, title=title, filename=filename)
+    titles = []
+    for title, messages in iter_archive(filename):
+        titles.append(title)
+        if title == "一":
+            next(iter(messages))
+    assert titles == ["一", "二", "三"]
+
+
+def export(tmp_path, extension):
+    filename = str(tmp_path / f"chat{extension}")
+    count = ChatExporter().export(filename, [("对话一", FIRST), ("<对话二>", SECOND)])
+    assert count == 4
+    assert not (tmp_path / f"chat{extension}.part").exists()
+    with open(filename, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def test_jsonl_writer_outputs_one_conversation_per_line(tmp_path):
+    lines = export(tmp_path, ".jsonl").splitlines()
+    assert [json.loads(line) for line in lines] == [{"messages": FIRST}, {"messages": SECOND}]
+
+
+def test_html_writer_escapes_content(tmp_path):
+    text = export(tmp_path, ".html")
+    assert "&lt;b&gt;回答二&lt;/b&gt; &amp; 更多" in text
+    assert "<h1>&lt;对话二&gt;</h1>" in text
+    assert text.rstrip().endswith("</body></html>")
+
+
+def test_text_and_markdown_writers(tmp_path):
+    assert export(tmp_path, ".txt").startswith("您:\n问题一\n\nAI:\n回答一\n\n")
+    markdown = export(tmp_path, ".md")
+    assert markdown.startswith("# 对话一\n\n**您:**\n\n问题一\n\n")
+    assert markdown.count("---") == 2
+
+
+def test_failed_export_removes_partial_file(tmp_path):
+    def broken():
+        yield {"role": "user", "content": "写到一半"}
+        raise OSError("读取失败")
+
+    filename = tmp_path / "chat.md"
+    with pytest.raises(OSError):
+        ChatExporter().export(str(filename), [("对话", broken())])
+    assert not filename.exists()
+    assert not (tmp_path / "chat.md.part").exists()
+
+
+def test_unknown_extension_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ChatExporter().export(str(tmp_path / "chat.pdf"), [("对话", FIRST)])
@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from deadlines import (DEADLINE_MAX, DEADLINE_MIN, Deadline, StreamMonitor, ThroughputTracker,
+                       make_deadline)
+
+
+def test_deadline_grows_with_max_tokens():
+    tracker = ThroughputTracker()
+    deadline = make_deadline(tracker, {"model": "m", "max_tokens": 512})
+    # 默认 10 tokens/s、首字 5 秒：首包等待 20 秒，生成 51.2 秒乘安全系数 2
+    assert deadline.first_chunk == pytest.approx(20.0)
+    assert deadline.total == pytest.approx(20.0 + 102.4)
+    assert deadline.expected == pytest.approx(5.0 + 51.2)
+
+    tracker.observe("fast", ttft=1.0)
+    assert make_deadline(tracker, {"model": "fast", "max_tokens": 1}).total == DEADLINE_MIN
+
+
+def test_capped_deadline_still_allows_retries():
+    deadline = make_deadline(ThroughputTracker(), {"model": "m", "max_tokens": 16384})
+    assert deadline.total == DEADLINE_MAX
+    assert deadline.expected <= deadline.total / 2
+    assert deadline.can_retry(2)
+
+
+def test_can_retry_needs_backoff_and_expected_time():
+    deadline = Deadline(connect=5, first_chunk=10, idle=15, total=100, expected=40)
+    assert deadline.can_retry(8)
+    deadline.start -= 55
+    assert not deadline.can_retry(8)
+    assert deadline.request_timeout()[1] == pytest.approx(45, abs=1)
+
+
+def test_tracker_uses_moving_average():
+    tracker = ThroughputTracker(alpha=0.3)
+    assert tracker.estimate("m") == (tracker.default_tps, tracker.default_ttft)
+    tracker.observe("m", ttft=1.0, tokens=100, seconds=10)
+    tracker.observe("m", ttft=2.0, tokens=200, seconds=10)
+    tps, ttft = tracker.estimate("m")
+    assert ttft == pytest.approx(0.3 * 2.0 + 0.7 * 1.0)
+    assert tps == pytest.approx(0.3 * 20 + 0.7 * 10)
+    # 太短的回复和没有模型名的请求不计入
+    tracker.observe("m", tokens=4, seconds=0.01)
+    tracker.observe("", ttft=100)
+    assert tracker.estimate("m") == (tps, ttft)
+
+    restored = ThroughputTracker()
+    restored.load(tracker.state())
+    assert restored.estimate("m") == (tps, ttft)
+
+
+class FakeResponse:
+    raw = None
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_monitor_expires_when_first_chunk_is_late():
+    monitor = StreamMonitor(interval=0.01)
+    response = FakeResponse()
+    watch = monitor.watch(response, first_chunk=0.05, idle=5)
+    assert wait_for(lambda: response.closed)
+    assert "第一个数据块" in watch.expired
+
+
+def test_monitor_keeps_streams_that_make_progress():
+    monitor = StreamMonitor(interval=0.01)
+    response = FakeResponse()
+    watch = monitor.watch(response, first_chunk=5, idle=0.1)
+    watch.touch()
+    for _ in range(20):
+        time.sleep(0.02)
+        watch.touch()
+    assert not response.closed and watch.expired is None
+
+    assert wait_for(lambda: response.closed)
+    assert "新的数据块" in watch.expired
+    assert wait_for(lambda: monitor.thread is None)
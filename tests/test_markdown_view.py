@@ -0,0 +1,42 @@
+from markdown_view import split_blocks
+
+SAMPLE = """# 标题
+
+第一段文字，包含 **加粗** 和 `代码`。
+第一段的第二行。
+
+- 列表项一
+  续行
+- 列表项二
+
+```python
+def f():
+
+    return 1
+```
+
+> 引用的内容
+> 第二行
+
+| 名称 | 数值 |
+| --- | --- |
+| a | 1 |
+
+---
+
+最后一段
+"""
+
+
+def test_blocks_cover_the_whole_text():
+    assert "".join(split_blocks(SAMPLE)) == SAMPLE
+    assert split_blocks(SAMPLE)[0] == "# 标题\n\n"
+
+
+def test_appending_text_only_changes_the_last_block():
+    full = split_blocks(SAMPLE)
+    for length in range(len(SAMPLE) + 1):
+        blocks = split_blocks(SAMPLE[:length])
+        # 除最后一个（仍在接收中的）块外，流式渲染的块与完整文本的块一致
+        stable = max(len(blocks) - 1, 0)
+        assert blocks[:stable] == full[:stable], length
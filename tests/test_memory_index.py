@@ -0,0 +1,120 @@
+import time
+
+import pytest
+
+from memory_index import APIEmbedder, ConversationMemory, EmbeddingError, HashEmbedder, VectorIndex
+
+
+class FlakyEmbedder(HashEmbedder):
+    """前 failures 次调用失败的本地嵌入器"""
+    name = "flaky"
+
+    def __init__(self, failures, retryable=True):
+        super().__init__()
+        self.failures = failures
+        self.retryable = retryable
+        self.calls = 0
+
+    def embed(self, texts):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise EmbeddingError("embedding service unavailable", self.retryable)
+        return super().embed(texts)
+
+
+class StubClient:
+    """总是返回同一个响应的客户端"""
+
+    def __init__(self, response):
+        self.response = response
+
+    def make_request(self, endpoint, data):
+        return self.response
+
+
+def wait_indexed(memory, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if memory.index is not None and len(memory.index) == count:
+            return
+        time.sleep(0.01)
+    raise AssertionError("索引没有按时完成")
+
+
+MESSAGES = [
+    {"role": "user", "content": "how do I bake an apple pie"},
+    {"role": "assistant", "content": "use apples, butter and flour"},
+    {"role": "user", "content": "what is the capital of france"},
+    {"role": "assistant", "content": "paris is the capital"},
+]
+
+
+def test_vector_index_respects_candidates():
+    embedder = HashEmbedder()
+    index = VectorIndex(embedder.dim)
+    index.add([0, 1, 2], embedder.embed(["apple pie", "apple tart", "paris"]))
+    query = embedder.embed(["apple pie"])
+    assert index.search(query, 1)[0][0][0] == 0
+    assert [i for i, _ in index.search(query, 3, candidates=[1, 2])[0]] == [1, 2]
+
+
+def test_recall_offline_with_hash_embedder():
+    memory = ConversationMemory(HashEmbedder())
+    memory.sync(MESSAGES)
+    wait_indexed(memory, len(MESSAGES))
+    hits = memory.recall("apple pie recipe", k=1)
+    assert hits[0][0] == 0
+    assert memory.recall("capital of france", k=1, candidates=[2, 3])[0][0] in (2, 3)
+
+
+def test_failed_batch_is_retried(monkeypatch):
+    real_sleep = time.sleep
+    monkeypatch.setattr(time, "sleep", lambda seconds: real_sleep(0.01))
+    memory = ConversationMemory(FlakyEmbedder(failures=2))
+    memory.sync(MESSAGES)
+    wait_indexed(memory, len(MESSAGES))
+
+
+def test_save_after_reset_removes_stale_file(tmp_path):
+    filename = str(tmp_path / "memory.npz")
+    memory = ConversationMemory(HashEmbedder())
+    memory.sync(MESSAGES)
+    wait_indexed(memory, len(MESSAGES))
+    assert memory.save(filename)
+
+    memory.reset()
+    assert memory.save(filename)
+    assert not (tmp_path / "memory.npz").exists()
+    assert not ConversationMemory(HashEmbedder()).load(filename)
+
+
+def test_permanent_error_parks_batch_until_retry():
+    embedder = FlakyEmbedder(failures=1, retryable=False)
+    memory = ConversationMemory(embedder, batch_size=len(MESSAGES))
+    memory.sync(MESSAGES)
+    deadline = time.monotonic() + 5
+    while len(memory.parked) < len(MESSAGES) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert memory.paused and len(memory.parked) == len(MESSAGES)
+    # 暂停期间新消息直接暂存，不再请求
+    memory.sync(MESSAGES + [{"role": "user", "content": "another question"}])
+    deadline = time.monotonic() + 5
+    while len(memory.parked) < len(MESSAGES) + 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert embedder.calls == 1
+    assert memory.recall("apple pie") == []
+
+    memory.retry_parked()
+    wait_indexed(memory, len(MESSAGES) + 1)
+    assert memory.paused is None
+
+
+@pytest.mark.parametrize("status, retryable", [(None, True), (503, True), (429, True), (401, False), (404, False)])
+def test_api_embedder_marks_client_errors_as_permanent(status, retryable):
+    response = {"error": "failed"}
+    if status is not None:
+        response["status"] = status
+    with pytest.raises(EmbeddingError) as info:
+        APIEmbedder(StubClient(response)).embed(["text"])
+    assert info.value.retryable is retryable
@@ -0,0 +1,92 @@
+import threading
+
+from message_queue import MessageQueue
+
+
+def texts(queue):
+    return [item.text for item in queue.items]
+
+
+def test_add_move_remove_pop_keep_order():
+    queue = MessageQueue()
+    for text in ("一", "二", "三", "四"):
+        queue.add(text)
+    assert queue.move(3, -2) == 1
+    assert texts(queue) == ["一", "四", "二", "三"]
+    # 越界的移动停在两端
+    assert queue.move(0, -1) == 0
+    assert queue.move(2, 5) == 3
+    assert texts(queue) == ["一", "四", "三", "二"]
+
+    queue.remove(1)
+    assert texts(queue) == ["一", "三", "二"]
+    assert queue.pop().text == "一"
+    assert len(queue) == 2 and queue[0].text == "三"
+
+
+def test_label_shows_state_of_independent_messages():
+    queue = MessageQueue()
+    assert queue.add("依赖上下文").label() == "依赖上下文"
+    item = queue.add("独立问题", independent=True)
+    assert item.label() == "[并行·排队] 独立问题"
+    item.state = "done"
+    assert item.label() == "[并行·已完成] 独立问题"
+
+
+def prefetch_and_wait(queue, item, request):
+    done = threading.Event()
+
+    def on_done(item):
+        if item.state in ("done", "failed"):
+            done.set()
+
+    queue.prefetch(item, request, on_done)
+    return done
+
+
+def test_prefetch_stores_response():
+    queue = MessageQueue()
+    item = queue.add("问题", independent=True)
+    assert prefetch_and_wait(queue, item, lambda text: {"content": text + "的回答"}).wait(5)
+    assert item.state == "done"
+    assert item.response == {"content": "问题的回答"}
+
+    failing = queue.add("会失败的问题", independent=True)
+
+    def request(text):
+        raise RuntimeError("网络错误")
+
+    assert prefetch_and_wait(queue, failing, request).wait(5)
+    assert failing.state == "failed"
+    assert "网络错误" in failing.response["error"]
+
+
+def prefetch_thread(queue, item, request):
+    """启动预取并返回它的后台线程"""
+    before = set(threading.enumerate())
+    queue.prefetch(item, request, lambda item: None)
+    return (set(threading.enumerate()) - before).pop()
+
+
+def test_edited_or_removed_message_discards_stale_response():
+    queue = MessageQueue()
+    started = threading.Semaphore(0)
+    release = threading.Event()
+
+    def request(text):
+        started.release()
+        release.wait(5)
+        return {"content": text}
+
+    edited = queue.add("旧问题", independent=True)
+    removed = queue.add("被删除的问题", independent=True)
+    threads = [prefetch_thread(queue, edited, request), prefetch_thread(queue, removed, request)]
+    assert started.acquire(timeout=5) and started.acquire(timeout=5)
+    # 请求进行中时编辑或删除消息，旧请求的结果不再写入
+    edited.reset("新问题")
+    queue.remove(1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert edited.state == "queued" and edited.response is None
+    assert removed.response is None
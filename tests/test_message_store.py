@@ -0,0 +1,105 @@
+import pickle
+
+import pytest
+
+from message_store import MessageStore, ConversationTree, NodeTextStore
+
+
+def make_messages(count):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"消息 {i}"} for i in range(count)]
+
+
+def test_spill_keeps_only_hot_messages_in_memory():
+    messages = make_messages(10)
+    store = MessageStore(messages, hot_limit=3)
+    assert list(store) == messages
+    assert store.memory_usage() == sum(len(m["content"]) for m in messages[-3:])
+    # 转存到磁盘的消息按需读回
+    assert store[0] == messages[0]
+    assert store[2:4] == messages[2:4]
+
+
+def test_snapshot_is_not_affected_by_later_changes():
+    store = MessageStore(make_messages(5), hot_limit=2)
+    snapshot = store.snapshot()
+    store.clear()
+    store.append({"role": "user", "content": "新对话"})
+    assert list(snapshot) == make_messages(5)
+
+
+def test_pickle_round_trip_restores_messages_and_hot_limit():
+    messages = make_messages(8)
+    store = MessageStore(messages, hot_limit=2)
+    restored = pickle.loads(pickle.dumps(store))
+    assert list(restored) == messages
+    assert restored.hot_limit == 2
+    assert restored.memory_usage() == store.memory_usage()
+
+
+def test_tree_reuses_identical_child():
+    tree = ConversationTree(make_messages(2))
+    tree.truncate(1)
+    node_id = tree.append({"role": "assistant", "content": "消息 1"})
+    assert node_id == 1
+    assert len(tree.nodes) == 2
+    assert tree.branch_position(1) == (1, 1)
+
+
+def test_fork_and_switch_between_branches():
+    tree = ConversationTree(make_messages(4))
+    first_branch = tree.node_ids()
+    new_id = tree.fork(2, {"role": "user", "content": "改写的问题"})
+    tree.append({"role": "assistant", "content": "新的回答"})
+    assert len(tree) == 4
+    assert tree.siblings(2) == [first_branch[2], new_id]
+    assert tree.branch_position(2) == (2, 2)
+    assert ConversationTree.common_prefix(first_branch, tree.node_ids()) == 2
+
+    # 切回原分支时沿最近使用的子节点走到原来的叶子
+    tree.switch(2, first_branch[2])
+    assert tree.node_ids() == first_branch
+    assert list(tree) == make_messages(4)
+    tree.switch(2, new_id)
+    assert tree[3] == {"role": "assistant", "content": "新的回答"}
+
+
+def test_switch_rejects_non_sibling():
+    tree = ConversationTree(make_messages(3))
+    with pytest.raises(ValueError):
+        tree.switch(1, tree.node_id(2))
+
+
+def test_tree_pickle_round_trip_keeps_branches():
+    tree = ConversationTree(make_messages(4), hot_limit=2)
+    tree.fork(1, {"role": "assistant", "content": "另一个回答"})
+    restored = pickle.loads(pickle.dumps(tree))
+    assert restored.node_ids() == tree.node_ids()
+    assert list(restored) == list(tree)
+    restored.switch(1, 1)
+    assert list(restored) == make_messages(4)
+
+
+def test_node_text_store_spills_old_texts():
+    store = NodeTextStore(hot_limit=2)
+    for node_id in range(1, 12, 2):
+        store[node_id] = f"思考过程 {node_id} " * 50
+    assert store.memory_usage() == len(store[9]) + len(store[11])
+    assert store[1] == "思考过程 1 " * 50
+    assert store.get(2, "") == ""
+    assert sorted(store) == [1, 3, 5, 7, 9, 11]
+
+    store[1] = "改写后的思考过程"
+    assert store[1] == "改写后的思考过程"
+    assert len(store) == 6
+
+
+def test_node_text_store_pickle_and_copy():
+    store = NodeTextStore({1: "第一段", 3: "第二段"}, hot_limit=1)
+    copy = store.copy()
+    store[5] = "第三段"
+    store.clear()
+    assert dict(copy) == {1: "第一段", 3: "第二段"}
+
+    restored = pickle.loads(pickle.dumps(copy))
+    assert restored == {1: "第一段", 3: "第二段"}
+    assert restored.memory_usage() == len("第二段")
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from profiling import Profiler
+
+
+class Worker:
+    def compute(self, n):
+        return sum(i * i for i in range(n))
+
+    def render(self):
+        return self.compute(10)
+
+
+@pytest.fixture
+def profiler(tmp_path):
+    profiler = Profiler(output_dir=str(tmp_path))
+    yield profiler
+    if profiler.enabled:
+        profiler.stop()
+
+
+def test_uninstrument_restores_original_methods(profiler):
+    worker = Worker()
+    profiler.start()
+    profiler.instrument(worker, ["compute", "render"])
+    assert "compute" in worker.__dict__
+    assert worker.render() == Worker().render()
+
+    profiler.stop()
+    assert "compute" not in worker.__dict__ and "render" not in worker.__dict__
+    assert worker.compute.__func__ is Worker.compute
+
+
+def test_frequent_spans_are_written_once_per_name(profiler):
+    worker = Worker()
+    profiler.start()
+    profiler.instrument(worker, ["compute", "render"])
+    for _ in range(50):
+        worker.render()
+    worker.compute(100)
+    summary = profiler.stop()
+
+    assert len(profiler.spans["Worker.render"]) == 50
+    # 嵌套在 render 中的 compute 只记录耗时
+    assert len(profiler.spans["Worker.compute"]) == 51
+    files = sorted(os.listdir(profiler.session_dir))
+    assert [name for name in files if name.endswith(".prof")] == [
+        "Worker.compute.prof", "Worker.render.prof", "session.prof"]
+    with open(summary, "r", encoding="utf-8") as f:
+        text = f.read()
+    assert "Worker.render" in text and "CPU 热点" in text
+
+
+def test_session_mode_writes_only_the_summary(tmp_path):
+    profiler = Profiler(output_dir=str(tmp_path), mode="session")
+    worker = Worker()
+    profiler.start()
+    profiler.instrument(worker, ["compute"])
+    worker.compute(10)
+    profiler.stop()
+    assert [name for name in os.listdir(profiler.session_dir) if name.endswith(".prof")] == ["session.prof"]
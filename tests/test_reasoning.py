@@ -0,0 +1,36 @@
+import pytest
+
+from reasoning import ThinkTagSplitter, split_think_tags
+
+TEXTS = [
+    "<think>先想一想。\n再确认一次。</think>\n\n这是回答。",
+    "  \n<think>前面有空白</think>回答",
+    "没有思考标签的回答，<think> 出现在中间时保留在正文中。",
+    "<think>只有思考过程</think>",
+    "<thi",
+    "",
+]
+
+
+def feed_in_chunks(text, size):
+    splitter = ThinkTagSplitter()
+    reasoning = content = ""
+    for start in range(0, len(text), size):
+        r, c = splitter.feed(text[start:start + size])
+        reasoning += r
+        content += c
+    r, c = splitter.flush()
+    return reasoning + r, content + c
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_chunk_size_does_not_change_the_result(text):
+    expected = split_think_tags(text)
+    for size in range(1, len(text) + 1):
+        assert feed_in_chunks(text, size) == expected, size
+
+
+def test_split_think_tags():
+    assert split_think_tags(TEXTS[0]) == ("先想一想。\n再确认一次。", "这是回答。")
+    assert split_think_tags(TEXTS[1]) == ("前面有空白", "回答")
+    assert split_think_tags(TEXTS[2]) == ("", TEXTS[2])
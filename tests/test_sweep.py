@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from backends import LocalServerBackend
+from sweep import ParameterSweep, expand_grid, parse_values
+
+
+def run_sweep(client, results_file, prompts=("问题一", "问题二"), grid=None):
+    grid = grid or {"temperature": [0.2, 0.8]}
+    sweep = ParameterSweep(client, list(prompts), grid, client.parameters, results_file=results_file,
+                           requests_per_minute=6000)
+    sweep.start()
+    sweep.thread.join(10)
+    assert not sweep.running
+    return sweep
+
+
+def count_lines(filename):
+    with open(filename, "r", encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+
+def test_parse_values_and_expand_grid():
+    assert parse_values("temperature", "0.2, 0.8，0.2") == [0.2, 0.8]
+    assert parse_values("max_tokens", "256,,512") == [256, 512]
+    with pytest.raises(ValueError):
+        parse_values("max_tokens", "abc")
+    grid = {"max_tokens": [1, 2], "model": ["a"], "top_p": []}
+    # 按 SWEEP_PARAMS 的顺序展开，没有取值的参数不参与
+    assert expand_grid(grid) == [{"model": "a", "max_tokens": 1}, {"model": "a", "max_tokens": 2}]
+
+
+def test_second_run_reuses_results(client, tmp_path):
+    results_file = str(tmp_path / "sweep.jsonl")
+    first = run_sweep(client, results_file)
+    assert first.completed == 4 and first.cached == 0 and first.failed == 0
+    assert count_lines(results_file) == 4
+
+    second = run_sweep(client, results_file)
+    assert second.completed == 4 and second.cached == 4
+    assert count_lines(results_file) == 4
+
+    # 扩大网格后只运行新增的组合
+    third = run_sweep(client, results_file, grid={"temperature": [0.2, 0.8, 1.0]})
+    assert third.cached == 4
+    assert count_lines(results_file) == 6
+
+
+def test_duplicate_prompts_run_once(client, tmp_path):
+    sweep = run_sweep(client, str(tmp_path / "sweep.jsonl"), prompts=("问题", "问题"))
+    assert len(sweep.cells) == 2
+
+
+def test_results_are_not_shared_between_backends(client, tmp_path):
+    results_file = str(tmp_path / "sweep.jsonl")
+    run_sweep(client, results_file)
+
+    # 同一模型改由本地服务处理；本地后端的回复仍由模拟后端生成，不产生网络请求
+    local = LocalServerBackend("http://127.0.0.1:8000/v1")
+    local.stream = client.fake_backend.stream
+    client.backend_for = lambda model=None: local
+    sweep = run_sweep(client, results_file)
+    assert sweep.cached == 0
+    with open(results_file, "r", encoding="utf-8") as f:
+        backends = {json.loads(line)["backend"] for line in f}
+    assert backends == {"fake:", "local:http://127.0.0.1:8000/v1"}
@@ -0,0 +1,89 @@
+import sys
+import time
+import threading
+import traceback
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+
+class UIWatchdog:
+    """Tk 事件循环卡顿检测
+
+    主线程每隔 interval 秒通过 root.after 更新一次心跳，后台线程检查心跳，
+    超过 threshold 秒没有更新时记录一次卡顿，并抓取主线程当时的调用栈。
+    心跳实际触发时间与预期时间之差即事件循环延迟，用作响应度指标。
+    """
+
+    def __init__(self, root, threshold: float = 0.25, interval: float = 0.05,
+                 history: int = 200):
+        self.root = root
+        self.threshold = threshold
+        self.interval = interval
+        self.main_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.expected = self.last_beat + interval
+        self.latencies: "deque[float]" = deque(maxlen=history)
+        self.stalls: "deque[Dict[str, Any]]" = deque(maxlen=50)
+        self.running = False
+        self.in_stall = False
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.last_beat = time.monotonic()
+        self.expected = self.last_beat + self.interval
+        self.root.after(int(self.interval * 1000), self._beat)
+        self.thread = threading.Thread(target=self._watch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _beat(self):
+        if not self.running:
+            return
+        now = time.monotonic()
+        self.latencies.append(max(0.0, now - self.expected))
+        self.last_beat = now
+        self.expected = now + self.interval
+        self.root.after(int(self.interval * 1000), self._beat)
+
+    def _watch(self):
+        while self.running:
+            time.sleep(self.interval)
+            blocked = time.monotonic() - self.last_beat - self.interval
+            if blocked > self.threshold:
+                if not self.in_stall:
+                    # 每次卡顿只在超过阈值时抓取一次调用栈
+                    self.in_stall = True
+                    self._record_stall(blocked)
+                else:
+                    self.stalls[-1]["duration"] = blocked
+            elif self.in_stall:
+                self.in_stall = False
+                stall = self.stalls[-1]
+                print(f"界面卡顿结束，持续约 {stall['duration'] * 1000:.0f} ms")
+
+    def _record_stall(self, blocked: float):
+        frame = sys._current_frames().get(self.main_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame else "(无法获取主线程调用栈)"
+        self.stalls.append({"time": time.time(), "duration": blocked, "stack": stack})
+        print(f"检测到界面卡顿 (已阻塞 {blocked * 1000:.0f} ms)，主线程调用栈:\n{stack}")
+
+    def metrics(self) -> Dict[str, float]:
+        """返回最近心跳延迟的统计 (毫秒)"""
+        samples = sorted(self.latencies)
+        if not samples:
+            return {"p50": 0.0, "p95": 0.0, "max": 0.0, "stalls": len(self.stalls)}
+        return {
+            "p50": samples[len(samples) // 2] * 1000,
+            "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+            "max": samples[-1] * 1000,
+            "stalls": len(self.stalls),
+        }
+
+    def recent_stalls(self) -> List[Dict[str, Any]]:
+        return list(self.stalls)